@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+"""
+Cloudflare异步客户端 - 面向批量任务提交
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from typing import List, Dict, Optional, Any
+
+try:
+    import httpx  # 异步客户端依赖：pip install httpx（HTTP/2 另需 httpx[http2]）
+except ImportError:
+    httpx = None
+
+from cloudflare_client import CLIENT_VERSION, MAX_URLS_PER_TASK, load_device_id
+
+class AsyncCloudflareClient:
+    """Cloudflare异步客户端 - 单事件循环，限制并发数"""
+
+    def __init__(self, api_url: str = "https://xuke.ambition.qzz.io",
+                 max_concurrency: int = 100, timeout: float = 10, http2: bool = False):
+        if httpx is None:
+            raise ImportError("异步客户端需要安装 httpx：pip install httpx")
+
+        self.api_url = api_url.rstrip('/')
+
+        # 用户状态
+        self.user_id: Optional[str] = None
+        self.username: Optional[str] = None
+        self.email: Optional[str] = None
+        self.user_info: Optional[Dict] = None
+        self.license_info: Optional[Dict] = None
+
+        self.authenticated = False
+        self.license_valid = False
+
+        # 任务管理
+        self.tasks: Dict[str, Dict] = {}
+
+        # 回调函数
+        self.status_callbacks: List[Any] = []
+        self.error_callbacks: List[Any] = []
+
+        # 并发控制：信号量限制同时在途的请求数，连接池与之保持一致
+        self.max_concurrency = max_concurrency
+        self.max_rate_limit_retries = 3
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.device_id = load_device_id()
+        self.logger = logging.getLogger("CloudflareAsyncClient")
+
+        # HTTP/2 下所有请求在少量连接上多路复用，需要安装 httpx[http2]
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                self.logger.warning("HTTP/2 不可用（需要安装 httpx[http2]），使用 HTTP/1.1")
+                http2 = False
+
+        self.client = httpx.AsyncClient(
+            base_url=self.api_url,
+            timeout=timeout,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency
+            ),
+            headers={
+                'User-Agent': 'XuekeDownloadClient/1.0',
+                'Content-Type': 'application/json',
+                'X-Client-Version': CLIENT_VERSION,
+                'X-Device-ID': self.device_id
+            }
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """关闭连接池"""
+        await self.client.aclose()
+
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """在并发限制内发送请求；被服务器限流（429）时按 Retry-After 等待后重试
+
+        只有限流配额耗尽（X-RateLimit-Remaining 为0）的429才重试；配额仍有剩余的429
+        （如任务数超限的准入拒绝）直接返回给调用方。
+        """
+        for attempt in range(self.max_rate_limit_retries + 1):
+            async with self._semaphore:
+                response = await self.client.request(method, path, **kwargs)
+
+            retry_after = response.headers.get("Retry-After", "")
+            rate_limited = (response.status_code == 429
+                            and response.headers.get("X-RateLimit-Remaining", "0") == "0")
+            if not rate_limited or not retry_after.isdigit() or attempt == self.max_rate_limit_retries:
+                return response
+
+            # 在信号量外等待，不占用并发名额
+            await asyncio.sleep(int(retry_after))
+
+    async def connect(self) -> bool:
+        """测试服务器连接"""
+        try:
+            response = await self._request("GET", "/api/ping", timeout=5)
+            return response.status_code == 200
+        except Exception as e:
+            self.logger.error(f"连接测试失败: {e}")
+            self._notify_error(e)
+            return False
+
+    async def login(self, username: str, password: str) -> bool:
+        """登录到服务器"""
+        if not username or not password:
+            self._notify_error(Exception("用户名和密码不能为空"))
+            return False
+
+        try:
+            response = await self._request("POST", "/api/auth/login", json={
+                'username': username,
+                'password': hashlib.sha256(password.encode()).hexdigest(),
+                'device_id': self.device_id
+            })
+
+            if response.status_code == 200:
+                data = response.json()
+
+                if data.get('success'):
+                    self.authenticated = True
+                    self.user_id = data.get('user_id')
+                    self.username = username
+                    self.client.headers['X-User-ID'] = self.user_id
+                    self.user_info = data.get('user_info', {})
+                    self.email = self.user_info.get('email', '')
+
+                    # 登录响应中已包含有效许可证时直接可用
+                    if self.user_info.get('license_valid'):
+                        self.license_valid = True
+                        self.license_info = self.user_info.get('license_info', {})
+
+                    self._notify_status("login_success", self.user_info)
+                    self.logger.info(f"登录成功: {username}")
+                    return True
+                else:
+                    error = data.get('error', '登录失败')
+                    self._notify_status("login_failed", {"error": error})
+                    self.logger.error(f"登录失败: {error}")
+                    return False
+            else:
+                self._notify_error(Exception(f"登录请求失败: {response.status_code}"))
+                return False
+
+        except Exception as e:
+            self.logger.error(f"登录异常: {e}")
+            self._notify_error(e)
+            return False
+
+    async def validate_license(self, license_key: str) -> bool:
+        """验证激活码"""
+        if not self.authenticated:
+            self._notify_error(Exception("请先登录"))
+            return False
+
+        if not license_key:
+            self._notify_error(Exception("激活码不能为空"))
+            return False
+
+        try:
+            response = await self._request("POST", "/api/license/validate", json={
+                'license_key': license_key,
+                'device_id': self.device_id,
+                'user_id': self.user_id
+            })
+
+            if response.status_code == 200:
+                data = response.json()
+
+                if data.get('valid'):
+                    self.license_valid = True
+                    self.license_info = data.get('license_info', {})
+
+                    self._notify_status("license_valid", self.license_info)
+                    self.logger.info("激活码验证成功")
+                    return True
+                else:
+                    error = data.get('error', '激活码无效')
+                    self._notify_status("license_invalid", {"error": error})
+                    self.logger.error(f"激活码验证失败: {error}")
+                    return False
+            else:
+                self._notify_error(Exception(f"验证请求失败: {response.status_code}"))
+                return False
+
+        except Exception as e:
+            self.logger.error(f"验证激活码异常: {e}")
+            self._notify_error(e)
+            return False
+
+    async def submit_download_task(self, urls: List[str], email: str) -> Optional[str]:
+        """提交下载任务（异步客户端不做离线排队）"""
+        if not urls:
+            self._notify_error(Exception("下载链接不能为空"))
+            return None
+
+        if not email:
+            self._notify_error(Exception("邮箱不能为空"))
+            return None
+
+        if not (self.authenticated and self.license_valid):
+            self._notify_error(Exception("请先登录并验证激活码"))
+            return None
+
+        try:
+            response = await self._request("POST", "/api/tasks", json={
+                'user_id': self.user_id,
+                'urls': urls,
+                'email': email,
+                'submitted_by': self.username
+            })
+
+            if response.status_code == 200:
+                data = response.json()
+
+                if data.get('success'):
+                    server_task = data['task']
+                    task_id = server_task['task_id']
+                    self.tasks[task_id] = server_task
+
+                    self._notify_status("task_submitted", {
+                        "task_id": task_id,
+                        "url_count": len(urls),
+                        "email": email
+                    })
+
+                    self.logger.info(f"任务提交成功: {task_id}")
+                    return task_id
+
+            return None
+
+        except Exception as e:
+            self.logger.error(f"提交任务失败: {e}")
+            self._notify_error(e)
+            return None
+
+    async def submit_many(self, urls: List[str], email: str,
+                          chunk_size: int = MAX_URLS_PER_TASK) -> Dict:
+        """批量提交：按服务器限制切分URL，所有分块同时提交，在途请求数由信号量限制
+
+        返回格式与 CloudflareClientCore.submit_many 相同：
+        {"chunks": {序号: {"task_id", "error", "url_count", "elapsed"}}, "submitted", "failed", "elapsed"}
+        """
+        chunk_size = max(1, min(chunk_size, MAX_URLS_PER_TASK))
+        chunks = [urls[i:i + chunk_size] for i in range(0, len(urls), chunk_size)]
+        started = time.time()
+
+        async def submit_chunk(chunk: List[str]) -> Dict:
+            chunk_started = time.time()
+            task_id = await self.submit_download_task(chunk, email)
+            return {
+                "task_id": task_id,
+                "error": None if task_id else "任务提交失败",
+                "url_count": len(chunk),
+                "elapsed": time.time() - chunk_started
+            }
+
+        results = await asyncio.gather(*(submit_chunk(chunk) for chunk in chunks))
+        submitted = sum(1 for r in results if r["task_id"])
+        elapsed = time.time() - started
+        self.logger.info(f"批量提交完成: {submitted}/{len(chunks)} 个分块成功，耗时 {elapsed:.2f}s")
+
+        return {
+            "chunks": dict(enumerate(results)),
+            "submitted": submitted,
+            "failed": len(chunks) - submitted,
+            "elapsed": elapsed
+        }
+
+    async def get_task_info(self, task_id: str) -> Optional[Dict]:
+        """获取任务信息"""
+        try:
+            response = await self._request("GET", f"/api/tasks/{task_id}")
+            if response.status_code == 200:
+                task = response.json()
+                self.tasks[task_id] = task
+                return task
+        except Exception as e:
+            self.logger.error(f"获取任务信息失败: {e}")
+
+        return self.tasks.get(task_id)
+
+    async def get_download_links(self, task_id: str) -> List[str]:
+        """获取下载链接"""
+        try:
+            response = await self._request("GET", f"/api/tasks/{task_id}/download")
+            if response.status_code == 200:
+                data = response.json()
+                return data.get('direct_links', [])
+        except Exception as e:
+            self.logger.error(f"获取下载链接失败: {e}")
+
+        return []
+
+    def _notify_status(self, status_type: str, data: Dict):
+        """通知状态更新"""
+        for callback in self.status_callbacks:
+            try:
+                callback(status_type, data)
+            except Exception as e:
+                self.logger.error(f"状态回调执行失败: {e}")
+
+    def _notify_error(self, error: Exception):
+        """通知错误"""
+        for callback in self.error_callbacks:
+            try:
+                callback(error)
+            except Exception as e:
+                self.logger.error(f"错误回调执行失败: {e}")
+
+    # 回调注册
+    def register_status_callback(self, callback):
+        """注册状态回调"""
+        if callback not in self.status_callbacks:
+            self.status_callbacks.append(callback)
+
+    def register_error_callback(self, callback):
+        """注册错误回调"""
+        if callback not in self.error_callbacks:
+            self.error_callbacks.append(callback)
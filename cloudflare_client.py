@@ -9,10 +9,47 @@ import hashlib
 import uuid
 import time
 import os
-from typing import List, Dict, Optional, Tuple, Any
-from datetime import datetime
+import random
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Optional, Tuple, Any, Iterator
 import threading
 import queue
+from cloudflare_downloader import TaskDownloader, extract_zip_stream
+from cloudflare_queue import OfflineTaskQueue
+from cloudflare_history import TaskHistoryStore, utc_isoformat
+from cloudflare_transport import mount_transport
+from cloudflare_metrics import ClientMetrics
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import msgpack  # 可选：服务器支持时用 MessagePack 代替 JSON
+except ImportError:
+    msgpack = None
+
+# 服务器限制：单个任务最多包含的URL数（与worker的MAX_URLS_PER_TASK一致）
+MAX_URLS_PER_TASK = 50
+
+# 服务器限制：单个批量请求最多包含的任务数（与worker的MAX_BATCH_SIZE一致）
+MAX_BATCH_SIZE = 100
+# 任务列表分页大小（服务器上限 200）
+TASK_PAGE_SIZE = 200
+
+# 仍需跟踪进度的任务状态（与worker的ACTIVE_TASK_STATUSES一致）
+ACTIVE_TASK_STATUSES = ("pending", "processing")
+
+# 可以安全重试的请求方法
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+# 值得重试的响应状态码
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# 客户端版本（服务器据此判断是否可以返回 MessagePack）
+CLIENT_VERSION = "2.1.0"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+# 轮询任务状态时只请求用到的字段（不含 urls 等大字段）
+TASK_POLL_FIELDS = "status,progress,created_at,started_at,completed_at,updated_at,downloaded_files,direct_links,error_message"
 
 # 消息协议类
 class Message:
@@ -54,6 +91,110 @@ class Message:
             "data": self.data
         }
 
+class ResponseCache:
+    """GET响应缓存：按条目设置过期时间，超出容量时淘汰最久未使用的条目"""
+    
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """获取条目（包括已过期的，用于条件请求）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+    
+    def put(self, key: str, data: Any, etag: Optional[str], ttl: Optional[float]):
+        """写入条目，ttl 为 None 表示永不过期"""
+        with self._lock:
+            self._entries[key] = {
+                "data": data,
+                "etag": etag,
+                "expires_at": None if ttl is None else time.time() + ttl
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def is_fresh(self, entry: Dict) -> bool:
+        """条目是否仍在有效期内"""
+        return entry["expires_at"] is None or entry["expires_at"] > time.time()
+    
+    def invalidate(self, prefix: str):
+        """删除键以 prefix 开头的条目"""
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """熔断器打开时直接拒绝的请求"""
+
+class CircuitBreaker:
+    """熔断器：连续失败达到阈值后在冷却期内拒绝请求，冷却结束后放行一个试探请求"""
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """当前是否允许发送请求"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.time() - self.opened_at >= self.reset_timeout:
+                # 冷却结束，只放行一个试探请求
+                self.state = "half_open"
+                return True
+            return False
+    
+    def retry_in(self) -> float:
+        """距离下一次试探还有多少秒"""
+        return max(0.0, self.opened_at + self.reset_timeout - time.time())
+    
+    def record_success(self):
+        """请求成功，关闭熔断器"""
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+    
+    def record_failure(self):
+        """请求失败，达到阈值或试探失败时打开熔断器"""
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.time()
+
+def load_device_id(device_file: str = "device_id.txt") -> str:
+    """读取本机设备ID，不存在时生成并保存"""
+    try:
+        if os.path.exists(device_file):
+            with open(device_file, 'r', encoding='utf-8') as f:
+                device_id = f.read().strip()
+                if device_id:
+                    return device_id
+        
+        # 生成新设备ID
+        device_id = str(uuid.uuid4())
+        with open(device_file, 'w', encoding='utf-8') as f:
+            f.write(device_id)
+        
+        return device_id
+    except:
+        return str(uuid.uuid4())
+
 class CloudflareClientCore:
     """Cloudflare客户端核心 - 连接到网站服务器"""
     
@@ -74,7 +215,17 @@ class CloudflareClientCore:
         
         # 任务管理
         self.tasks: Dict[str, Dict] = {}
-        self.pending_tasks: List[Dict] = []
+        
+        # 正在通过服务器推送跟踪的任务
+        self.streaming_tasks = set()
+        self._tasks_lock = threading.Lock()
+        
+        # 增量同步游标（服务器返回的最后更新时间）
+        self.tasks_cursor = ""
+        # 更新时间等于游标的任务 {task_id: updated_at}；服务器返回 >= 游标的任务，已处理过的版本跳过
+        self._tasks_at_cursor: Dict[str, str] = {}
+        # 本地历史上次同步到的任务更新时间
+        self.history_synced_at = ""
         
         # 回调函数
         self.status_callbacks: List[Any] = []
@@ -85,32 +236,70 @@ class CloudflareClientCore:
         self.config_file = "cloudflare_config.json"
         self.config = self._load_config()
         
+        # 响应缓存
+        self.cache = ResponseCache(self.config.get("cache", {}).get("max_entries", 256))
+        
+        # 离线任务队列（持久化，重启后继续提交）
+        queue_config = self.config.get("offline_queue", {})
+        self.pending_queue = OfflineTaskQueue(
+            queue_config.get("path", "pending_tasks.db"),
+            max_attempts=queue_config.get("max_attempts", 5),
+            lease_seconds=queue_config.get("lease_seconds", 300)
+        )
+        self._drain_lock = threading.Lock()
+        
+        # 本地任务历史
+        history_config = self.config.get("history", {})
+        self.history = TaskHistoryStore(
+            history_config.get("path", "download_history.db"),
+            max_entries=history_config.get("max_entries", 1000)
+        )
+        
+        # 熔断器
+        connection_config = self.config.get("connection", {})
+        self.breaker = CircuitBreaker(
+            connection_config.get("circuit_failure_threshold", 5),
+            connection_config.get("circuit_reset_timeout", 30)
+        )
+        
+        # 服务器限流提示的最早发送时间（所有线程共享）
+        self._throttle_until = 0.0
+        
         # 会话管理
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'XuekeDownloadClient/1.0',
             'Content-Type': 'application/json',
-            'X-Client-Version': '2.0.0'
+            'X-Client-Version': CLIENT_VERSION
         })
+        self.transport = mount_transport(self.session, connection_config)
+        
+        # 请求与任务指标
+        self.metrics = ClientMetrics()
+        
+        # 响应格式（连接时根据服务器声明的功能协商）
+        self.wire_format = "json"
         
         # 设备ID
         self.device_id = self._get_device_id()
+        self.session.headers['X-Device-ID'] = self.device_id
         
         # 日志
         self._setup_logging()
         self.logger = logging.getLogger("CloudflareClient")
         
-        # 心跳线程
-        self.heartbeat_active = True
-        self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
-        self.heartbeat_thread.start()
+        # 导入旧版 pending_tasks.json 和 download_history.json
+        self._load_pending_tasks()
+        self._load_history()
         
-        # 任务状态检查线程
-        self.status_check_active = True
-        self.status_thread = threading.Thread(target=self._status_check_loop, daemon=True)
-        self.status_thread.start()
+        # 调度线程（心跳 + 自适应任务状态轮询）
+        self.poll_interval = self._poll_bounds()[0]
+        self.scheduler_wakeup = threading.Event()
+        self.scheduler_active = True
+        self.scheduler_thread = threading.Thread(target=self._scheduler_loop, daemon=True)
+        self.scheduler_thread.start()
         
-        self.logger.info(f"Cloudflare客户端初始化完成，服务器: {api_url}")
+        self.logger.info(f"Cloudflare客户端初始化完成，服务器: {api_url}，传输: {self.transport}")
     
     def _setup_logging(self):
         """配置日志"""
@@ -142,8 +331,56 @@ class CloudflareClientCore:
             },
             "connection": {
                 "heartbeat_interval": 60,
-                "status_check_interval": 10,
-                "auto_reconnect": True
+                "status_check_interval": 10,  # 轮询退避的上限
+                "status_check_min_interval": 1,  # 提交任务后的首次轮询间隔
+                "poll_jitter": 0.2,  # 轮询间隔的随机抖动比例
+                "use_push": True,  # 任务提交后通过SSE接收状态推送
+                "max_push_streams": 4,  # 同时保持的推送连接上限
+                "auto_reconnect": True,
+                "request_timeout": 10,  # 未指定超时的请求使用的默认值
+                "max_retries": 3,
+                "retry_backoff": 0.5,  # 指数退避的初始间隔（秒）
+                "retry_backoff_max": 8,
+                "max_retry_after": 60,  # Retry-After 超过此值时不再等待
+                "circuit_failure_threshold": 5,  # 连续失败多少次后熔断
+                "circuit_reset_timeout": 30,  # 熔断后多久放行试探请求
+                "pool_connections": 4,  # 缓存的主机连接池数量
+                "pool_maxsize": 16,  # 每个主机保持的最大连接数（应不小于并发线程数）
+                "pool_block": False,  # 连接用尽时等待而不是临时新建
+                "keep_alive": True,
+                "keep_alive_idle": 60,  # TCP keep-alive 探测前的空闲秒数
+                "http2": False,  # 需要安装 httpx[http2]
+                "http2_max_connections": 4,
+                "msgpack": True  # 需要安装 msgpack，服务器支持时启用
+            },
+            "cache": {
+                "enabled": True,
+                "max_entries": 256,
+                # 各类接口的缓存秒数；已完成任务的详情和下载链接不会再变化，永久缓存
+                "ttl": {
+                    "task": 5,
+                    "task_list": 5,
+                    "download_links": 300,
+                    "stats": 30
+                }
+            },
+            "download": {
+                "directory": "downloads",
+                "max_workers": 4,
+                "chunk_size": 65536
+            },
+            "offline_queue": {
+                "path": "pending_tasks.db",
+                "max_attempts": 5,  # 超过后标记为失败，不再自动提交
+                "lease_seconds": 300,  # 提交中的任务在此时间后未确认则重新可见
+                "drain_workers": 4,
+                "drain_batches": 50,  # 单次清空队列最多取出的批次数（每批100条）
+                "retry_backoff": 5,  # 提交失败后重试间隔的初始值（秒），按失败次数翻倍
+                "retry_backoff_max": 300
+            },
+            "history": {
+                "path": "download_history.db",
+                "max_entries": 1000  # 本地保留的任务条数
             }
         }
         
@@ -167,22 +404,7 @@ class CloudflareClientCore:
     
     def _get_device_id(self) -> str:
         """获取设备ID"""
-        try:
-            device_file = "device_id.txt"
-            if os.path.exists(device_file):
-                with open(device_file, 'r', encoding='utf-8') as f:
-                    device_id = f.read().strip()
-                    if device_id:
-                        return device_id
-            
-            # 生成新设备ID
-            device_id = str(uuid.uuid4())
-            with open(device_file, 'w', encoding='utf-8') as f:
-                f.write(device_id)
-            
-            return device_id
-        except:
-            return str(uuid.uuid4())
+        return load_device_id()
     
     def save_config(self) -> bool:
         """保存配置"""
@@ -194,6 +416,172 @@ class CloudflareClientCore:
             self.logger.error(f"保存配置失败: {e}")
             return False
     
+    def _request(self, method: str, path: str, retry: bool = None, **kwargs) -> requests.Response:
+        """统一的请求入口：默认超时、带抖动的指数退避重试、遵守 Retry-After、熔断
+        
+        path 可以是 API 路径或完整URL。retry 默认只对幂等方法开启；非幂等请求
+        仅在连接超时（请求未发出）或服务器通过 Retry-After 明确要求时重试。
+        熔断器打开时抛出 CircuitOpenError。
+        """
+        connection = self.config.get("connection", {})
+        url = path if path.startswith(("http://", "https://")) else f"{self.api_url}{path}"
+        kwargs.setdefault("timeout", connection.get("request_timeout", 10))
+        if self.wire_format == "msgpack" and url.startswith(self.api_url):
+            headers = kwargs.get("headers") or {}
+            if "Accept" not in headers:
+                kwargs["headers"] = {**headers, "Accept": f"{MSGPACK_CONTENT_TYPE}, application/json;q=0.9"}
+        if retry is None:
+            retry = method.upper() in IDEMPOTENT_METHODS
+        max_retries = connection.get("max_retries", 3)
+        attempt = 0
+        # 指标按API路径统计，其他地址统一记为 external
+        metric_path = url[len(self.api_url):] if url.startswith(self.api_url) else "external"
+        
+        while True:
+            self._pace()
+            
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"服务器暂时不可用，{self.breaker.retry_in():.0f}秒后重试")
+            
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self.metrics.record_error(method, metric_path, e, time.perf_counter() - started)
+                self.breaker.record_failure()
+                if attempt >= max_retries or not (retry or isinstance(e, requests.exceptions.ConnectTimeout)):
+                    raise
+                delay = self._backoff(attempt)
+                self.logger.warning(f"请求失败，{delay:.1f}秒后重试 ({attempt + 1}/{max_retries}) {method} {url}: {e}")
+            else:
+                self._record_response(method, metric_path, response, time.perf_counter() - started,
+                                      stream=kwargs.get("stream", False))
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                self._update_rate_limit(response)
+                
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+                    return response
+                
+                retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
+                if not retry and retry_after is None:
+                    return response
+                
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                if delay > connection.get("max_retry_after", 60):
+                    return response
+                
+                response.close()
+                self.logger.warning(f"HTTP {response.status_code}，{delay:.1f}秒后重试 ({attempt + 1}/{max_retries}) {method} {url}")
+            
+            attempt += 1
+            self.metrics.record_retry(method, metric_path)
+            time.sleep(delay)
+    
+    def _record_response(self, method: str, path: str, response: requests.Response,
+                         elapsed: float, stream: bool = False):
+        """记录请求指标；流式响应的耗时只到收到响应头为止"""
+        request_body = response.request.body if response.request is not None else None
+        sent = len(request_body) if isinstance(request_body, (bytes, str)) else 0
+        
+        if stream:
+            received = int(response.headers.get("Content-Length") or 0)
+        else:
+            # urllib3 的 tell() 是实际读取的（压缩后）字节数；分块传输时不计数，改用解压后的长度
+            tell = getattr(response.raw, "tell", None)
+            received = (tell() if callable(tell) else 0) or len(response.content)
+        
+        self.metrics.record_request(
+            method, path, response.status_code, elapsed,
+            bytes_sent=sent, bytes_received=received,
+            server_timing=response.headers.get("Server-Timing")
+        )
+    
+    def get_metrics(self) -> Dict:
+        """客户端指标：各接口的请求数、流量、延迟分位数、重试和错误，任务端到端耗时"""
+        metrics = self.metrics.snapshot()
+        metrics["pending_tasks"] = self.pending_queue.count()
+        metrics["circuit_state"] = self.breaker.state
+        metrics["wire_format"] = self.wire_format
+        return metrics
+    
+    def get_metrics_prometheus(self) -> str:
+        """Prometheus 文本格式的客户端指标"""
+        return self.metrics.to_prometheus({
+            "cloudflare_client_pending_tasks": (self.pending_queue.count(), "离线队列中等待提交的任务数"),
+            "cloudflare_client_circuit_open": (int(self.breaker.state == "open"), "熔断器是否打开")
+        })
+    
+    def _decode(self, response: requests.Response) -> Any:
+        """解析响应体（JSON 或协商后的 MessagePack）"""
+        if response.headers.get("Content-Type", "").startswith(MSGPACK_CONTENT_TYPE):
+            return msgpack.unpackb(response.content, raw=False)
+        return response.json()
+    
+    def _negotiate_wire_format(self, server_info: Any):
+        """根据服务器声明的功能选择响应格式"""
+        features = server_info.get("features", []) if isinstance(server_info, dict) else []
+        self.wire_format = "json"
+        
+        if "msgpack" in features and self.config.get("connection", {}).get("msgpack", True):
+            if msgpack is None:
+                self.logger.info("未安装 msgpack，使用 JSON 响应格式")
+            else:
+                self.wire_format = "msgpack"
+    
+    def _pace(self):
+        """服务器提示配额将尽或已限流时，发送前先等待"""
+        wait = self._throttle_until - time.time()
+        if wait > 0:
+            time.sleep(min(wait, self.config.get("connection", {}).get("max_retry_after", 60)))
+    
+    def _update_rate_limit(self, response: requests.Response):
+        """根据限流响应头调整发送节奏"""
+        now = time.time()
+        throttle_until = self._throttle_until
+        
+        # 只有限流造成的429需要整体放慢；配额仍有剩余的429（如任务数超限）只影响该请求
+        if response.status_code == 429 and response.headers.get("X-RateLimit-Remaining", "0") == "0":
+            retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                throttle_until = max(throttle_until, now + retry_after)
+        
+        try:
+            limit = int(response.headers["X-RateLimit-Limit"])
+            remaining = int(response.headers["X-RateLimit-Remaining"])
+            reset = float(response.headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            limit = None
+        
+        # 剩余配额不足一成时，按令牌恢复速度均匀发送
+        if limit and remaining < max(1, limit * 0.1):
+            throttle_until = max(throttle_until, now + reset / max(1, limit - remaining))
+        
+        self._throttle_until = throttle_until
+    
+    def _backoff(self, attempt: int) -> float:
+        """第 attempt 次重试前的等待时间（full jitter）"""
+        connection = self.config.get("connection", {})
+        cap = min(connection.get("retry_backoff_max", 8),
+                  connection.get("retry_backoff", 0.5) * (2 ** attempt))
+        return random.uniform(0, cap)
+    
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """解析 Retry-After（秒数或HTTP日期）"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    
     def connect(self, url: str = None) -> bool:
         """连接到服务器（对于Cloudflare总是成功）"""
         try:
@@ -202,8 +590,9 @@ class CloudflareClientCore:
                 self.config["server"]["url"] = url
             
             # 测试连接
-            response = self.session.get(f"{self.api_url}/api/ping", timeout=5)
+            response = self._request("GET", "/api/ping", timeout=5)
             if response.status_code == 200:
+                self._negotiate_wire_format(self._decode(response))
                 self.connected = True
                 self._notify_status("connected", {"url": self.api_url})
                 self.logger.info(f"已连接到服务器 {self.api_url}")
@@ -230,8 +619,8 @@ class CloudflareClientCore:
                 return False
             
             # 发送登录请求
-            response = self.session.post(
-                f"{self.api_url}/api/auth/login",
+            response = self._request(
+                "POST", "/api/auth/login",
                 json={
                     'username': username,
                     'password': hashlib.sha256(password.encode()).hexdigest(),
@@ -241,13 +630,17 @@ class CloudflareClientCore:
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = self._decode(response)
                 
                 if data.get('success'):
                     # 更新用户信息
                     self.authenticated = True
                     self.user_id = data.get('user_id')
                     self.username = username
+                    self.tasks_cursor = ""
+                    self._tasks_at_cursor = {}
+                    self.history_synced_at = ""
+                    self.session.headers['X-User-ID'] = self.user_id
                     self.user_info = data.get('user_info', {})
                     self.email = self.user_info.get('email', '')
                     
@@ -256,12 +649,15 @@ class CloudflareClientCore:
                     self.config["user"]["password"] = password  # 注意：应该加密
                     self.save_config()
                     
-                    # 提交等待中的任务
-                    self._submit_pending_tasks()
-                    
                     # 获取用户详情
                     self._get_user_details()
                     
+                    # 提交等待中的任务（需要有效许可证）
+                    self._submit_pending_tasks()
+                    
+                    # 唤醒调度线程开始心跳
+                    self.scheduler_wakeup.set()
+                    
                     self._notify_status("login_success", self.user_info)
                     self.logger.info(f"登录成功: {username}")
                     return True
@@ -285,9 +681,9 @@ class CloudflareClientCore:
             return
         
         try:
-            response = self.session.get(f"{self.api_url}/api/users/{self.user_id}")
+            response = self._request("GET", f"/api/users/{self.user_id}")
             if response.status_code == 200:
-                user_data = response.json()
+                user_data = self._decode(response)
                 self.user_info.update(user_data)
                 
                 # 更新激活信息
@@ -311,8 +707,8 @@ class CloudflareClientCore:
                 return False
             
             # 发送激活码验证请求
-            response = self.session.post(
-                f"{self.api_url}/api/license/validate",
+            response = self._request(
+                "POST", "/api/license/validate",
                 json={
                     'license_key': license_key,
                     'device_id': self.device_id,
@@ -322,7 +718,7 @@ class CloudflareClientCore:
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = self._decode(response)
                 
                 if data.get('valid'):
                     self.license_valid = True
@@ -332,6 +728,8 @@ class CloudflareClientCore:
                     
                     self._notify_status("license_valid", self.license_info)
                     self.logger.info("激活码验证成功")
+                    
+                    self._submit_pending_tasks()
                     return True
                 else:
                     error = data.get('error', '激活码无效')
@@ -368,7 +766,7 @@ class CloudflareClientCore:
             "urls": urls,
             "email": email,
             "status": "pending",
-            "created_at": datetime.now().isoformat(),
+            "created_at": utc_isoformat(),
             "user_id": self.user_id,
             "username": self.username
         }
@@ -380,11 +778,136 @@ class CloudflareClientCore:
             # 离线状态，保存到等待队列
             return self._save_task_offline(task)
     
+    def submit_many(self, urls: List[str], email: str, chunk_size: int = MAX_URLS_PER_TASK,
+                    max_workers: int = 8) -> Dict:
+        """批量提交：按服务器限制切分URL，在线时通过批量接口提交，否则并发逐个提交
+        
+        返回 {"chunks": {序号: {"task_id", "error", "url_count", "elapsed"}},
+              "submitted", "failed", "elapsed"}
+        """
+        chunk_size = max(1, min(chunk_size, MAX_URLS_PER_TASK))
+        chunks = [urls[i:i + chunk_size] for i in range(0, len(urls), chunk_size)]
+        results: Dict[int, Dict] = {}
+        started = time.time()
+        
+        def submit_batch(indexes: List[int]) -> Optional[Dict[int, Dict]]:
+            batch_started = time.time()
+            batch_results = self.submit_tasks_batch([chunks[i] for i in indexes], email)
+            if batch_results is None:
+                return None
+            elapsed = time.time() - batch_started
+            return {index: {**result, "url_count": len(chunks[index]), "elapsed": elapsed}
+                    for index, result in zip(indexes, batch_results)}
+        
+        def submit_chunk(chunk: List[str]) -> Dict:
+            chunk_started = time.time()
+            try:
+                task_id = self.submit_download_task(chunk, email)
+                error = None if task_id else "任务提交失败"
+            except Exception as e:
+                task_id, error = None, str(e)
+            return {
+                "task_id": task_id,
+                "error": error,
+                "url_count": len(chunk),
+                "elapsed": time.time() - chunk_started
+            }
+        
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            if chunks and self.authenticated and self.license_valid:
+                batches = [list(range(i, min(i + MAX_BATCH_SIZE, len(chunks))))
+                           for i in range(0, len(chunks), MAX_BATCH_SIZE)]
+                for batch_results in executor.map(submit_batch, batches):
+                    if batch_results:
+                        results.update(batch_results)
+            
+            # 离线或服务器不支持批量接口时逐个提交
+            futures = {executor.submit(submit_chunk, chunks[index]): index
+                       for index in range(len(chunks)) if index not in results}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        
+        submitted = sum(1 for r in results.values() if r["task_id"])
+        elapsed = time.time() - started
+        self.logger.info(f"批量提交完成: {submitted}/{len(chunks)} 个分块成功，耗时 {elapsed:.2f}s")
+        
+        return {
+            "chunks": dict(sorted(results.items())),
+            "submitted": submitted,
+            "failed": len(chunks) - submitted,
+            "elapsed": elapsed
+        }
+    
+    def submit_tasks_batch(self, url_groups: List[List[str]], email: str) -> Optional[List[Dict]]:
+        """一次请求创建多个任务（每组URL一个任务，最多 MAX_BATCH_SIZE 组）
+        
+        返回与输入顺序一致的 [{"task_id", "error"}]；服务器不支持批量接口时返回 None
+        """
+        if not (self.authenticated and self.license_valid):
+            self._notify_error(Exception("请先登录并验证激活码"))
+            return [{"task_id": None, "error": "请先登录并验证激活码"} for _ in url_groups]
+        
+        try:
+            response = self._request(
+                "POST", "/api/tasks:batch",
+                json={
+                    'user_id': self.user_id,
+                    'submitted_by': self.username,
+                    'tasks': [{'urls': urls, 'email': email} for urls in url_groups]
+                },
+                timeout=30
+            )
+            
+            if response.status_code in (404, 405):
+                return None
+            
+            data = self._decode(response)
+            if response.status_code != 200 or 'results' not in data:
+                raise Exception(data.get('error', f"HTTP {response.status_code}"))
+            
+            results = []
+            for urls, item in zip(url_groups, data['results']):
+                if item.get('success'):
+                    local_task = {"urls": urls, "email": email, "user_id": self.user_id,
+                                  "username": self.username}
+                    results.append({"task_id": self._track_submitted_task(local_task, item['task']),
+                                    "error": None})
+                else:
+                    results.append({"task_id": None, "error": item.get('error', '任务提交失败')})
+            return results
+            
+        except Exception as e:
+            self.logger.error(f"批量提交任务失败: {e}")
+            self._notify_error(e)
+            return [{"task_id": None, "error": str(e)} for _ in url_groups]
+    
+    def get_tasks_status(self, task_ids: List[str]) -> Dict[str, Dict]:
+        """批量查询任务状态（每 MAX_BATCH_SIZE 个一个请求），返回 {task_id: 状态}"""
+        statuses: Dict[str, Dict] = {}
+        for i in range(0, len(task_ids), MAX_BATCH_SIZE):
+            try:
+                response = self._request(
+                    "POST", "/api/tasks/status:batch",
+                    retry=True,  # 只读查询，可以安全重试
+                    json={'task_ids': task_ids[i:i + MAX_BATCH_SIZE]}
+                )
+                if response.status_code != 200:
+                    self.logger.error(f"批量查询任务状态失败: HTTP {response.status_code}")
+                    continue
+                
+                for status in self._decode(response).get('tasks', []):
+                    statuses[status['task_id']] = status
+                    self._apply_task_update(status)
+            except Exception as e:
+                self.logger.error(f"批量查询任务状态失败: {e}")
+        
+        return statuses
+    
     def _submit_task_online(self, task: Dict) -> Optional[str]:
         """在线提交任务"""
         try:
-            response = self.session.post(
-                f"{self.api_url}/api/tasks",
+            response = self._request(
+                "POST", "/api/tasks",
                 json={
                     'user_id': self.user_id,
                     'urls': task["urls"],
@@ -395,30 +918,10 @@ class CloudflareClientCore:
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = self._decode(response)
                 
                 if data.get('success'):
-                    server_task = data['task']
-                    task_id = server_task['task_id']
-                    
-                    # 保存任务
-                    self.tasks[task_id] = {
-                        **task,
-                        **server_task
-                    }
-                    
-                    # 保存到历史
-                    self._add_to_history(task)
-                    
-                    # 通知状态
-                    self._notify_status("task_submitted", {
-                        "task_id": task_id,
-                        "url_count": len(task["urls"]),
-                        "email": task["email"]
-                    })
-                    
-                    self.logger.info(f"任务提交成功: {task_id}")
-                    return task_id
+                    return self._track_submitted_task(task, data['task'])
             
             return None
             
@@ -427,13 +930,41 @@ class CloudflareClientCore:
             self._notify_error(e)
             return None
     
+    def _track_submitted_task(self, task: Dict, server_task: Dict) -> str:
+        """记录服务器已创建的任务并开始跟踪，返回任务ID"""
+        task_id = server_task['task_id']
+        
+        # 保存任务
+        self.tasks[task_id] = {
+            **task,
+            **server_task
+        }
+        self.metrics.task_submitted(task_id)
+        
+        # 保存到历史
+        self._add_to_history(self.tasks[task_id])
+        
+        # 任务列表已变化
+        self.cache.invalidate(f"{self.api_url}/api/users/{self.user_id}/tasks")
+        
+        # 通知状态
+        self._notify_status("task_submitted", {
+            "task_id": task_id,
+            "url_count": len(task["urls"]),
+            "email": task["email"]
+        })
+        
+        self.logger.info(f"任务提交成功: {task_id}")
+        
+        # 优先使用服务器推送，否则立即切换到快速轮询
+        self._start_task_listener(task_id)
+        self.scheduler_wakeup.set()
+        return task_id
+    
     def _save_task_offline(self, task: Dict) -> str:
         """保存离线任务"""
         task["status"] = "offline_pending"
-        self.pending_tasks.append(task)
-        
-        # 保存到本地
-        self._save_pending_tasks()
+        self.pending_queue.enqueue(task)
         
         # 通知状态
         self._notify_status("task_offline_saved", {
@@ -444,146 +975,382 @@ class CloudflareClientCore:
         self.logger.info(f"任务保存为离线: {task['task_id']}")
         return task["task_id"]
     
-    def _submit_pending_tasks(self):
-        """提交等待中的任务"""
-        if not self.authenticated or not self.license_valid:
-            return
+    def _submit_pending_tasks(self) -> Dict:
+        """并发提交等待中的任务，成功的从队列删除，失败的按退避时间稍后重试
         
-        tasks_to_submit = self.pending_tasks.copy()
-        self.pending_tasks.clear()
+        逐批取出直到队列中没有可提交的任务（或达到批次上限）。
+        返回 {"submitted", "failed"}
+        """
+        result = {"submitted": 0, "failed": 0}
+        if not self.authenticated or not self.license_valid:
+            return result
         
-        for task in tasks_to_submit:
-            task_id = self._submit_task_online(task)
-            if task_id:
-                self.logger.info(f"提交等待任务: {task_id}")
+        # 登录、验证激活码和调度线程都会触发，避免同时重复提交
+        if not self._drain_lock.acquire(blocking=False):
+            return result
         
-        # 更新保存文件
-        self._save_pending_tasks()
-    
-    def _save_pending_tasks(self):
-        """保存等待任务到文件"""
         try:
-            pending_file = "pending_tasks.json"
-            with open(pending_file, 'w', encoding='utf-8') as f:
-                json.dump(self.pending_tasks, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            self.logger.error(f"保存等待任务失败: {e}")
+            queue_config = self.config.get("offline_queue", {})
+            backoff = queue_config.get("retry_backoff", 5)
+            backoff_max = queue_config.get("retry_backoff_max", 300)
+            
+            def submit_entry(entry: Dict) -> bool:
+                task = {**entry["task"], "status": "pending",
+                        "user_id": self.user_id, "username": self.username}
+                task_id = self._submit_task_online(task)
+                if task_id:
+                    self.pending_queue.ack(entry["task_id"])
+                    self.logger.info(f"提交等待任务: {entry['task_id']} -> {task_id}")
+                    return True
+                
+                # 失败的任务延后重新可见，本轮不会再次取出
+                delay = min(backoff * 2 ** (entry["attempts"] - 1), backoff_max)
+                self.pending_queue.nack(entry["task_id"], "任务提交失败", retry_delay=delay)
+                self.logger.warning(f"等待任务提交失败（第{entry['attempts']}次），{delay:.0f}秒后重试: {entry['task_id']}")
+                return False
+            
+            max_workers = queue_config.get("drain_workers", 4)
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                for _ in range(max(1, queue_config.get("drain_batches", 50))):
+                    entries = self.pending_queue.claim()
+                    if not entries:
+                        break
+                    outcomes = list(executor.map(submit_entry, entries))
+                    result["submitted"] += sum(outcomes)
+                    result["failed"] += len(outcomes) - sum(outcomes)
+                    # 整批失败（多半是服务器不可用）时停止，剩余任务交给调度线程退避后再试
+                    if not any(outcomes):
+                        break
+            
+            if result["submitted"] or result["failed"]:
+                self._notify_status("pending_tasks_submitted", result)
+            return result
+        finally:
+            self._drain_lock.release()
     
     def _load_pending_tasks(self):
-        """从文件加载等待任务"""
+        """把旧版 pending_tasks.json 中的任务导入离线队列"""
+        pending_file = "pending_tasks.json"
         try:
-            pending_file = "pending_tasks.json"
             if os.path.exists(pending_file):
                 with open(pending_file, 'r', encoding='utf-8') as f:
-                    self.pending_tasks = json.load(f)
+                    tasks = json.load(f)
+                for task in tasks:
+                    self.pending_queue.enqueue(task)
+                os.replace(pending_file, pending_file + ".migrated")
+                self.logger.info(f"已导入 {len(tasks)} 个等待任务")
         except Exception as e:
             self.logger.error(f"加载等待任务失败: {e}")
-            self.pending_tasks = []
     
     def _add_to_history(self, task: Dict):
         """添加到历史记录"""
+        self.history.upsert(self._history_record(task))
+    
+    def _history_record(self, task: Dict) -> Dict:
+        """生成历史记录条目"""
+        record = {**task, "server": "cloudflare"}
+        if "urls" in task:
+            record["urls"] = task["urls"][:3]  # 只保存前3个URL
+            record["url_count"] = len(task["urls"])
+        return record
+    
+    def _load_history(self):
+        """把旧版 download_history.json 导入本地历史"""
+        history_file = "download_history.json"
         try:
-            history_file = "download_history.json"
-            history = []
-            
             if os.path.exists(history_file):
                 with open(history_file, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-            
-            # 添加新记录
-            history_entry = {
-                "task_id": task["task_id"],
-                "urls": task["urls"][:3],  # 只保存前3个URL
-                "email": task["email"],
-                "status": task["status"],
-                "created_at": task["created_at"],
-                "completed_at": None,
-                "server": "cloudflare"
-            }
+                    entries = json.load(f)
+                self.history.upsert_many(entries)
+                os.replace(history_file, history_file + ".migrated")
+                self.logger.info(f"已导入 {len(entries)} 条历史记录")
+        except Exception as e:
+            self.logger.error(f"加载历史记录失败: {e}")
+    
+    def _poll_bounds(self) -> Tuple[float, float]:
+        """轮询间隔的上下限"""
+        connection = self.config.get("connection", {})
+        max_interval = connection.get("status_check_interval", 10)
+        min_interval = min(connection.get("status_check_min_interval", 1), max_interval)
+        return min_interval, max_interval
+    
+    def _jitter(self, interval: float) -> float:
+        """为间隔加上随机抖动，避免大量客户端同时请求"""
+        jitter = self.config.get("connection", {}).get("poll_jitter", 0.2)
+        return max(0.1, interval * (1 + random.uniform(-jitter, jitter)))
+    
+    def _has_active_tasks(self) -> bool:
+        """是否存在仍需轮询的任务（已有推送连接的任务不再轮询）"""
+        return any(
+            t.get("status") in ACTIVE_TASK_STATUSES and task_id not in self.streaming_tasks
+            for task_id, t in list(self.tasks.items())
+        )
+    
+    def _send_heartbeat(self):
+        """发送心跳"""
+        try:
+            response = self._request("GET", "/api/ping", timeout=5)
+            if response.status_code == 200:
+                # 更新用户活动
+                if self.user_id:
+                    self._request("POST", f"/api/users/{self.user_id}/activity", timeout=5)
+        except:
+            pass
+    
+    def _scheduler_loop(self):
+        """调度循环：心跳按固定间隔，任务状态仅在有活动任务时轮询，无变化时指数退避"""
+        heartbeat_interval = self.config.get("connection", {}).get("heartbeat_interval", 60)
+        queue_config = self.config.get("offline_queue", {})
+        drain_backoff_min = queue_config.get("retry_backoff", 5)
+        drain_backoff = drain_backoff_min
+        next_heartbeat = time.time()
+        next_status_check = time.time()
+        next_drain = time.time()
+        
+        while self.scheduler_active:
+            min_interval, max_interval = self._poll_bounds()
+            now = time.time()
             
-            history.append(history_entry)
+            if self.authenticated:
+                if now >= next_heartbeat:
+                    self._send_heartbeat()
+                    next_heartbeat = now + self._jitter(heartbeat_interval)
+                
+                if self.user_id and self._has_active_tasks() and now >= next_status_check:
+                    try:
+                        changed = self._check_user_tasks()
+                    except Exception as e:
+                        self.logger.error(f"状态检查失败: {e}")
+                        changed = False
+                    
+                    # 有变化时保持快速轮询，否则指数退避
+                    if changed:
+                        self.poll_interval = min_interval
+                    else:
+                        self.poll_interval = min(self.poll_interval * 2, max_interval)
+                    next_status_check = time.time() + self._jitter(self.poll_interval)
+                
+                # 离线队列中有到期的任务时提交；整轮失败时退避，避免服务器不可用时反复重试
+                if self.license_valid and now >= next_drain:
+                    ready_at = self.pending_queue.next_ready_time()
+                    if ready_at is not None and ready_at <= now:
+                        drained = self._submit_pending_tasks()
+                        if drained["failed"] and not drained["submitted"]:
+                            next_drain = time.time() + self._jitter(drain_backoff)
+                            drain_backoff = min(drain_backoff * 2, queue_config.get("retry_backoff_max", 300))
+                        else:
+                            drain_backoff = drain_backoff_min
             
-            # 只保留最近50条
-            if len(history) > 50:
-                history = history[-50:]
+            # 计算下一次需要醒来的时间
+            now = time.time()
+            wait = heartbeat_interval
+            if self.authenticated:
+                wait = next_heartbeat - now
+                if self._has_active_tasks():
+                    wait = min(wait, next_status_check - now)
+                if self.license_valid:
+                    ready_at = self.pending_queue.next_ready_time()
+                    if ready_at is not None:
+                        wait = min(wait, max(ready_at, next_drain) - now)
             
-            # 保存
-            with open(history_file, 'w', encoding='utf-8') as f:
-                json.dump(history, f, ensure_ascii=False, indent=2)
+            if self.scheduler_wakeup.wait(max(0.1, wait)):
+                self.scheduler_wakeup.clear()
+                # 被唤醒（登录或提交新任务）时重置为快速轮询
+                self.poll_interval = min_interval
+                next_status_check = time.time() + self._jitter(min_interval)
+    
+    def _check_user_tasks(self) -> bool:
+        """检查用户任务状态（增量同步，只拉取游标之后有变化的任务）
+        
+        返回本地跟踪的任务是否有状态或进度变化
+        """
+        changed = False
+        try:
+            response = self._request(
+                "GET", f"/api/users/{self.user_id}/tasks",
+                params={"since": self.tasks_cursor, "fields": TASK_POLL_FIELDS}
+            )
+            if response.status_code == 200:
+                data = self._decode(response)
+                
+                # 兼容不支持增量同步的旧版服务器（返回完整列表）
+                if isinstance(data, dict):
+                    tasks = self._dedupe_at_cursor(data.get("tasks", []), data.get("cursor", self.tasks_cursor))
+                else:
+                    tasks = data
+                
+                for task in tasks:
+                    if self._apply_task_update(task):
+                        changed = True
                 
+                # 增量结果同时写入本地历史
+                self.history.upsert_many([self._history_record(task) for task in tasks])
         except Exception as e:
-            self.logger.error(f"保存历史记录失败: {e}")
+            self.logger.error(f"检查任务状态失败: {e}")
+        
+        return changed
     
-    def _heartbeat_loop(self):
-        """心跳循环"""
-        interval = self.config.get("connection", {}).get("heartbeat_interval", 60)
+    def _dedupe_at_cursor(self, tasks: List[Dict], cursor: str) -> List[Dict]:
+        """按任务ID去重，跳过上次已处理过的游标处的同一版本，并推进游标"""
+        unique = {}
+        for task in tasks:
+            task_id = task.get("task_id")
+            if task_id and self._tasks_at_cursor.get(task_id) != task.get("updated_at"):
+                unique[task_id] = task
         
-        while self.heartbeat_active:
-            try:
-                if self.authenticated:
-                    response = self.session.get(f"{self.api_url}/api/ping", timeout=5)
-                    if response.status_code == 200:
-                        # 更新用户活动
-                        if self.user_id:
-                            self.session.post(
-                                f"{self.api_url}/api/users/{self.user_id}/activity",
-                                timeout=5
-                            )
-            except:
-                pass
-            
-            time.sleep(interval)
+        at_cursor = self._tasks_at_cursor if cursor == self.tasks_cursor else {}
+        for task in tasks:
+            if task.get("task_id") and task.get("updated_at") == cursor:
+                at_cursor[task["task_id"]] = cursor
+        
+        self.tasks_cursor = cursor
+        self._tasks_at_cursor = at_cursor
+        return list(unique.values())
     
-    def _status_check_loop(self):
-        """状态检查循环"""
-        interval = self.config.get("connection", {}).get("status_check_interval", 10)
+    def _apply_task_update(self, task: Dict) -> bool:
+        """合并服务器返回的任务状态并通知订阅者，返回是否有变化"""
+        task_id = task.get('task_id')
+        if not task_id:
+            return False
         
-        while self.status_check_active:
-            try:
-                if self.authenticated and self.user_id:
-                    # 检查用户任务状态
-                    self._check_user_tasks()
-            except Exception as e:
-                self.logger.error(f"状态检查失败: {e}")
+        with self._tasks_lock:
+            # 只更新本地跟踪的任务
+            local_task = self.tasks.get(task_id)
+            if local_task is None:
+                return False
+            
+            old_status = local_task.get('status')
+            new_status = task.get('status', old_status)
+            changed = False
+            
+            if 'progress' in task and task.get('progress') != local_task.get('progress'):
+                local_task['progress'] = task.get('progress')
+                changed = True
             
-            time.sleep(interval)
+            if old_status != new_status:
+                changed = True
+                local_task.update(task)
+        
+        if changed:
+            self.cache.invalidate(f"{self.api_url}/api/tasks/{task_id}")
+            self.cache.invalidate(f"{self.api_url}/api/users/{self.user_id}/tasks")
+            self._add_to_history(local_task)
+        
+        # 通知状态变化
+        if old_status != new_status:
+            if new_status in ('completed', 'failed'):
+                self.metrics.task_finished(task_id, new_status)
+            
+            if new_status == 'completed':
+                self._notify_status("task_complete", task)
+            elif new_status == 'processing':
+                self._notify_status("task_status", {
+                    "task_id": task_id,
+                    "status": new_status,
+                    "progress": task.get('progress', 0)
+                })
+        
+        return changed
     
-    def _check_user_tasks(self):
-        """检查用户任务状态"""
+    def _start_task_listener(self, task_id: str):
+        """为任务开启服务器推送监听（SSE），超过上限的任务仍走轮询"""
+        connection = self.config.get("connection", {})
+        if not connection.get("use_push", True):
+            return
+        
+        with self._tasks_lock:
+            if task_id in self.streaming_tasks:
+                return
+            if len(self.streaming_tasks) >= connection.get("max_push_streams", 4):
+                return
+            self.streaming_tasks.add(task_id)
+        
+        threading.Thread(target=self._task_event_loop, args=(task_id,), daemon=True).start()
+    
+    def _task_event_loop(self, task_id: str):
+        """读取任务状态事件流，连接断开时回退到轮询"""
         try:
-            response = self.session.get(f"{self.api_url}/api/users/{self.user_id}/tasks")
-            if response.status_code == 200:
-                tasks = response.json()
-                
-                for task in tasks:
-                    task_id = task.get('task_id')
-                    if task_id:
-                        # 更新本地任务状态
-                        if task_id in self.tasks:
-                            old_status = self.tasks[task_id].get('status')
-                            new_status = task.get('status')
-                            
-                            if old_status != new_status:
-                                self.tasks[task_id].update(task)
-                                
-                                # 通知状态变化
-                                if new_status == 'completed':
-                                    self._notify_status("task_complete", task)
-                                elif new_status == 'processing':
-                                    self._notify_status("task_status", {
-                                        "task_id": task_id,
-                                        "status": new_status,
-                                        "progress": task.get('progress', 0)
-                                    })
+            while self.scheduler_active and self.tasks.get(task_id, {}).get("status") in ACTIVE_TASK_STATUSES:
+                with self._request(
+                    "GET", f"/api/tasks/{task_id}/status",
+                    retry=False,  # 断开后由外层循环重连
+                    headers={'Accept': 'text/event-stream'},
+                    stream=True,
+                    timeout=(5, 60)
+                ) as response:
+                    content_type = response.headers.get('Content-Type', '')
+                    if response.status_code != 200 or not content_type.startswith('text/event-stream'):
+                        # 服务器不支持推送
+                        return
+                    
+                    # 事件流固定为UTF-8，未声明charset时requests会按ISO-8859-1解码
+                    response.encoding = 'utf-8'
+                    event = "message"
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not self.scheduler_active:
+                            return
+                        if not line:
+                            event = "message"
+                        elif line.startswith("event:"):
+                            event = line[len("event:"):].strip()
+                        elif line.startswith("data:"):
+                            data = json.loads(line[len("data:"):].strip())
+                            if event == "status":
+                                self._apply_task_update(data)
+                            elif event == "error":
+                                self.logger.error(f"任务状态推送错误: {data.get('error')}")
+                                return
         except Exception as e:
-            self.logger.error(f"检查任务状态失败: {e}")
+            self.logger.error(f"任务状态推送中断: {e}")
+        finally:
+            with self._tasks_lock:
+                self.streaming_tasks.discard(task_id)
+            # 任务仍未结束时由调度线程继续轮询
+            self.scheduler_wakeup.set()
+    
+    def _cached_get(self, path: str, kind: str, timeout: float = 10) -> Optional[Any]:
+        """带缓存的GET：有效期内直接返回本地数据，过期后用ETag做条件请求
+        
+        返回解析后的JSON，请求失败（非200/304）时返回None
+        """
+        cache_config = self.config.get("cache", {})
+        url = f"{self.api_url}{path}"
+        entry = self.cache.get(url) if cache_config.get("enabled", True) else None
+        
+        if entry is not None and self.cache.is_fresh(entry):
+            return entry["data"]
+        
+        headers = {}
+        if entry is not None and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        
+        response = self._request("GET", url, headers=headers, timeout=timeout)
+        ttl = cache_config.get("ttl", {}).get(kind, 0)
+        
+        if response.status_code == 304 and entry is not None:
+            self.cache.put(url, entry["data"], entry["etag"], ttl)
+            return entry["data"]
+        
+        if response.status_code != 200:
+            return None
+        
+        data = self._decode(response)
+        
+        # 已完成的任务不会再变化，永久缓存
+        if kind == "download_links" or (kind == "task" and isinstance(data, dict) and data.get("status") == "completed"):
+            ttl = None
+        
+        if cache_config.get("enabled", True) and (ttl is None or ttl > 0):
+            self.cache.put(url, data, response.headers.get("ETag"), ttl)
+        
+        return data
     
     def get_task_info(self, task_id: str) -> Optional[Dict]:
         """获取任务信息"""
         try:
-            response = self.session.get(f"{self.api_url}/api/tasks/{task_id}")
-            if response.status_code == 200:
-                return response.json()
+            data = self._cached_get(f"/api/tasks/{task_id}", "task")
+            if data is not None:
+                return data
         except:
             pass
         
@@ -593,32 +1360,198 @@ class CloudflareClientCore:
         """获取所有任务"""
         if self.authenticated and self.user_id:
             try:
-                response = self.session.get(f"{self.api_url}/api/users/{self.user_id}/tasks")
-                if response.status_code == 200:
-                    return response.json()
+                data = self._cached_get(f"/api/users/{self.user_id}/tasks", "task_list")
+                if data is not None:
+                    return data
             except:
                 pass
         
         return list(self.tasks.values())
     
+    def get_tasks_page(self, limit: int = 50, cursor: str = None, status: str = None,
+                       since: str = None) -> Optional[Dict]:
+        """获取一页任务（按创建时间倒序）
+        
+        status 可为逗号分隔的多个状态，since 只返回此后有变化的任务。
+        返回 {"tasks", "cursor", "has_more"}，请求失败时返回None
+        """
+        if not (self.authenticated and self.user_id):
+            return None
+        
+        params = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        if status:
+            params["status"] = status
+        if since:
+            params["since"] = since
+        
+        try:
+            response = self._request("GET", f"/api/users/{self.user_id}/tasks", params=params)
+            if response.status_code != 200:
+                self.logger.error(f"获取任务列表失败: HTTP {response.status_code}")
+                return None
+            
+            data = self._decode(response)
+            
+            # 兼容不支持分页的旧版服务器（一次返回全部）
+            if isinstance(data, list):
+                return {"tasks": data, "cursor": None, "has_more": False}
+            
+            has_more = bool(data.get("has_more"))
+            return {
+                "tasks": data.get("tasks", []),
+                "cursor": data.get("cursor") if has_more else None,
+                "has_more": has_more
+            }
+        except Exception as e:
+            self.logger.error(f"获取任务列表失败: {e}")
+            return None
+    
+    def iter_tasks(self, status: str = None, since: str = None,
+                   page_size: int = TASK_PAGE_SIZE) -> Iterator[Dict]:
+        """逐页惰性遍历任务（按创建时间倒序），只在需要时请求下一页"""
+        cursor = None
+        while True:
+            page = self.get_tasks_page(limit=page_size, cursor=cursor, status=status, since=since)
+            if page is None:
+                return
+            
+            yield from page["tasks"]
+            
+            cursor = page["cursor"]
+            if not cursor:
+                return
+    
+    def sync_history(self, full: bool = False) -> int:
+        """分页拉取任务写入本地历史，返回同步的任务数
+        
+        默认只拉取上次同步之后有变化的任务，full=True 时重新拉取全部
+        """
+        if not (self.authenticated and self.user_id):
+            return 0
+        
+        since = "" if full else self.history_synced_at
+        latest = since
+        cursor = None
+        synced = 0
+        
+        while True:
+            page = self.get_tasks_page(limit=TASK_PAGE_SIZE, cursor=cursor, since=since)
+            if page is None:
+                # 中途失败时不推进同步时间，下次重新拉取
+                return synced
+            
+            tasks = page["tasks"]
+            self.history.upsert_many([self._history_record(task) for task in tasks])
+            synced += len(tasks)
+            
+            for task in tasks:
+                latest = max(latest, task.get("updated_at") or task.get("completed_at")
+                             or task.get("started_at") or task.get("created_at") or "")
+            
+            cursor = page["cursor"]
+            if not cursor:
+                break
+        
+        self.history_synced_at = latest
+        return synced
+    
+    def get_history(self, status: str = None, since: str = None, limit: int = 50,
+                    offset: int = 0) -> List[Dict]:
+        """查询本地历史（按创建时间倒序，离线可用）"""
+        return self.history.query(status=status, since=since, limit=limit, offset=offset)
+    
+    def count_history(self, status: str = None) -> int:
+        """本地历史记录数"""
+        return self.history.count(status)
+    
+    def get_history_entry(self, task_id: str) -> Optional[Dict]:
+        """读取本地历史中的单个任务"""
+        return self.history.get(task_id)
+    
     def get_download_links(self, task_id: str) -> List[str]:
         """获取下载链接"""
         try:
-            response = self.session.get(f"{self.api_url}/api/tasks/{task_id}/download")
-            if response.status_code == 200:
-                data = response.json()
+            data = self._cached_get(f"/api/tasks/{task_id}/download", "download_links")
+            if data is not None:
                 return data.get('direct_links', [])
         except Exception as e:
             self.logger.error(f"获取下载链接失败: {e}")
         
         return []
     
+    def download_task_files(self, task_id: str, dest_dir: str = None,
+                            progress_callback: Any = None) -> Dict:
+        """并发下载任务的全部文件到本地（支持断点续传）"""
+        download_config = self.config.get("download", {})
+        dest_dir = dest_dir or os.path.join(download_config.get("directory", "downloads"), task_id)
+        
+        links = self.get_download_links(task_id)
+        if not links:
+            self._notify_error(Exception("没有可用的下载链接"))
+            return {"files": [], "succeeded": 0, "failed": 0, "bytes": 0, "elapsed": 0, "throughput": 0}
+        
+        downloader = TaskDownloader(
+            self._request,
+            max_workers=download_config.get("max_workers", 4),
+            chunk_size=download_config.get("chunk_size", 65536),
+            progress_callback=progress_callback
+        )
+        result = downloader.download(links, dest_dir)
+        result["task_id"] = task_id
+        result["directory"] = dest_dir
+        
+        self._notify_status("download_complete", result)
+        return result
+
+    def download_task_bundle(self, task_id: str, dest_dir: str = None,
+                             compression: str = None) -> Dict:
+        """以单个ZIP流下载任务全部文件，边接收边解压（compression 可为 "deflate"）"""
+        download_config = self.config.get("download", {})
+        dest_dir = dest_dir or os.path.join(download_config.get("directory", "downloads"), task_id)
+        result = {"task_id": task_id, "directory": dest_dir, "files": [], "bytes": 0,
+                  "elapsed": 0.0, "error": None}
+        started = time.time()
+
+        try:
+            data = self._cached_get(f"/api/tasks/{task_id}/download", "download_links")
+            bundle_url = data.get('download_all') if data else None
+            if not bundle_url:
+                raise Exception("没有可用的打包下载链接")
+
+            params = {"compression": compression} if compression else None
+            with self._request("GET", bundle_url, params=params, stream=True, timeout=30) as response:
+                if response.status_code != 200:
+                    raise Exception(f"HTTP {response.status_code}")
+
+                result["files"] = extract_zip_stream(
+                    response.raw, dest_dir,
+                    chunk_size=download_config.get("chunk_size", 65536),
+                    entry_callback=lambda entry: self._notify_status("download_entry", entry)
+                )
+
+            result["bytes"] = sum(entry["size"] for entry in result["files"])
+            corrupted = [entry["name"] for entry in result["files"] if not entry["crc_ok"]]
+            if corrupted:
+                raise Exception(f"文件校验失败: {', '.join(corrupted)}")
+
+        except Exception as e:
+            result["error"] = str(e)
+            self.logger.error(f"打包下载失败: {e}")
+            self._notify_error(e)
+        finally:
+            result["elapsed"] = time.time() - started
+
+        self._notify_status("download_complete", result)
+        return result
+
     def get_server_stats(self) -> Dict:
         """获取服务器统计"""
         try:
-            response = self.session.get(f"{self.api_url}/api/stats")
-            if response.status_code == 200:
-                return response.json()
+            data = self._cached_get("/api/stats", "stats")
+            if data is not None:
+                return data
         except:
             pass
         
@@ -628,7 +1561,7 @@ class CloudflareClientCore:
         """登出"""
         if self.authenticated:
             try:
-                self.session.post(f"{self.api_url}/api/auth/logout", timeout=5)
+                self._request("POST", "/api/auth/logout", timeout=5)
             except:
                 pass
         
@@ -637,20 +1570,22 @@ class CloudflareClientCore:
         self.user_id = None
         self.username = None
         self.user_info = None
+        self.tasks_cursor = ""
+        self._tasks_at_cursor = {}
+        self.history_synced_at = ""
+        self.session.headers.pop('X-User-ID', None)
+        self.cache.clear()
         
         self._notify_status("logout", {})
         self.logger.info("用户已登出")
     
     def disconnect(self):
         """断开连接"""
-        self.heartbeat_active = False
-        self.status_check_active = False
-        
-        if self.heartbeat_thread.is_alive():
-            self.heartbeat_thread.join(timeout=1)
+        self.scheduler_active = False
+        self.scheduler_wakeup.set()
         
-        if self.status_thread.is_alive():
-            self.status_thread.join(timeout=1)
+        if self.scheduler_thread.is_alive():
+            self.scheduler_thread.join(timeout=1)
         
         self.connected = False
         self._notify_status("disconnected", {})
@@ -697,7 +1632,8 @@ class CloudflareClientCore:
             "username": self.username,
             "user_id": self.user_id,
             "email": self.email,
-            "pending_tasks": len(self.pending_tasks),
+            "pending_tasks": self.pending_queue.count(),
+            "circuit_state": self.breaker.state,
             "active_tasks": len([t for t in self.tasks.values() if t.get("status") in ["processing", "downloading"]]),
             "server_url": self.api_url
         }
\ No newline at end of file
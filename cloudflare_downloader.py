@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+"""
+任务文件下载器 - 并发、断点续传、流式解压ZIP
+"""
+import os
+import time
+import zlib
+import struct
+import logging
+import threading
+from typing import List, Dict, Optional, Any, Callable
+from urllib.parse import urlparse, unquote
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+class TaskDownloader:
+    """并发下载任务文件：分块写盘，未完成的文件保存为 .part 并用 Range 续传
+
+    request(method, url, **kwargs) 发送请求并返回 requests.Response，通常传入客户端的
+    _request，下载请求同样经过重试、熔断和指标统计。
+    """
+
+    def __init__(self, request: Callable[..., requests.Response], max_workers: int = 4,
+                 chunk_size: int = 64 * 1024, timeout: float = 30,
+                 progress_callback: Any = None):
+        self.request = request
+        self.max_workers = max(1, max_workers)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        # progress_callback(url, downloaded_bytes, total_bytes)
+        self.progress_callback = progress_callback
+        self.logger = logging.getLogger("CloudflareDownloader")
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """取消尚未完成的下载（已下载部分保留，可续传）"""
+        self._cancelled.set()
+
+    def download(self, urls: List[str], dest_dir: str) -> Dict:
+        """下载全部文件
+
+        返回 {"files": [每个文件的结果], "succeeded", "failed", "bytes", "elapsed", "throughput"}
+        """
+        os.makedirs(dest_dir, exist_ok=True)
+        self._cancelled.clear()
+        started = time.time()
+
+        paths = self._target_paths(urls, dest_dir)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            files = list(executor.map(self._download_one, urls, paths))
+
+        elapsed = time.time() - started
+        total_bytes = sum(f["bytes"] for f in files)
+        succeeded = sum(1 for f in files if not f["error"])
+
+        self.logger.info(f"下载完成: {succeeded}/{len(files)} 个文件，{total_bytes} 字节，耗时 {elapsed:.2f}s")
+
+        return {
+            "files": files,
+            "succeeded": succeeded,
+            "failed": len(files) - succeeded,
+            "bytes": total_bytes,
+            "elapsed": elapsed,
+            "throughput": total_bytes / elapsed if elapsed > 0 else 0
+        }
+
+    @staticmethod
+    def _target_paths(urls: List[str], dest_dir: str) -> List[str]:
+        """根据URL确定保存路径：文件名重复时从第二个起加序号（name_2.ext）
+
+        序号按URL顺序分配，同一组URL重新下载时仍对应同一个 .part 文件
+        """
+        paths = []
+        used = set()
+        for url in urls:
+            filename = os.path.basename(unquote(urlparse(url).path)) or "download"
+            stem, ext = os.path.splitext(filename)
+            count = 1
+            while filename in used:
+                count += 1
+                filename = f"{stem}_{count}{ext}"
+            used.add(filename)
+            paths.append(os.path.join(dest_dir, filename))
+        return paths
+
+    def _download_one(self, url: str, path: str) -> Dict:
+        """下载单个文件"""
+        part_path = path + ".part"
+        result = {
+            "url": url,
+            "path": path,
+            "bytes": 0,
+            "size": None,
+            "resumed": False,
+            "elapsed": 0.0,
+            "throughput": 0.0,
+            "error": None
+        }
+        started = time.time()
+
+        try:
+            if os.path.exists(path):
+                # 已完整下载过
+                result["size"] = os.path.getsize(path)
+                return result
+
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+            with self.request("GET", url, headers=headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code == 416 and offset:
+                    # .part 已是完整文件
+                    total = self._parse_total(response.headers.get("Content-Range"))
+                    mode = None
+                elif response.status_code == 206 and offset:
+                    total = self._parse_total(response.headers.get("Content-Range"))
+                    result["resumed"] = True
+                    mode = "ab"
+                elif response.status_code == 200:
+                    # 服务器不支持续传时从头下载
+                    content_length = response.headers.get("Content-Length")
+                    total = int(content_length) if content_length else None
+                    offset = 0
+                    mode = "wb"
+                else:
+                    raise Exception(f"HTTP {response.status_code}")
+
+                result["size"] = total
+
+                if mode:
+                    downloaded = offset
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            if self._cancelled.is_set():
+                                raise Exception("下载已取消")
+                            if not chunk:
+                                continue
+                            f.write(chunk)
+                            downloaded += len(chunk)
+                            result["bytes"] += len(chunk)
+                            if self.progress_callback:
+                                self.progress_callback(url, downloaded, total)
+
+            # 校验大小，不一致时保留 .part 以便下次续传
+            actual = os.path.getsize(part_path)
+            if total is not None and actual != total:
+                raise Exception(f"文件大小不一致: {actual}/{total}")
+
+            os.replace(part_path, path)
+            result["size"] = actual
+
+        except Exception as e:
+            result["error"] = str(e)
+            self.logger.error(f"下载失败 {url}: {e}")
+        finally:
+            result["elapsed"] = time.time() - started
+            if result["elapsed"] > 0:
+                result["throughput"] = result["bytes"] / result["elapsed"]
+
+        return result
+
+    @staticmethod
+    def _parse_total(content_range: Optional[str]) -> Optional[int]:
+        """从 Content-Range 中解析文件总大小"""
+        if not content_range or "/" not in content_range:
+            return None
+        total = content_range.rsplit("/", 1)[1].strip()
+        return int(total) if total.isdigit() else None
+
+
+class _StreamReader:
+    """在文件对象上提供精确读取和回退（解析流式ZIP用）"""
+
+    def __init__(self, raw, chunk_size: int = 64 * 1024):
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self.buffer = b""
+        self.consumed = 0
+
+    def read_some(self) -> bytes:
+        """读取一段数据（缓冲区优先），流结束时返回空字节串"""
+        if self.buffer:
+            data, self.buffer = self.buffer, b""
+        else:
+            data = self.raw.read(self.chunk_size)
+        self.consumed += len(data)
+        return data
+
+    def read_exact(self, size: int) -> bytes:
+        """读取恰好 size 个字节"""
+        parts = []
+        remaining = size
+        while remaining > 0:
+            data = self.read_some()
+            if not data:
+                raise EOFError("ZIP数据不完整")
+            if len(data) > remaining:
+                self.unread(data[remaining:])
+                data = data[:remaining]
+            parts.append(data)
+            remaining -= len(data)
+        return b"".join(parts)
+
+    def unread(self, data: bytes):
+        """把多读的数据放回缓冲区"""
+        self.buffer = data + self.buffer
+        self.consumed -= len(data)
+
+
+def extract_zip_stream(raw, dest_dir: str, chunk_size: int = 64 * 1024,
+                       entry_callback: Any = None) -> List[Dict]:
+    """边接收边解压ZIP流，遇到中央目录即结束
+
+    支持 stored 条目和带数据描述符的 deflate 条目；每个条目写完后调用
+    entry_callback(entry)。返回各条目的 {"name", "path", "size", "crc_ok"}
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    reader = _StreamReader(raw, chunk_size)
+    entries = []
+
+    while True:
+        signature = reader.read_exact(4)
+        if signature != b"PK\x03\x04":
+            # 中央目录或结束记录：所有文件都已解出
+            break
+
+        (_, flags, method, _, _, crc, compressed_size, size,
+         name_length, extra_length) = struct.unpack("<HHHHHIIIHH", reader.read_exact(26))
+        name = reader.read_exact(name_length).decode("utf-8" if flags & 0x0800 else "cp437")
+        reader.read_exact(extra_length)
+
+        # 只取文件名，防止路径穿越
+        path = os.path.join(dest_dir, os.path.basename(name.replace("\\", "/")) or "unnamed")
+        actual_crc = 0
+        written = 0
+
+        with open(path + ".part", "wb") as f:
+            if method == 0 and not flags & 0x0008:
+                remaining = compressed_size
+                while remaining > 0:
+                    data = reader.read_exact(min(chunk_size, remaining))
+                    f.write(data)
+                    actual_crc = zlib.crc32(data, actual_crc)
+                    written += len(data)
+                    remaining -= len(data)
+            elif method == 8:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                while not decompressor.eof:
+                    data = reader.read_some()
+                    if not data:
+                        raise EOFError("ZIP数据不完整")
+                    output = decompressor.decompress(data)
+                    f.write(output)
+                    actual_crc = zlib.crc32(output, actual_crc)
+                    written += len(output)
+                if decompressor.unused_data:
+                    reader.unread(decompressor.unused_data)
+            else:
+                raise ValueError(f"不支持的ZIP条目格式: method={method}, flags={flags}")
+
+        if flags & 0x0008:
+            descriptor = reader.read_exact(4)
+            if descriptor == b"PK\x07\x08":
+                descriptor = reader.read_exact(4)
+            crc = struct.unpack("<I", descriptor)[0]
+            _, size = struct.unpack("<II", reader.read_exact(8))
+
+        os.replace(path + ".part", path)
+        entry = {
+            "name": name,
+            "path": path,
+            "size": written,
+            "crc_ok": actual_crc == crc and written == size
+        }
+        entries.append(entry)
+        if entry_callback:
+            entry_callback(entry)
+
+    return entries
@@ -2,19 +2,39 @@
 Cloudflare客户端GUI适配器
 """
 import tkinter as tk
-from tkinter import ttk, messagebox
-import threading
+from tkinter import ttk, messagebox, filedialog
+import queue
+import logging
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from cloudflare_client import CloudflareClientCore
 
 class CloudflareClientGUI:
-    """Cloudflare客户端GUI"""
+    """Cloudflare客户端GUI
+    
+    所有网络调用都提交到共享线程池执行，结果经线程安全队列交回，
+    由主线程定时取出更新界面；后台线程不直接访问任何控件。
+    """
+    
+    # 线程池大小与每次最多处理的界面事件数
+    IO_WORKERS = 4
+    UI_POLL_MS = 50
+    UI_BATCH = 100
+    
+    # 历史列表每页加载条数
+    HISTORY_PAGE_SIZE = 200
     
     def __init__(self, root):
         self.root = root
         self.root.title("学科网下载客户端 - Cloudflare版")
         self.root.geometry("1000x700")
+        self.logger = logging.getLogger("CloudflareGUI")
+        
+        # 后台I/O线程池和界面事件队列
+        self.executor = ThreadPoolExecutor(max_workers=self.IO_WORKERS, thread_name_prefix="gui-io")
+        self.ui_queue = queue.Queue()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # 客户端核心
         self.client = CloudflareClientCore()
@@ -29,9 +49,53 @@ class CloudflareClientGUI:
         # 启动状态更新
         self._start_status_updater()
         
+        # 开始处理界面事件
+        self._drain_ui_queue()
+        
         # 尝试自动连接
         self.root.after(1000, self._auto_connect)
     
+    def _run_in_background(self, func, *args, on_done=None):
+        """在线程池中执行 func(*args)，完成后在主线程调用 on_done(result)"""
+        def task():
+            try:
+                result = func(*args)
+            except Exception as e:
+                self.logger.error(f"后台任务失败: {e}")
+                self.on_error(e)
+                return
+            if on_done:
+                self.post_to_ui(on_done, result)
+        
+        try:
+            return self.executor.submit(task)
+        except RuntimeError:
+            # 窗口关闭后线程池已停止
+            return None
+    
+    def post_to_ui(self, callback, *args):
+        """从任意线程安排 callback(*args) 在主线程执行"""
+        self.ui_queue.put((callback, args))
+    
+    def _drain_ui_queue(self):
+        """主线程定时处理界面事件"""
+        for _ in range(self.UI_BATCH):
+            try:
+                callback, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                self.logger.error(f"界面更新失败: {e}")
+        
+        self.root.after(self.UI_POLL_MS, self._drain_ui_queue)
+    
+    def on_close(self):
+        """关闭窗口：停止线程池，不等待进行中的请求"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+    
     def _create_widgets(self):
         """创建GUI组件"""
         # 创建笔记本
@@ -193,11 +257,17 @@ class CloudflareClientGUI:
             self.history_tree.heading(col, text=col)
             self.history_tree.column(col, width=120)
         
-        scrollbar = ttk.Scrollbar(list_frame, orient='vertical', command=self.history_tree.yview)
-        self.history_tree.configure(yscrollcommand=scrollbar.set)
+        # 已显示的行（task_id -> 行值，按显示顺序），用于增量更新
+        self._history_rows = {}
+        self._history_limit = self.HISTORY_PAGE_SIZE
+        self._history_total = 0
+        self._history_loading = False
+        
+        self.history_scrollbar = ttk.Scrollbar(list_frame, orient='vertical', command=self.history_tree.yview)
+        self.history_tree.configure(yscrollcommand=self._on_history_scroll)
         
         self.history_tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
+        self.history_scrollbar.pack(side='right', fill='y')
         
         # 操作按钮
         btn_frame = ttk.Frame(frame)
@@ -206,6 +276,10 @@ class CloudflareClientGUI:
         ttk.Button(btn_frame, text="刷新", command=self.refresh_history).pack(side='left', padx=2)
         ttk.Button(btn_frame, text="查看详情", command=self.view_task_detail).pack(side='left', padx=2)
         ttk.Button(btn_frame, text="下载文件", command=self.download_files).pack(side='left', padx=2)
+        ttk.Button(btn_frame, text="加载更多", command=self.load_more_history).pack(side='left', padx=2)
+        
+        self.history_count_label = ttk.Label(btn_frame, text="")
+        self.history_count_label.pack(side='right', padx=5)
     
     def _create_status_tab(self):
         """创建状态标签页"""
@@ -218,9 +292,26 @@ class CloudflareClientGUI:
         status_frame = ttk.LabelFrame(frame, text="连接状态", padding=10)
         status_frame.pack(fill='x', padx=10, pady=5)
         
-        self.status_text = scrolledtext.ScrolledText(status_frame, height=15)
+        self.status_text = scrolledtext.ScrolledText(status_frame, height=9)
         self.status_text.pack(fill='both', expand=True)
         
+        # 请求指标（按接口）
+        metrics_frame = ttk.LabelFrame(frame, text="请求指标", padding=10)
+        metrics_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        
+        columns = ('接口', '请求数', '错误', '重试', 'p50', 'p95', 'p99', '服务器p50', 'KV p50', '接收')
+        self.metrics_tree = ttk.Treeview(metrics_frame, columns=columns, show='headings', height=6)
+        for col in columns:
+            self.metrics_tree.heading(col, text=col)
+            self.metrics_tree.column(col, width=240 if col == '接口' else 70, anchor='w' if col == '接口' else 'e')
+        self.metrics_tree.pack(fill='both', expand=True)
+        
+        self.task_metrics_label = ttk.Label(metrics_frame, text="任务耗时: 暂无数据")
+        self.task_metrics_label.pack(anchor='w', pady=(5, 0))
+        
+        # 已显示的指标行（接口 -> 行值），用于增量更新
+        self._metrics_rows = {}
+        
         # 服务器统计
         stats_frame = ttk.LabelFrame(frame, text="服务器统计", padding=10)
         stats_frame.pack(fill='x', padx=10, pady=5)
@@ -234,39 +325,61 @@ class CloudflareClientGUI:
         
         ttk.Button(btn_frame, text="刷新状态", command=self.refresh_status).pack(side='left', padx=5)
         ttk.Button(btn_frame, text="保存配置", command=self.save_config).pack(side='left', padx=5)
+        ttk.Button(btn_frame, text="导出指标", command=self.export_metrics).pack(side='left', padx=5)
     
     def _start_status_updater(self):
-        """启动状态更新定时器"""
+        """启动状态更新定时器（只更新发生变化的控件）"""
+        last = {}
+        
+        def changed(status, *keys):
+            return any(key not in last or last[key] != status[key] for key in keys)
+        
+        pending = None
+        
+        def collect_status():
+            # 状态和指标都会读取 SQLite（离线队列计数），在线程池中获取
+            return self.client.get_status(), self.client.get_metrics()
+        
         def update_status():
-            status = self.client.get_status()
+            nonlocal pending
+            # 上一次获取尚未完成时跳过本轮，避免在线程池中堆积
+            if pending is None or pending.done():
+                pending = self._run_in_background(collect_status, on_done=render_status)
+            self.root.after(2000, update_status)
+        
+        def render_status(result):
+            status, metrics = result
             
             # 更新连接状态
-            if status['connected']:
-                self.conn_status.config(text=f"状态: 已连接 ({status['server_url']})", foreground="green")
-                self.connect_btn.config(state='disabled')
-            else:
-                self.conn_status.config(text="状态: 未连接", foreground="red")
-                self.connect_btn.config(state='normal')
+            if changed(status, 'connected', 'server_url'):
+                if status['connected']:
+                    self.conn_status.config(text=f"状态: 已连接 ({status['server_url']})", foreground="green")
+                    self.connect_btn.config(state='disabled')
+                else:
+                    self.conn_status.config(text="状态: 未连接", foreground="red")
+                    self.connect_btn.config(state='normal')
             
             # 更新登录状态
-            if status['authenticated']:
-                self.login_status.config(text=f"登录状态: 已登录 ({status['username']})", foreground="green")
-                self.login_btn.config(state='disabled')
-                self.logout_btn.config(state='normal')
-            else:
-                self.login_status.config(text="登录状态: 未登录", foreground="red")
-                self.login_btn.config(state='normal')
-                self.logout_btn.config(state='disabled')
+            if changed(status, 'authenticated', 'username'):
+                if status['authenticated']:
+                    self.login_status.config(text=f"登录状态: 已登录 ({status['username']})", foreground="green")
+                    self.login_btn.config(state='disabled')
+                    self.logout_btn.config(state='normal')
+                else:
+                    self.login_status.config(text="登录状态: 未登录", foreground="red")
+                    self.login_btn.config(state='normal')
+                    self.logout_btn.config(state='disabled')
             
             # 更新激活状态
-            if status['license_valid']:
-                self.license_status.config(text="激活状态: 已激活", foreground="green")
-                self.license_btn.config(state='disabled')
-                self.download_btn.config(state='normal')
-            else:
-                self.license_status.config(text="激活状态: 未激活", foreground="red")
-                self.license_btn.config(state='normal')
-                self.download_btn.config(state='disabled')
+            if changed(status, 'license_valid'):
+                if status['license_valid']:
+                    self.license_status.config(text="激活状态: 已激活", foreground="green")
+                    self.license_btn.config(state='disabled')
+                    self.download_btn.config(state='normal')
+                else:
+                    self.license_status.config(text="激活状态: 未激活", foreground="red")
+                    self.license_btn.config(state='normal')
+                    self.download_btn.config(state='disabled')
             
             # 更新状态文本
             status_info = f"""客户端状态:
@@ -280,10 +393,14 @@ class CloudflareClientGUI:
 • 活动任务: {status['active_tasks']} 个
 """
             
-            self.status_text.delete('1.0', 'end')
-            self.status_text.insert('end', status_info)
+            if status_info != last.get('status_info'):
+                self.status_text.delete('1.0', 'end')
+                self.status_text.insert('end', status_info)
             
-            self.root.after(2000, update_status)
+            last.clear()
+            last.update(status, status_info=status_info)
+            
+            self._render_metrics(metrics)
         
         update_status()
     
@@ -305,15 +422,13 @@ class CloudflareClientGUI:
         """测试连接"""
         url = self.server_url.get().strip()
         
-        def connect_thread():
-            success = self.client.connect(url)
-            
+        def on_done(success):
             if success:
-                self.root.after(0, lambda: messagebox.showinfo("成功", "服务器连接成功"))
+                messagebox.showinfo("成功", "服务器连接成功")
             else:
-                self.root.after(0, lambda: messagebox.showerror("错误", "连接服务器失败"))
+                messagebox.showerror("错误", "连接服务器失败")
         
-        threading.Thread(target=connect_thread, daemon=True).start()
+        self._run_in_background(self.client.connect, url, on_done=on_done)
     
     def login(self, username=None, password=None):
         """登录"""
@@ -329,20 +444,17 @@ class CloudflareClientGUI:
             messagebox.showwarning("警告", "请输入密码")
             return
         
-        def login_thread():
-            success = self.client.login(username, password)
-            
+        def on_done(success):
             if success:
-                self.root.after(0, lambda: messagebox.showinfo("成功", "登录成功"))
+                messagebox.showinfo("成功", "登录成功")
             else:
-                self.root.after(0, lambda: messagebox.showerror("错误", "登录失败"))
+                messagebox.showerror("错误", "登录失败")
         
-        threading.Thread(target=login_thread, daemon=True).start()
+        self._run_in_background(self.client.login, username, password, on_done=on_done)
     
     def logout(self):
         """登出"""
-        self.client.logout()
-        messagebox.showinfo("提示", "已登出")
+        self._run_in_background(self.client.logout, on_done=lambda _: messagebox.showinfo("提示", "已登出"))
     
     def validate_license(self):
         """验证激活码"""
@@ -352,15 +464,13 @@ class CloudflareClientGUI:
             messagebox.showwarning("警告", "请输入激活码")
             return
         
-        def validate_thread():
-            success = self.client.validate_license(license_key)
-            
+        def on_done(success):
             if success:
-                self.root.after(0, lambda: messagebox.showinfo("成功", "激活码验证成功"))
+                messagebox.showinfo("成功", "激活码验证成功")
             else:
-                self.root.after(0, lambda: messagebox.showerror("错误", "激活码验证失败"))
+                messagebox.showerror("错误", "激活码验证失败")
         
-        threading.Thread(target=validate_thread, daemon=True).start()
+        self._run_in_background(self.client.validate_license, license_key, on_done=on_done)
     
     def add_example_urls(self):
         """添加示例链接"""
@@ -396,31 +506,30 @@ https://www.xkw.com/doc/2024/biology/005"""
         self.progress_label.config(text="正在提交任务...")
         self.progress_bar['value'] = 0
         
-        def submit_thread():
-            task_id = self.client.submit_download_task(urls, email)
-            
+        def on_done(task_id):
             if task_id:
-                self.root.after(0, lambda: messagebox.showinfo(
+                self.progress_label.config(text=f"任务已提交，ID: {task_id}")
+                messagebox.showinfo(
                     "成功", 
                     f"任务提交成功！\n任务ID: {task_id}\n\n请等待服务器处理..."
-                ))
-                
-                self.root.after(0, lambda: self.progress_label.config(
-                    text=f"任务已提交，ID: {task_id}"
-                ))
+                )
                 
                 # 刷新历史
                 self.root.after(1000, self.refresh_history)
             else:
-                self.root.after(0, lambda: messagebox.showerror("错误", "任务提交失败"))
+                messagebox.showerror("错误", "任务提交失败")
         
-        threading.Thread(target=submit_thread, daemon=True).start()
+        self._run_in_background(self.client.submit_download_task, urls, email, on_done=on_done)
     
     def check_status(self):
-        """检查状态"""
-        status = self.client.get_status()
-        stats = self.client.get_server_stats()
+        """检查状态（服务器统计和本地状态都在后台读取）"""
+        def collect():
+            return self.client.get_server_stats(), self.client.get_status()
         
+        self._run_in_background(collect, on_done=lambda result: self._show_status_check(*result))
+    
+    def _show_status_check(self, stats: dict, status: dict):
+        """显示状态检查结果"""
         status_text = f"客户端状态:\n"
         status_text += f"• 连接: {'✅已连接' if status['connected'] else '❌未连接'}\n"
         status_text += f"• 登录: {'✅已登录' if status['authenticated'] else '❌未登录'}\n"
@@ -438,33 +547,91 @@ https://www.xkw.com/doc/2024/biology/005"""
         messagebox.showinfo("状态检查", status_text)
     
     def refresh_history(self):
-        """刷新历史记录"""
-        # 清空现有数据
-        for item in self.history_tree.get_children():
-            self.history_tree.delete(item)
+        """刷新历史记录（先显示本地历史，再在后台与服务器同步）"""
+        self._render_history()
+        
+        def on_done(changed):
+            if changed:
+                self._render_history()
         
+        self._run_in_background(self.client.sync_history, on_done=on_done)
+    
+    def load_more_history(self):
+        """多加载一页历史"""
+        if len(self._history_rows) < self._history_total:
+            self._history_limit += self.HISTORY_PAGE_SIZE
+            self._render_history()
+    
+    def _on_history_scroll(self, first, last):
+        """列表滚动到底部时自动加载下一页"""
+        self.history_scrollbar.set(first, last)
+        if (float(last) >= 1.0 and not self._history_loading
+                and len(self._history_rows) < self._history_total):
+            self._history_loading = True
+            self.root.after_idle(self._load_more_on_scroll)
+    
+    def _load_more_on_scroll(self):
+        self._history_loading = False
+        self.load_more_history()
+    
+    @staticmethod
+    def _history_row(task: dict) -> tuple:
+        """任务记录 -> 列表行值"""
+        created_at = task.get('created_at') or ''
+        completed_at = task.get('completed_at') or ''
+        
+        if created_at and len(created_at) > 10:
+            created_at = created_at[:19]
+        if completed_at and len(completed_at) > 10:
+            completed_at = completed_at[:19]
+        
+        return (
+            task.get('task_id', ''),
+            task.get('status', ''),
+            f"{task.get('progress', 0)}%",
+            len(task.get('downloaded_files', [])),
+            created_at,
+            completed_at
+        )
+    
+    def _render_history(self):
+        """用本地历史增量更新列表：按 task_id 只插入、删除、修改有变化的行"""
         try:
-            tasks = self.client.get_all_tasks()
-            
-            for task in tasks[:20]:  # 只显示最近20条
-                created_at = task.get('created_at', '')
-                completed_at = task.get('completed_at', '')
-                
-                if created_at and len(created_at) > 10:
-                    created_at = created_at[:19]
-                if completed_at and len(completed_at) > 10:
-                    completed_at = completed_at[:19]
-                
-                self.history_tree.insert('', 'end', values=(
-                    task.get('task_id', ''),
-                    task.get('status', ''),
-                    f"{task.get('progress', 0)}%",
-                    len(task.get('downloaded_files', [])),
-                    created_at,
-                    completed_at
-                ))
+            tasks = self.client.get_history(limit=self._history_limit)
+            self._history_total = self.client.count_history()
         except Exception as e:
-            print(f"刷新历史记录失败: {e}")
+            self.logger.error(f"刷新历史记录失败: {e}")
+            return
+        
+        rows = {}
+        for task in tasks:
+            if task.get('task_id'):
+                rows[task['task_id']] = self._history_row(task)
+        
+        tree = self.history_tree
+        previous = self._history_rows
+        
+        for task_id in previous:
+            if task_id not in rows:
+                tree.delete(task_id)
+        
+        # 已有行的相对顺序不变时只需插入新行；否则逐行移动（很少发生）
+        kept_before = [task_id for task_id in previous if task_id in rows]
+        kept_after = [task_id for task_id in rows if task_id in previous]
+        reorder = kept_before != kept_after
+        
+        for index, (task_id, values) in enumerate(rows.items()):
+            old_values = previous.get(task_id)
+            if old_values is None:
+                tree.insert('', index, iid=task_id, values=values)
+                continue
+            if old_values != values:
+                tree.item(task_id, values=values)
+            if reorder:
+                tree.move(task_id, '', index)
+        
+        self._history_rows = rows
+        self.history_count_label.config(text=f"显示 {len(rows)} / {self._history_total} 条")
     
     def view_task_detail(self):
         """查看任务详情"""
@@ -477,15 +644,26 @@ https://www.xkw.com/doc/2024/biology/005"""
         values = self.history_tree.item(item, 'values')
         task_id = values[0]
         
-        task_info = self.client.get_task_info(task_id)
+        # 本地历史中已完成的任务不会再变化，无需请求服务器
+        task_info = self.client.get_history_entry(task_id)
+        if self.client.authenticated and (not task_info or task_info.get('status') != 'completed'):
+            self._run_in_background(
+                lambda: self.client.get_task_info(task_id) or task_info,
+                on_done=self._show_task_detail
+            )
+        else:
+            self._show_task_detail(task_info)
+    
+    def _show_task_detail(self, task_info: dict):
+        """显示任务详情"""
         if task_info:
             detail = f"任务ID: {task_info.get('task_id')}\n"
             detail += f"状态: {task_info.get('status')}\n"
             detail += f"进度: {task_info.get('progress')}%\n"
             detail += f"用户: {task_info.get('username')}\n"
             detail += f"邮箱: {task_info.get('email')}\n"
-            detail += f"创建时间: {task_info.get('created_at', '')[:19]}\n"
-            detail += f"完成时间: {task_info.get('completed_at', '')[:19]}\n"
+            detail += f"创建时间: {(task_info.get('created_at') or '')[:19]}\n"
+            detail += f"完成时间: {(task_info.get('completed_at') or '')[:19]}\n"
             detail += f"文件数: {len(task_info.get('downloaded_files', []))}\n"
             
             # 显示下载链接
@@ -515,20 +693,33 @@ https://www.xkw.com/doc/2024/biology/005"""
             messagebox.showwarning("警告", "任务未完成，无法下载")
             return
         
-        links = self.client.get_download_links(task_id)
-        if links:
-            import webbrowser
-            for link in links[:3]:  # 最多打开3个链接
-                webbrowser.open(link)
+        self.progress_label.config(text=f"正在下载任务文件: {task_id}")
+        
+        def on_done(result):
+            if not result["files"]:
+                return
             
-            messagebox.showinfo("下载", f"已开始下载 {len(links)} 个文件")
-        else:
-            messagebox.showwarning("警告", "没有可用的下载链接")
+            message = f"下载完成: {result['succeeded']}/{len(result['files'])} 个文件\n"
+            message += f"保存目录: {result['directory']}\n"
+            message += f"总大小: {result['bytes'] / 1024:.1f} KB，平均速度: {result['throughput'] / 1024:.1f} KB/s"
+            
+            failed = [f for f in result["files"] if f["error"]]
+            if failed:
+                message += f"\n\n失败 {len(failed)} 个（再次点击可续传）:\n"
+                for f in failed[:3]:
+                    message += f"• {f['url']}: {f['error']}\n"
+            
+            self.progress_label.config(text=f"任务文件已下载: {task_id}")
+            messagebox.showinfo("下载", message)
+        
+        self._run_in_background(self.client.download_task_files, task_id, on_done=on_done)
     
     def refresh_status(self):
         """刷新状态"""
-        stats = self.client.get_server_stats()
-        
+        self._run_in_background(self.client.get_server_stats, on_done=self._render_server_stats)
+    
+    def _render_server_stats(self, stats: dict):
+        """显示服务器统计"""
         stats_text = f"服务器统计信息:\n"
         stats_text += f"• 总用户数: {stats.get('total_users', 0)}\n"
         stats_text += f"• 活跃用户: {stats.get('active_users', 0)}\n"
@@ -546,6 +737,74 @@ https://www.xkw.com/doc/2024/biology/005"""
         self.stats_text.delete('1.0', 'end')
         self.stats_text.insert('end', stats_text)
     
+    @staticmethod
+    def _format_ms(value) -> str:
+        return f"{value:.0f}ms" if value is not None else "-"
+    
+    def _render_metrics(self, metrics: dict):
+        """增量更新请求指标列表（metrics 由 client.get_metrics() 在后台线程获取）"""
+        rows = {}
+        for name, endpoint in metrics["endpoints"].items():
+            rows[name] = (
+                name,
+                endpoint["requests"],
+                sum(endpoint["errors"].values()),
+                endpoint["retries"],
+                self._format_ms(endpoint["latency"]["p50_ms"]),
+                self._format_ms(endpoint["latency"]["p95_ms"]),
+                self._format_ms(endpoint["latency"]["p99_ms"]),
+                self._format_ms(endpoint["server_latency"]["p50_ms"]),
+                self._format_ms(endpoint["kv_latency"]["p50_ms"]),
+                f"{endpoint['bytes_received'] / 1024:.1f}KB"
+            )
+        
+        for name in self._metrics_rows:
+            if name not in rows:
+                self.metrics_tree.delete(name)
+        
+        # 接口按名称排序，新接口插入到对应位置
+        for index, (name, values) in enumerate(rows.items()):
+            old_values = self._metrics_rows.get(name)
+            if old_values is None:
+                self.metrics_tree.insert('', index, iid=name, values=values)
+            elif old_values != values:
+                self.metrics_tree.item(name, values=values)
+        
+        self._metrics_rows = rows
+        
+        durations = metrics["tasks"]["end_to_end"]
+        parts = [f"{status} {d['count']}个 p50 {d['p50_ms'] / 1000:.1f}s p95 {d['p95_ms'] / 1000:.1f}s"
+                 for status, d in durations.items()]
+        text = f"任务耗时（提交到结束）: {'；'.join(parts) if parts else '暂无数据'}，进行中 {metrics['tasks']['in_flight']} 个"
+        if self.task_metrics_label.cget('text') != text:
+            self.task_metrics_label.config(text=text)
+    
+    def export_metrics(self):
+        """导出 Prometheus 文本格式的指标"""
+        path = filedialog.asksaveasfilename(
+            title="导出指标", defaultextension=".prom", initialfile="cloudflare_client.prom",
+            filetypes=[("Prometheus", "*.prom"), ("文本文件", "*.txt")]
+        )
+        if not path:
+            return
+        
+        # 序列化和写文件在后台执行，返回错误信息（成功时为 None）
+        def write():
+            try:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(self.client.get_metrics_prometheus())
+                return None
+            except Exception as e:
+                return str(e)
+        
+        def on_done(error):
+            if error:
+                messagebox.showerror("错误", f"导出指标失败: {error}")
+            else:
+                messagebox.showinfo("成功", f"指标已导出到:\n{path}")
+        
+        self._run_in_background(write, on_done=on_done)
+    
     def save_config(self):
         """保存配置"""
         try:
@@ -563,7 +822,11 @@ https://www.xkw.com/doc/2024/biology/005"""
             messagebox.showerror("错误", f"保存配置失败: {e}")
     
     def on_status_update(self, status_type: str, data: dict):
-        """处理状态更新"""
+        """处理状态更新（由客户端后台线程调用，转交主线程处理）"""
+        self.post_to_ui(self._handle_status_update, status_type, data)
+    
+    def _handle_status_update(self, status_type: str, data: dict):
+        """在主线程中应用状态更新"""
         if status_type == "license_valid":
             # 更新激活信息显示
             self.days_left.config(text=str(data.get("days_left", 0)))
@@ -592,9 +855,9 @@ https://www.xkw.com/doc/2024/biology/005"""
                 if len(direct_links) > 3:
                     message += f"... 还有 {len(direct_links) - 3} 个链接\n"
             
-            self.root.after(0, lambda: messagebox.showinfo("下载完成", message))
-            self.root.after(0, lambda: self.progress_label.config(text="下载完成"))
-            self.root.after(0, lambda: self.progress_bar.config(value=100))
+            self.progress_label.config(text="下载完成")
+            self.progress_bar.config(value=100)
+            messagebox.showinfo("下载完成", message)
             
             # 刷新历史记录
             self.root.after(1000, self.refresh_history)
@@ -604,13 +867,12 @@ https://www.xkw.com/doc/2024/biology/005"""
             task_id = data.get("task_id", "")
             message = data.get("message", "")
             
-            self.root.after(0, lambda: messagebox.showinfo("任务保存", 
-                f"任务已保存\n任务ID: {task_id}\n\n{message}"))
+            messagebox.showinfo("任务保存", f"任务已保存\n任务ID: {task_id}\n\n{message}")
     
     def on_error(self, error: Exception):
-        """处理错误"""
+        """处理错误（可在任意线程调用）"""
         error_msg = str(error)
-        self.root.after(0, lambda: messagebox.showerror("错误", f"发生错误:\n\n{error_msg}"))
+        self.post_to_ui(lambda: messagebox.showerror("错误", f"发生错误:\n\n{error_msg}"))
 
 def main():
     """主函数"""
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""
+本地任务历史 - SQLite(WAL) 存储，按任务ID、状态和创建时间索引
+"""
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import List, Dict, Optional
+
+# 表结构版本（PRAGMA user_version）：1 起 created_at 统一为 UTC ISO-8601
+SCHEMA_VERSION = 1
+
+def utc_isoformat(moment: datetime = None) -> str:
+    """与服务器 Date.toISOString() 相同的格式：2024-01-01T08:00:00.000Z"""
+    moment = (moment or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+def normalize_timestamp(value: Optional[str]) -> str:
+    """把 ISO-8601 时间统一为 UTC（不带时区的值按本地时间处理），无法解析时原样返回"""
+    if not value:
+        return ""
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        return value
+    # astimezone 对不带时区的时间按本地时区解释
+    return utc_isoformat(moment)
+
+class TaskHistoryStore:
+    """本地任务历史：每个任务一行，写入为单行 upsert，超出保留条数时定期清理"""
+
+    # 每写入多少次检查一次保留条数
+    PRUNE_EVERY = 100
+
+    def __init__(self, db_path: str = "download_history.db", max_entries: int = 1000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.logger = logging.getLogger("CloudflareHistory")
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS task_history (
+                task_id TEXT PRIMARY KEY,
+                status TEXT,
+                created_at TEXT,
+                updated_at REAL NOT NULL,
+                payload TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_status ON task_history (status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_created ON task_history (created_at)")
+        try:
+            self._migrate()
+        except Exception as e:
+            # 迁移未完成时版本号不变，下次启动重试
+            self.logger.error(f"迁移历史记录失败: {e}")
+
+    def _migrate(self):
+        """旧版本地创建的任务 created_at 为本地时间，统一转为 UTC 以便与服务器时间一起排序"""
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._conn.execute("SELECT task_id, created_at, payload FROM task_history").fetchall()
+            for task_id, created_at, payload in rows:
+                normalized = normalize_timestamp(created_at)
+                if normalized == created_at:
+                    continue
+                task = json.loads(payload)
+                task["created_at"] = normalized
+                self._conn.execute(
+                    "UPDATE task_history SET created_at = ?, payload = ? WHERE task_id = ?",
+                    (normalized, json.dumps(task, ensure_ascii=False), task_id)
+                )
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+    def upsert(self, task: Dict) -> bool:
+        """写入或合并一条任务记录"""
+        return self.upsert_many([task])
+
+    def upsert_many(self, tasks: List[Dict]) -> bool:
+        """批量写入或合并任务记录（单个事务）"""
+        tasks = [t for t in tasks if t.get("task_id")]
+        if not tasks:
+            return True
+
+        try:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for task in tasks:
+                        row = self._conn.execute(
+                            "SELECT payload FROM task_history WHERE task_id = ?", (task["task_id"],)
+                        ).fetchone()
+                        merged = {**json.loads(row[0]), **task} if row else dict(task)
+                        if merged.get("created_at"):
+                            merged["created_at"] = normalize_timestamp(merged["created_at"])
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO task_history (task_id, status, created_at, updated_at, payload) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (merged["task_id"], merged.get("status"), merged.get("created_at") or "",
+                             time.time(), json.dumps(merged, ensure_ascii=False))
+                        )
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+
+                self._writes += len(tasks)
+                if self._writes >= self.PRUNE_EVERY:
+                    self._writes = 0
+                    self._prune()
+            return True
+        except Exception as e:
+            self.logger.error(f"保存历史记录失败: {e}")
+            return False
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        """按任务ID读取"""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT payload FROM task_history WHERE task_id = ?", (task_id,)
+                ).fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            self.logger.error(f"读取历史记录失败: {e}")
+            return None
+
+    def query(self, status: str = None, since: str = None, limit: int = 50,
+              offset: int = 0) -> List[Dict]:
+        """按创建时间倒序查询，可按状态和创建时间（ISO字符串，不带时区时按本地时间）过滤"""
+        conditions, params = [], []
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if since:
+            conditions.append("created_at >= ?")
+            params.append(normalize_timestamp(since))
+
+        sql = "SELECT payload FROM task_history"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+
+        try:
+            with self._lock:
+                rows = self._conn.execute(sql, params).fetchall()
+            return [json.loads(row[0]) for row in rows]
+        except Exception as e:
+            self.logger.error(f"查询历史记录失败: {e}")
+            return []
+
+    def count(self, status: str = None) -> int:
+        """记录数"""
+        try:
+            with self._lock:
+                if status:
+                    return self._conn.execute(
+                        "SELECT COUNT(*) FROM task_history WHERE status = ?", (status,)
+                    ).fetchone()[0]
+                return self._conn.execute("SELECT COUNT(*) FROM task_history").fetchone()[0]
+        except Exception as e:
+            self.logger.error(f"统计历史记录失败: {e}")
+            return 0
+
+    def prune(self) -> int:
+        """立即按保留条数清理，返回删除数量"""
+        try:
+            with self._lock:
+                return self._prune()
+        except Exception as e:
+            self.logger.error(f"清理历史记录失败: {e}")
+            return 0
+
+    def _prune(self) -> int:
+        """删除超出保留条数的最旧记录（调用方持有锁）"""
+        if not self.max_entries or self.max_entries <= 0:
+            return 0
+        cursor = self._conn.execute(
+            "DELETE FROM task_history WHERE task_id IN ("
+            "SELECT task_id FROM task_history ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        return cursor.rowcount
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+"""
+客户端指标 - 按接口统计请求数、流量、延迟分布、重试和错误，以及任务端到端耗时
+"""
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# 路径中这些段之后的一段是资源ID，统计时归并为 {id}
+ID_PARENT_SEGMENTS = ("users", "tasks", "licenses")
+
+# 文件下载路径 /download/{任务ID}/{文件名} 整体归并为一个接口
+DOWNLOAD_PATH_TEMPLATE = "/download/{id}/{file}"
+
+# 导出的分位数
+QUANTILES = (0.5, 0.95, 0.99)
+
+def normalize_path(path: str) -> str:
+    """把具体路径归并为接口模板，如 /api/users/u1/tasks -> /api/users/{id}/tasks"""
+    path = path.split("?", 1)[0]
+    if path.startswith("/download/"):
+        return DOWNLOAD_PATH_TEMPLATE
+    segments = path.split("/")
+    for i in range(1, len(segments)):
+        # 带冒号的是自定义方法（如 tasks:batch、status:batch），不是ID
+        if segments[i - 1] in ID_PARENT_SEGMENTS and segments[i] and ":" not in segments[i]:
+            segments[i] = "{id}"
+    return "/".join(segments) or "/"
+
+class LatencyHistogram:
+    """HDR风格的对数-线性直方图：按2的幂分段，每段再等分为若干子桶
+
+    以微秒整数记录，相对误差约为 1/SUB_BUCKETS，内存只随数值范围的量级增长。
+    """
+
+    SUB_BUCKET_BITS = 5
+    SUB_BUCKETS = 1 << (SUB_BUCKET_BITS - 1)
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds: float):
+        """记录一次耗时（秒）"""
+        value = max(0, int(seconds * 1_000_000))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.SUB_BUCKET_BITS
+        if shift <= 0:
+            return value
+        return shift * self.SUB_BUCKETS + (value >> shift)
+
+    def _upper_bound(self, index: int) -> int:
+        """桶内最大值（微秒）"""
+        if index < 2 * self.SUB_BUCKETS:
+            return index
+        shift, top = divmod(index, self.SUB_BUCKETS)
+        top += self.SUB_BUCKETS
+        shift -= 1
+        return ((top + 1) << shift) - 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """分位数（秒），取所在桶的上界，不超过实际最大值"""
+        if not self.count:
+            return None
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._upper_bound(index) / 1_000_000, self.max)
+        return self.max
+
+    def summary(self) -> Dict:
+        """count/mean/min/max 和各分位数（毫秒）"""
+        result = {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else None,
+            "min_ms": self.min * 1000 if self.min is not None else None,
+            "max_ms": self.max * 1000 if self.max is not None else None
+        }
+        for q in QUANTILES:
+            value = self.quantile(q)
+            result[f"p{int(q * 100)}_ms"] = value * 1000 if value is not None else None
+        return result
+
+class _EndpointStats:
+    """单个接口的统计"""
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = LatencyHistogram()
+        # 服务器处理耗时（Server-Timing），与总延迟相减即为网络耗时
+        self.server = LatencyHistogram()
+        self.kv = LatencyHistogram()
+
+class ClientMetrics:
+    """线程安全的客户端指标"""
+
+    # 最多同时跟踪的未完成任务数（超出时丢弃最早的）
+    MAX_TRACKED_TASKS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._endpoints: Dict[str, _EndpointStats] = {}
+        self._task_submitted: "OrderedDict[str, float]" = OrderedDict()
+        self._task_durations: Dict[str, LatencyHistogram] = {}
+
+    def _endpoint(self, path: str) -> _EndpointStats:
+        stats = self._endpoints.get(path)
+        if stats is None:
+            stats = self._endpoints[path] = _EndpointStats()
+        return stats
+
+    def record_request(self, method: str, path: str, status: int, seconds: float,
+                       bytes_sent: int = 0, bytes_received: int = 0, server_timing: str = None):
+        """记录一次完成的请求（每次尝试单独记录）"""
+        timings = parse_server_timing(server_timing)
+        with self._lock:
+            stats = self._endpoint(f"{method} {normalize_path(path)}")
+            stats.requests += 1
+            status_class = f"{status // 100}xx"
+            stats.statuses[status_class] = stats.statuses.get(status_class, 0) + 1
+            if status >= 400:
+                stats.errors[f"http_{status}"] = stats.errors.get(f"http_{status}", 0) + 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.latency.record(seconds)
+            if "total" in timings:
+                stats.server.record(timings["total"])
+            if "kv" in timings:
+                stats.kv.record(timings["kv"])
+
+    def record_error(self, method: str, path: str, error: Exception, seconds: float):
+        """记录一次未得到响应的请求（连接失败、超时等）"""
+        with self._lock:
+            stats = self._endpoint(f"{method} {normalize_path(path)}")
+            stats.requests += 1
+            kind = type(error).__name__
+            stats.errors[kind] = stats.errors.get(kind, 0) + 1
+            stats.latency.record(seconds)
+
+    def record_retry(self, method: str, path: str):
+        """记录一次重试"""
+        with self._lock:
+            self._endpoint(f"{method} {normalize_path(path)}").retries += 1
+
+    def task_submitted(self, task_id: str):
+        """记录任务提交时间"""
+        with self._lock:
+            self._task_submitted[task_id] = time.time()
+            while len(self._task_submitted) > self.MAX_TRACKED_TASKS:
+                self._task_submitted.popitem(last=False)
+
+    def task_finished(self, task_id: str, status: str):
+        """任务结束（完成或失败），记录从提交到结束的耗时"""
+        with self._lock:
+            submitted = self._task_submitted.pop(task_id, None)
+            if submitted is None:
+                return
+            histogram = self._task_durations.get(status)
+            if histogram is None:
+                histogram = self._task_durations[status] = LatencyHistogram()
+            histogram.record(time.time() - submitted)
+
+    def snapshot(self) -> Dict:
+        """当前指标的字典形式"""
+        with self._lock:
+            endpoints = {}
+            for name, stats in sorted(self._endpoints.items()):
+                endpoints[name] = {
+                    "requests": stats.requests,
+                    "statuses": dict(stats.statuses),
+                    "errors": dict(stats.errors),
+                    "retries": stats.retries,
+                    "bytes_sent": stats.bytes_sent,
+                    "bytes_received": stats.bytes_received,
+                    "latency": stats.latency.summary(),
+                    "server_latency": stats.server.summary(),
+                    "kv_latency": stats.kv.summary()
+                }
+
+            return {
+                "uptime": time.time() - self._started,
+                "endpoints": endpoints,
+                "tasks": {
+                    "in_flight": len(self._task_submitted),
+                    "end_to_end": {status: histogram.summary()
+                                   for status, histogram in sorted(self._task_durations.items())}
+                }
+            }
+
+    def to_prometheus(self, gauges: Dict[str, Tuple[float, str]] = None) -> str:
+        """Prometheus 文本格式；延迟以 summary 形式导出（单位秒）
+
+        gauges 为附加的 {名称: (值, 说明)}
+        """
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def summary(name: str, labels: str, histogram: LatencyHistogram):
+            for q in QUANTILES:
+                value = histogram.quantile(q)
+                if value is not None:
+                    lines.append(f'{name}{{{labels},quantile="{q}"}} {value:.6f}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.total:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+
+            family("cloudflare_client_requests_total", "counter", "按接口和状态分类的请求数")
+            for name, stats in endpoints:
+                for status_class, count in sorted(stats.statuses.items()):
+                    lines.append(f'cloudflare_client_requests_total{{{_labels(name)},status="{status_class}"}} {count}')
+
+            family("cloudflare_client_errors_total", "counter", "按接口和错误类型分类的错误数")
+            for name, stats in endpoints:
+                for kind, count in sorted(stats.errors.items()):
+                    lines.append(f'cloudflare_client_errors_total{{{_labels(name)},kind="{kind}"}} {count}')
+
+            family("cloudflare_client_retries_total", "counter", "重试次数")
+            for name, stats in endpoints:
+                lines.append(f"cloudflare_client_retries_total{{{_labels(name)}}} {stats.retries}")
+
+            family("cloudflare_client_bytes_total", "counter", "请求和响应体字节数")
+            for name, stats in endpoints:
+                lines.append(f'cloudflare_client_bytes_total{{{_labels(name)},direction="sent"}} {stats.bytes_sent}')
+                lines.append(f'cloudflare_client_bytes_total{{{_labels(name)},direction="received"}} {stats.bytes_received}')
+
+            family("cloudflare_client_request_duration_seconds", "summary", "客户端观测到的请求延迟")
+            for name, stats in endpoints:
+                summary("cloudflare_client_request_duration_seconds", _labels(name), stats.latency)
+
+            family("cloudflare_client_server_duration_seconds", "summary", "服务器处理耗时（Server-Timing）")
+            for name, stats in endpoints:
+                if stats.server.count:
+                    summary("cloudflare_client_server_duration_seconds", _labels(name), stats.server)
+
+            family("cloudflare_client_kv_duration_seconds", "summary", "服务器处理中KV读写耗时（Server-Timing）")
+            for name, stats in endpoints:
+                if stats.kv.count:
+                    summary("cloudflare_client_kv_duration_seconds", _labels(name), stats.kv)
+
+            family("cloudflare_client_task_duration_seconds", "summary", "任务从提交到结束的耗时")
+            for status, histogram in sorted(self._task_durations.items()):
+                summary("cloudflare_client_task_duration_seconds", f'status="{status}"', histogram)
+
+            family("cloudflare_client_tasks_in_flight", "gauge", "已提交未结束的任务数")
+            lines.append(f"cloudflare_client_tasks_in_flight {len(self._task_submitted)}")
+
+        for name, (value, help_text) in (gauges or {}).items():
+            family(name, "gauge", help_text)
+            lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+def _labels(endpoint: str) -> str:
+    """'GET /api/ping' -> method="GET",path="/api/ping" """
+    method, _, path = endpoint.partition(" ")
+    return f'method="{method}",path="{_escape(path)}"'
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+_SERVER_TIMING_RE = re.compile(r"dur=([0-9.]+)")
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """解析 Server-Timing 头，返回 {名称: 秒}"""
+    timings = {}
+    if not header:
+        return timings
+    for metric in header.split(","):
+        name = metric.split(";", 1)[0].strip()
+        match = _SERVER_TIMING_RE.search(metric)
+        if name and match:
+            timings[name] = float(match.group(1)) / 1000
+    return timings
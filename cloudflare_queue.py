@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+离线任务队列 - SQLite(WAL) 持久化，至少一次投递
+"""
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import List, Dict, Optional
+
+class OfflineTaskQueue:
+    """未能在线提交的任务队列
+
+    任务出队时只加租约，提交成功后 ack 才删除；进程崩溃或提交失败时
+    任务会在租约到期后重新可见。重试次数达到上限的任务标记为 failed 保留。
+    """
+
+    def __init__(self, db_path: str = "pending_tasks.db", max_attempts: int = 5,
+                 lease_seconds: float = 300):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.logger = logging.getLogger("CloudflareQueue")
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_tasks (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT UNIQUE NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                leased_until REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_pending_ready ON pending_tasks (status, leased_until)"
+        )
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+    def enqueue(self, task: Dict) -> bool:
+        """加入队列（同一 task_id 只保留一条）"""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO pending_tasks (task_id, payload, created_at) VALUES (?, ?, ?)",
+                    (task["task_id"], json.dumps(task, ensure_ascii=False), time.time())
+                )
+            return True
+        except Exception as e:
+            self.logger.error(f"任务入队失败: {e}")
+            return False
+
+    def claim(self, limit: int = 100) -> List[Dict]:
+        """取出可提交的任务并加租约，返回 [{"task_id", "task", "attempts"}]"""
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    rows = self._conn.execute(
+                        "SELECT task_id, payload, attempts FROM pending_tasks "
+                        "WHERE status = 'queued' AND leased_until <= ? ORDER BY seq LIMIT ?",
+                        (now, limit)
+                    ).fetchall()
+                    self._conn.executemany(
+                        "UPDATE pending_tasks SET leased_until = ?, attempts = attempts + 1 WHERE task_id = ?",
+                        [(now + self.lease_seconds, row[0]) for row in rows]
+                    )
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+
+            return [{"task_id": task_id, "task": json.loads(payload), "attempts": attempts + 1}
+                    for task_id, payload, attempts in rows]
+        except Exception as e:
+            self.logger.error(f"读取等待任务失败: {e}")
+            return []
+
+    def ack(self, task_id: str):
+        """提交成功，删除任务"""
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM pending_tasks WHERE task_id = ?", (task_id,))
+        except Exception as e:
+            self.logger.error(f"确认任务失败: {e}")
+
+    def nack(self, task_id: str, error: str = None, retry_delay: float = 0):
+        """提交失败，释放租约；超过重试上限时标记为 failed"""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE pending_tasks SET leased_until = ?, last_error = ?, "
+                    "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END "
+                    "WHERE task_id = ?",
+                    (time.time() + retry_delay, error, self.max_attempts, task_id)
+                )
+        except Exception as e:
+            self.logger.error(f"释放任务失败: {e}")
+
+    def next_ready_time(self) -> Optional[float]:
+        """最早可被取出的排队任务的时间戳；队列为空时返回 None"""
+        try:
+            with self._lock:
+                return self._conn.execute(
+                    "SELECT MIN(leased_until) FROM pending_tasks WHERE status = 'queued'"
+                ).fetchone()[0]
+        except Exception as e:
+            self.logger.error(f"读取等待任务失败: {e}")
+            return None
+
+    def count(self, status: str = "queued") -> int:
+        """指定状态的任务数"""
+        try:
+            with self._lock:
+                return self._conn.execute(
+                    "SELECT COUNT(*) FROM pending_tasks WHERE status = ?", (status,)
+                ).fetchone()[0]
+        except Exception as e:
+            self.logger.error(f"统计等待任务失败: {e}")
+            return 0
+
+    def list_tasks(self, status: str = None) -> List[Dict]:
+        """列出队列中的任务（含重试次数和最后一次错误）"""
+        query = "SELECT payload, status, attempts, last_error FROM pending_tasks"
+        params = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        try:
+            with self._lock:
+                rows = self._conn.execute(query + " ORDER BY seq", params).fetchall()
+            return [{**json.loads(payload), "queue_status": row_status,
+                     "attempts": attempts, "last_error": last_error}
+                    for payload, row_status, attempts, last_error in rows]
+        except Exception as e:
+            self.logger.error(f"读取等待任务失败: {e}")
+            return []
+
+    def requeue_failed(self) -> int:
+        """把失败任务重新放回队列，返回数量"""
+        try:
+            with self._lock:
+                cursor = self._conn.execute(
+                    "UPDATE pending_tasks SET status = 'queued', attempts = 0, leased_until = 0 "
+                    "WHERE status = 'failed'"
+                )
+            return cursor.rowcount
+        except Exception as e:
+            self.logger.error(f"重置失败任务失败: {e}")
+            return 0
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+HTTP传输适配器 - 连接池调优、TCP keep-alive、可选HTTP/2
+"""
+import os
+import ssl
+import socket
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import DEFAULT_CA_BUNDLE_PATH, get_encoding_from_headers, select_proxy
+from urllib3.connection import HTTPConnection
+
+# HTTP/2 禁止携带的逐跳头
+HOP_BY_HOP_HEADERS = ("connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade")
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTP/1.1 连接池：开启TCP keep-alive，避免空闲连接被中间设备静默断开"""
+
+    def __init__(self, keepalive_idle: Optional[int] = 60, **kwargs):
+        options = list(HTTPConnection.default_socket_options)
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if keepalive_idle and hasattr(socket, "TCP_KEEPIDLE"):
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, keepalive_idle))
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, keepalive_idle // 4)))
+        # 父类构造函数会调用 init_poolmanager，需先设置
+        self.socket_options = options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+class _Http2Body:
+    """把 httpx 的流式响应包装成 requests 需要的 raw 文件对象"""
+
+    def __init__(self, response):
+        self._response = response
+        self._chunks = response.iter_bytes()
+        self._buffer = b""
+        self._done = False
+
+    def read(self, amt: Optional[int] = None, **kwargs) -> bytes:
+        while not self._done and (amt is None or len(self._buffer) < amt):
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                self.close()
+            except Exception as e:
+                self.close()
+                raise requests.exceptions.ConnectionError(e)
+
+        if amt is None:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        if not self._done:
+            self._done = True
+            self._response.close()
+
+class Http2Adapter(BaseAdapter):
+    """基于 httpx 的传输适配器：所有线程的请求在少量 HTTP/2 连接上多路复用
+
+    需要安装 httpx[http2]；挂载到 requests.Session 后调用方式不变。
+    requests 传入的 verify/cert/proxies 均生效：每种组合使用一个独立的 httpx 客户端（连接池）。
+    """
+
+    def __init__(self, max_connections: int = 4, keepalive_expiry: float = 60, http2: bool = True):
+        super().__init__()
+        import httpx
+        if http2:
+            # 客户端按需创建，提前检查依赖，缺失时由 mount_transport 回退到 HTTP/1.1
+            import h2  # noqa: F401
+
+        self._httpx = httpx
+        self._http2 = http2
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._clients: Dict[Tuple, "httpx.Client"] = {}
+        self._lock = threading.Lock()
+
+    def _get_client(self, verify, cert, proxy: Optional[str]):
+        """按 (verify, cert, proxy) 取得客户端，首次使用时创建"""
+        if isinstance(cert, list):
+            cert = tuple(cert)
+        key = (verify, cert, proxy)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                # 代理和证书已由 requests 按环境变量解析，httpx 不再读取环境
+                client = self._clients[key] = self._httpx.Client(
+                    http2=self._http2,
+                    limits=self._limits,
+                    verify=_ssl_context(verify, cert),
+                    proxy=proxy,
+                    trust_env=False
+                )
+            return client
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        httpx = self._httpx
+        if isinstance(timeout, tuple):
+            connect_timeout, read_timeout = timeout
+            timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        else:
+            timeout = httpx.Timeout(timeout)
+
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS]
+        if not request.url.lower().startswith("https://"):
+            # 与 HTTPAdapter 一致：明文请求忽略证书设置，共用同一客户端
+            verify, cert = True, None
+        try:
+            client = self._get_client(verify, cert, select_proxy(request.url, proxies or {}))
+        except (OSError, ValueError) as e:
+            # CA 文件或客户端证书无法加载
+            raise requests.exceptions.SSLError(e, request=request)
+
+        try:
+            response = client.send(
+                client.build_request(request.method, request.url, headers=headers,
+                                     content=request.body, timeout=timeout),
+                stream=True
+            )
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(e, request=request)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(e, request=request)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+
+        result = requests.Response()
+        result.status_code = response.status_code
+        result.headers = CaseInsensitiveDict(response.headers.items())
+        result.encoding = get_encoding_from_headers(result.headers)
+        result.reason = response.reason_phrase
+        result.raw = _Http2Body(response)
+        result.url = request.url
+        result.request = request
+        result.connection = self
+        return result
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+
+def _ssl_context(verify, cert) -> ssl.SSLContext:
+    """按 requests 的 verify/cert 语义构造 SSL 上下文
+
+    verify 为 False 时不校验证书，为路径时使用指定的 CA 文件或目录；
+    cert 为客户端证书路径或 (证书, 私钥) 元组。
+    """
+    if verify is False:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif isinstance(verify, str):
+        if os.path.isdir(verify):
+            context = ssl.create_default_context(capath=verify)
+        else:
+            context = ssl.create_default_context(cafile=verify)
+    else:
+        context = ssl.create_default_context(cafile=DEFAULT_CA_BUNDLE_PATH)
+
+    if cert:
+        if isinstance(cert, str):
+            context.load_cert_chain(cert)
+        else:
+            context.load_cert_chain(*cert)
+    return context
+
+def mount_transport(session: requests.Session, connection: dict) -> str:
+    """按 connection 配置为会话挂载传输适配器，返回 https 实际使用的协议"""
+    logger = logging.getLogger("CloudflareTransport")
+    keep_alive = connection.get("keep_alive", True)
+
+    adapter = KeepAliveAdapter(
+        keepalive_idle=connection.get("keep_alive_idle", 60) if keep_alive else None,
+        pool_connections=connection.get("pool_connections", 4),
+        pool_maxsize=connection.get("pool_maxsize", 16),
+        pool_block=connection.get("pool_block", False)
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    if not keep_alive:
+        # 每个请求结束后关闭连接
+        session.headers["Connection"] = "close"
+        return "HTTP/1.1"
+
+    if connection.get("http2", False):
+        try:
+            session.mount("https://", Http2Adapter(
+                max_connections=connection.get("http2_max_connections", 4),
+                keepalive_expiry=connection.get("keep_alive_idle", 60)
+            ))
+            return "HTTP/2"
+        except ImportError as e:
+            logger.warning(f"HTTP/2 不可用（需要安装 httpx[http2]），使用 HTTP/1.1: {e}")
+
+    return "HTTP/1.1"
@@ -0,0 +1,210 @@
+"""
+测试公共配置 - 客户端模块位于仓库根目录
+"""
+import io
+import os
+import sys
+import json
+import base64
+import shutil
+import hashlib
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """在临时目录中创建的客户端（配置、设备ID、队列和历史数据库都写在该目录）"""
+    monkeypatch.chdir(tmp_path)
+    from cloudflare_client import CloudflareClientCore
+
+    core = CloudflareClientCore("http://127.0.0.1:9")
+    yield core
+    core.disconnect()
+    core.pending_queue.close()
+    core.history.close()
+
+
+def make_response(status, headers=None, body=b"{}"):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = body
+    response.raw = io.BytesIO(body)
+    return response
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """记录重试等待时间而不真正等待"""
+    import cloudflare_client
+
+    recorded = []
+    monkeypatch.setattr(cloudflare_client.time, "sleep", recorded.append)
+    return recorded
+
+
+@pytest.fixture
+def send(client, monkeypatch):
+    """按顺序返回预设的响应（或抛出异常），记录每次请求的方法"""
+    calls = []
+    outcomes = []
+
+    def fake_request(method, url, **kwargs):
+        calls.append(method)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(client.session, "request", fake_request)
+    client.config["connection"]["retry_backoff"] = 0.01
+
+    def script(*items):
+        outcomes.extend(items)
+        return calls
+
+    return script
+
+
+@pytest.fixture
+def serve(client, monkeypatch):
+    """serve(handler)：客户端会话的请求交给 handler(method, path, **kwargs) 处理，返回记录的 (方法, 路径)"""
+    calls = []
+
+    def install(handler):
+        def fake_request(method, url, **kwargs):
+            path = url[len(client.api_url):] if url.startswith(client.api_url) else url
+            calls.append((method, path))
+            return handler(method, path, **kwargs)
+
+        monkeypatch.setattr(client.session, "request", fake_request)
+        return calls
+
+    return install
+
+
+class WorkerProcess:
+    """在 Node 中运行的 worker（内存 KV），按顺序发送请求"""
+
+    def __init__(self, process, log_path):
+        self.process = process
+        self.log_path = log_path
+
+    def request(self, method, path, headers=None, json_body=None):
+        message = {"method": method, "path": path, "headers": headers or {}}
+        if json_body is not None:
+            message["body"] = json_body
+        return self._send(message)
+
+    def scheduled(self, cron="0 * * * *"):
+        """触发一次定时任务（等待 waitUntil 中的任务完成），返回 {"kv_ops": 本次实际的 KV 操作数}"""
+        return self._send({"scheduled": cron}).json()
+
+    def kv(self, prefix=""):
+        """内存 KV 中指定前缀的全部键值 {key: value}"""
+        return self._send({"kv": prefix}).json()
+
+    def _send(self, message):
+        self.process.stdin.write(json.dumps(message) + "\n")
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            with open(self.log_path, encoding="utf-8", errors="replace") as f:
+                raise RuntimeError(f"worker 进程已退出: {f.read()}")
+        return WorkerResponse(json.loads(line))
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, json_body=None, **kwargs):
+        return self.request("POST", path, json_body=json_body, **kwargs)
+
+    def close(self):
+        self.process.stdin.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class WorkerResponse:
+    def __init__(self, data):
+        self.status_code = data["status"]
+        # 响应头名称统一为小写
+        self.headers = {name.lower(): value for name, value in data["headers"].items()}
+        self.content = base64.b64decode(data["body"])
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def seed_accounts():
+    """一个用户 alice（密码 pw）及其有效的激活码 K1，使用旧版整体存储格式（由定时任务迁移，迁移前读取回退到旧数据）"""
+    now = datetime.now(timezone.utc)
+    created = now.isoformat().replace("+00:00", "Z")
+    expires = (now + timedelta(days=30)).isoformat().replace("+00:00", "Z")
+    return {
+        "users": [{"id": "u1", "username": "alice", "email": "alice@example.com",
+                   "password_hash": hashlib.sha256(b"pw").hexdigest(), "user_type": "user",
+                   "is_active": True, "created_at": created, "last_login": None,
+                   "last_activity": None, "device_id": None}],
+        "licenses": [{"id": "l1", "license_key": "K1", "user_id": "u1", "username": "alice",
+                      "days": 30, "max_uses": 0, "used_count": 0, "created_at": created,
+                      "expires_at": expires, "is_active": True, "activated_at": None,
+                      "device_id": None, "last_use": None}]
+    }
+
+
+def keyed_accounts():
+    """seed_accounts 的新版按键存储形式（user:/license: 及其索引），无需迁移"""
+    accounts = seed_accounts()
+    seed = {}
+    for user in accounts["users"]:
+        seed[f"user:{user['id']}"] = user
+        seed[f"user_by_name:{user['username']}"] = user["id"]
+        seed[f"user_by_email:{user['email']}"] = user["id"]
+    for license in accounts["licenses"]:
+        seed[f"license:{license['license_key']}"] = license
+        seed.setdefault(f"user_licenses:{license['user_id']}", []).append(license["license_key"])
+    return seed
+
+
+@pytest.fixture
+def worker_factory(tmp_path):
+    """启动 worker：worker_factory(env=None, seed=None)；未安装 node 时跳过"""
+    node = shutil.which("node")
+    if node is None:
+        pytest.skip("需要 node 运行 worker.js")
+
+    # worker.js 是 ES 模块，复制为 .mjs 以便 Node 按模块加载
+    module = tmp_path / "worker.mjs"
+    shutil.copyfile(os.path.join(ROOT, "worker.js"), module)
+    workers = []
+
+    def start(env=None, seed=None):
+        log_path = tmp_path / f"worker-{len(workers)}.log"
+        with open(log_path, "w") as log:
+            process = subprocess.Popen(
+                [node, os.path.join(ROOT, "tests", "worker_harness.mjs"), str(module)],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=log, text=True,
+                env={**os.environ,
+                     "WORKER_ENV": json.dumps(env or {}),
+                     "WORKER_SEED": json.dumps(seed_accounts() if seed is None else seed)}
+            )
+        worker = WorkerProcess(process, log_path)
+        workers.append(worker)
+        return worker
+
+    yield start
+    for worker in workers:
+        worker.close()
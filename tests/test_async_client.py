@@ -0,0 +1,105 @@
+"""
+异步客户端：只重试限流配额耗尽的429，准入拒绝直接返回；submit_many 在并发限制内同时提交各分块
+"""
+import asyncio
+import json
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from cloudflare_async_client import AsyncCloudflareClient
+
+
+def run_requests(tmp_path, monkeypatch, handler, paths):
+    monkeypatch.chdir(tmp_path)
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+
+    async def main():
+        async with AsyncCloudflareClient("http://worker.test") as client:
+            client.client._transport = httpx.MockTransport(handler)
+            return [await client._request("GET", path) for path in paths]
+
+    return asyncio.run(main()), sleeps
+
+
+def test_retries_when_quota_is_exhausted(tmp_path, monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if len(calls) < 3:
+            return httpx.Response(429, headers={"Retry-After": "2", "X-RateLimit-Remaining": "0"})
+        return httpx.Response(200)
+
+    (response,), sleeps = run_requests(tmp_path, monkeypatch, handler, ["/api/ping"])
+
+    assert response.status_code == 200
+    assert len(calls) == 3
+    assert sleeps == [2, 2]
+
+
+def test_admission_rejection_is_returned_immediately(tmp_path, monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(429, headers={"Retry-After": "120", "X-RateLimit-Remaining": "57"})
+
+    (response,), sleeps = run_requests(tmp_path, monkeypatch, handler, ["/api/tasks"])
+
+    assert response.status_code == 429
+    assert calls == ["/api/tasks"]
+    assert sleeps == []
+
+
+def test_gives_up_after_max_retries(tmp_path, monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(429, headers={"Retry-After": "1", "X-RateLimit-Remaining": "0"})
+
+    (response,), _ = run_requests(tmp_path, monkeypatch, handler, ["/api/ping"])
+
+    assert response.status_code == 429
+    assert len(calls) == 4
+
+
+def test_submit_many_runs_chunks_concurrently_within_limit(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from cloudflare_client import CLIENT_VERSION
+
+    in_flight, peak, submitted = [0], [0], []
+
+    async def handler(request):
+        assert request.headers["X-Client-Version"] == CLIENT_VERSION
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        await asyncio.sleep(0.01)
+        in_flight[0] -= 1
+        urls = json.loads(request.content)["urls"]
+        submitted.append(urls)
+        if urls[0] == "https://example.com/fail-0":
+            return httpx.Response(500)
+        return httpx.Response(200, json={"success": True, "task": {"task_id": f"task_{len(submitted)}"}})
+
+    async def main():
+        async with AsyncCloudflareClient("http://worker.test", max_concurrency=2) as client:
+            client.client._transport = httpx.MockTransport(handler)
+            client.authenticated = client.license_valid = True
+            urls = [f"https://example.com/{i}" for i in range(10)] + ["https://example.com/fail-0"]
+            return await client.submit_many(urls, "alice@example.com", chunk_size=2)
+
+    result = asyncio.run(main())
+
+    assert len(submitted) == 6
+    assert peak[0] == 2
+    assert result["submitted"] == 5 and result["failed"] == 1
+    assert [chunk["url_count"] for chunk in result["chunks"].values()] == [2, 2, 2, 2, 2, 1]
+    assert result["chunks"][5]["error"]
@@ -0,0 +1,112 @@
+"""
+响应缓存：有效期内直接返回，过期后带 If-None-Match 条件请求，304 时沿用并续期缓存
+"""
+import json
+
+import pytest
+
+import cloudflare_client
+from conftest import make_response
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cloudflare_client.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def server(serve):
+    """按路径返回 responses 中的 (状态码, 数据, ETag)，记录每次请求的 If-None-Match"""
+    responses = {}
+    conditions = []
+
+    def handler(method, path, headers=None, **kwargs):
+        conditions.append((headers or {}).get("If-None-Match"))
+        status, data, etag = responses[path]
+        body = json.dumps(data).encode() if status == 200 else b""
+        return make_response(status, {"Content-Type": "application/json", **({"ETag": etag} if etag else {})}, body)
+
+    calls = serve(handler)
+    return responses, conditions, calls
+
+
+def test_fresh_entry_skips_request(client, clock, server):
+    responses, _, calls = server
+    responses["/api/stats"] = (200, {"total_tasks": 1}, 'W/"a"')
+
+    assert client._cached_get("/api/stats", "stats") == {"total_tasks": 1}
+    clock[0] += 29
+    assert client._cached_get("/api/stats", "stats") == {"total_tasks": 1}
+
+    assert len(calls) == 1
+
+
+def test_expired_entry_revalidates_with_etag(client, clock, server):
+    responses, conditions, calls = server
+    responses["/api/stats"] = (200, {"total_tasks": 1}, 'W/"a"')
+    client._cached_get("/api/stats", "stats")
+
+    clock[0] += 31
+    responses["/api/stats"] = (304, None, 'W/"a"')
+    assert client._cached_get("/api/stats", "stats") == {"total_tasks": 1}
+    assert conditions == [None, 'W/"a"']
+
+    # 304 后缓存续期
+    clock[0] += 29
+    assert client._cached_get("/api/stats", "stats") == {"total_tasks": 1}
+    assert len(calls) == 2
+
+    clock[0] += 2
+    responses["/api/stats"] = (200, {"total_tasks": 2}, 'W/"b"')
+    assert client._cached_get("/api/stats", "stats") == {"total_tasks": 2}
+    assert conditions[-1] == 'W/"a"'
+
+
+def test_completed_task_is_cached_permanently(client, clock, server):
+    responses, _, calls = server
+    responses["/api/tasks/t1"] = (200, {"task_id": "t1", "status": "processing"}, None)
+    responses["/api/tasks/t2"] = (200, {"task_id": "t2", "status": "completed"}, None)
+
+    client._cached_get("/api/tasks/t1", "task")
+    client._cached_get("/api/tasks/t2", "task")
+    clock[0] += 3600
+    client._cached_get("/api/tasks/t1", "task")
+    client._cached_get("/api/tasks/t2", "task")
+
+    assert calls.count(("GET", "/api/tasks/t1")) == 2
+    assert calls.count(("GET", "/api/tasks/t2")) == 1
+
+
+def test_errors_are_not_cached(client, clock, server):
+    responses, conditions, calls = server
+    responses["/api/stats"] = (404, None, None)
+
+    assert client._cached_get("/api/stats", "stats") is None
+    responses["/api/stats"] = (200, {"total_tasks": 1}, None)
+    assert client._cached_get("/api/stats", "stats") == {"total_tasks": 1}
+    assert conditions == [None, None]
+
+
+def test_disabled_cache_always_requests(client, clock, server):
+    responses, conditions, calls = server
+    client.config["cache"]["enabled"] = False
+    responses["/api/stats"] = (200, {"total_tasks": 1}, 'W/"a"')
+
+    client._cached_get("/api/stats", "stats")
+    client._cached_get("/api/stats", "stats")
+
+    assert len(calls) == 2 and conditions == [None, None]
+
+
+def test_task_update_invalidates_cached_task(client, clock, server):
+    responses, _, calls = server
+    responses["/api/tasks/t1"] = (200, {"task_id": "t1", "status": "processing"}, None)
+    client.tasks["t1"] = {"task_id": "t1", "status": "processing"}
+    client._cached_get("/api/tasks/t1", "task")
+
+    client._apply_task_update({"task_id": "t1", "status": "completed"})
+    client._cached_get("/api/tasks/t1", "task")
+
+    assert calls.count(("GET", "/api/tasks/t1")) == 2
@@ -0,0 +1,116 @@
+"""
+任务状态推送（SSE）：按事件更新本地任务，服务器不支持或连接断开时回退到轮询
+"""
+import io
+import json
+
+import pytest
+from requests.utils import get_encoding_from_headers
+
+from conftest import make_response
+
+
+def event_stream(*events):
+    """events 为 (事件名, 数据) 序列，返回 text/event-stream 响应"""
+    body = "".join(f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n" for name, data in events)
+    response = make_response(200, {"Content-Type": "text/event-stream"})
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = False
+    response.raw = io.BytesIO(body.encode())
+    return response
+
+
+@pytest.fixture
+def pushing(client):
+    """停止后台调度线程，事件循环在测试线程中运行，唤醒标志留给断言检查"""
+    client.scheduler_active = False
+    client.scheduler_wakeup.set()
+    client.scheduler_thread.join(timeout=5)
+    client.scheduler_active = True
+    client.scheduler_wakeup.clear()
+    client.tasks["t1"] = {"task_id": "t1", "status": "pending", "progress": 0}
+    client.streaming_tasks.add("t1")
+    return client
+
+
+def test_status_events_update_task(pushing, serve):
+    updates = []
+    pushing.register_status_callback(lambda kind, data: updates.append((kind, data.get("task_id"))))
+    calls = serve(lambda method, path, **kwargs: event_stream(
+        ("status", {"task_id": "t1", "status": "processing", "progress": 40}),
+        ("status", {"task_id": "t1", "status": "processing", "progress": 80}),
+        ("status", {"task_id": "t1", "status": "completed", "progress": 100}),
+    ))
+
+    pushing._task_event_loop("t1")
+
+    # 任务结束后不再重连
+    assert calls == [("GET", "/api/tasks/t1/status")]
+    assert pushing.tasks["t1"]["status"] == "completed" and pushing.tasks["t1"]["progress"] == 100
+    assert ("task_complete", "t1") in updates
+    assert "t1" not in pushing.streaming_tasks
+
+
+def test_event_data_is_utf8(pushing, serve):
+    serve(lambda method, path, **kwargs: event_stream(
+        ("status", {"task_id": "t1", "status": "failed", "error_message": "下载失败"}),
+    ))
+
+    pushing._task_event_loop("t1")
+
+    assert pushing.tasks["t1"]["error_message"] == "下载失败"
+
+
+def test_reconnects_while_task_is_active(pushing, serve):
+    streams = iter([
+        event_stream(("status", {"task_id": "t1", "status": "processing", "progress": 50})),
+        event_stream(("status", {"task_id": "t1", "status": "completed", "progress": 100})),
+    ])
+    calls = serve(lambda method, path, **kwargs: next(streams))
+
+    pushing._task_event_loop("t1")
+
+    assert len(calls) == 2
+    assert pushing.tasks["t1"]["status"] == "completed"
+
+
+@pytest.mark.parametrize("response", [
+    make_response(200, {"Content-Type": "application/json"}, b'{"task_id": "t1", "status": "processing"}'),
+    make_response(404),
+])
+def test_falls_back_to_polling_without_push(pushing, serve, response):
+    serve(lambda method, path, **kwargs: response)
+
+    pushing._task_event_loop("t1")
+
+    assert pushing.tasks["t1"]["status"] == "pending"
+    assert "t1" not in pushing.streaming_tasks
+    # 唤醒调度线程继续轮询
+    assert pushing.scheduler_wakeup.is_set()
+
+
+def test_error_event_and_broken_connection_fall_back(pushing, serve):
+    serve(lambda method, path, **kwargs: event_stream(("error", {"error": "任务不存在"})))
+    pushing._task_event_loop("t1")
+    assert "t1" not in pushing.streaming_tasks
+
+    def broken(method, path, **kwargs):
+        raise ConnectionError("reset")
+
+    pushing.streaming_tasks.add("t1")
+    pushing.scheduler_wakeup.clear()
+    serve(broken)
+    pushing._task_event_loop("t1")
+    assert "t1" not in pushing.streaming_tasks
+    assert pushing.scheduler_wakeup.is_set()
+
+
+def test_stream_limit_leaves_extra_tasks_to_polling(client, monkeypatch):
+    started = []
+    monkeypatch.setattr(client, "_task_event_loop", started.append)
+    client.config["connection"].update({"use_push": True, "max_push_streams": 2})
+
+    for task_id in ("a", "b", "c", "a"):
+        client._start_task_listener(task_id)
+
+    assert client.streaming_tasks == {"a", "b"}
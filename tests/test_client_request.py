@@ -0,0 +1,127 @@
+"""
+客户端请求层：重试、Retry-After、限流节奏和熔断器
+"""
+import time
+
+import pytest
+import requests
+
+import cloudflare_client
+from cloudflare_client import CircuitBreaker, CircuitOpenError, CloudflareClientCore
+from conftest import make_response
+
+
+def test_idempotent_request_retries_server_errors(client, send, sleeps):
+    calls = send(make_response(503), make_response(502), make_response(200))
+
+    response = client._request("GET", "/api/ping")
+
+    assert response.status_code == 200
+    assert calls == ["GET", "GET", "GET"]
+    assert len(sleeps) == 2
+    assert client.get_metrics()["endpoints"]["GET /api/ping"]["retries"] == 2
+
+
+def test_retries_stop_at_max_retries(client, send, sleeps):
+    client.config["connection"]["max_retries"] = 2
+    calls = send(*[make_response(500) for _ in range(3)])
+
+    assert client._request("GET", "/api/ping").status_code == 500
+    assert len(calls) == 3
+
+
+def test_non_idempotent_request_is_not_retried_without_retry_after(client, send, sleeps):
+    calls = send(make_response(500))
+
+    assert client._request("POST", "/api/tasks").status_code == 500
+    assert calls == ["POST"]
+    assert sleeps == []
+
+
+def test_retry_after_is_honored_for_non_idempotent_requests(client, send, sleeps):
+    calls = send(make_response(429, {"Retry-After": "2", "X-RateLimit-Remaining": "0"}),
+                 make_response(201))
+
+    assert client._request("POST", "/api/tasks").status_code == 201
+    assert calls == ["POST", "POST"]
+    assert 2 in sleeps
+    # 限流配额耗尽后，后续请求发送前也会等待
+    assert client._throttle_until > time.time()
+
+
+def test_long_retry_after_is_returned_to_caller(client, send, sleeps):
+    calls = send(make_response(503, {"Retry-After": "600"}))
+
+    assert client._request("GET", "/api/ping").status_code == 503
+    assert len(calls) == 1
+
+
+def test_admission_429_does_not_throttle_later_requests(client, send, sleeps):
+    # 配额仍有剩余的429（任务数超限）只影响该请求
+    send(make_response(429, {"Retry-After": "120", "X-RateLimit-Remaining": "50"}))
+    assert client._request("POST", "/api/tasks").status_code == 429
+    assert client._throttle_until <= time.time()
+
+
+def test_connection_errors(client, send, sleeps):
+    calls = send(requests.exceptions.ConnectionError("reset"), make_response(200))
+    assert client._request("GET", "/api/ping").status_code == 200
+    assert len(calls) == 2
+
+    # 请求可能已经发出，非幂等请求不重试
+    send(requests.exceptions.ConnectionError("reset"))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client._request("POST", "/api/tasks")
+    assert len(calls) == 3
+
+    # 连接超时说明请求未发出，可以安全重试
+    send(requests.exceptions.ConnectTimeout("timeout"), make_response(201))
+    assert client._request("POST", "/api/tasks").status_code == 201
+    assert len(calls) == 5
+
+
+def test_circuit_opens_after_consecutive_failures(client, send, sleeps):
+    client.config["connection"]["max_retries"] = 0
+    client.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    calls = send(make_response(500), make_response(500))
+
+    client._request("GET", "/api/ping")
+    client._request("GET", "/api/ping")
+    with pytest.raises(CircuitOpenError):
+        client._request("GET", "/api/ping")
+    assert len(calls) == 2
+    assert client.get_metrics()["circuit_state"] == "open"
+
+
+def test_circuit_breaker_half_open_probe(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cloudflare_client.time, "time", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.retry_in() == 30
+
+    # 冷却结束只放行一个试探请求
+    now[0] += 30
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+    # 试探失败重新打开，成功则关闭
+    breaker.record_failure()
+    assert breaker.state == "open"
+    now[0] += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_parse_retry_after():
+    assert CloudflareClientCore._parse_retry_after("3") == 3
+    assert CloudflareClientCore._parse_retry_after("-1") == 0
+    assert CloudflareClientCore._parse_retry_after(None) is None
+    assert CloudflareClientCore._parse_retry_after("soon") is None
+    assert CloudflareClientCore._parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
@@ -0,0 +1,100 @@
+"""
+调度循环：只在有活动任务时轮询，无变化时指数退避，有变化或被唤醒时恢复快速轮询
+"""
+import pytest
+
+import cloudflare_client
+
+
+class FakeWakeup:
+    """代替 threading.Event：wait 推进模拟时钟并记录等待时间，woken 中的轮次模拟被唤醒"""
+
+    def __init__(self, client, clock, rounds, woken=()):
+        self.client = client
+        self.clock = clock
+        self.rounds = rounds
+        self.woken = set(woken)
+        self.waits = []
+
+    def wait(self, timeout):
+        self.waits.append(round(timeout, 3))
+        self.clock[0] += timeout
+        if len(self.waits) >= self.rounds:
+            self.client.scheduler_active = False
+        return len(self.waits) in self.woken
+
+    def set(self):
+        pass
+
+    def clear(self):
+        pass
+
+
+@pytest.fixture
+def scheduler(client, monkeypatch):
+    """停止后台调度线程，在测试线程中运行调度循环；返回 run(rounds, changes, woken) -> (等待时间, 检查时刻)"""
+    client.scheduler_active = False
+    client.scheduler_wakeup.set()
+    client.scheduler_thread.join(timeout=5)
+
+    clock = [1000.0]
+    monkeypatch.setattr(cloudflare_client.time, "time", lambda: clock[0])
+    monkeypatch.setattr(client, "_jitter", lambda interval: interval)
+    monkeypatch.setattr(client, "_send_heartbeat", lambda: None)
+    client.config["connection"].update({"status_check_min_interval": 1, "status_check_interval": 8,
+                                        "heartbeat_interval": 60})
+    client.authenticated = True
+    client.user_id = "u1"
+
+    def run(rounds, changes=(), woken=()):
+        checks = []
+
+        def check():
+            checks.append(clock[0] - 1000.0)
+            return len(checks) in changes
+
+        monkeypatch.setattr(client, "_check_user_tasks", check)
+        wakeup = FakeWakeup(client, clock, rounds, woken)
+        client.scheduler_wakeup = wakeup
+        client.scheduler_active = True
+        client.poll_interval = 1
+        client._scheduler_loop()
+        return wakeup.waits, checks
+
+    return run
+
+
+def test_backs_off_exponentially_while_nothing_changes(client, scheduler):
+    client.tasks["t1"] = {"task_id": "t1", "status": "processing"}
+
+    waits, checks = scheduler(6)
+
+    assert waits == [2, 4, 8, 8, 8, 8]
+    assert checks == [0, 2, 6, 14, 22, 30]
+
+
+def test_change_resets_to_fast_polling(client, scheduler):
+    client.tasks["t1"] = {"task_id": "t1", "status": "processing"}
+
+    waits, _ = scheduler(5, changes={3})
+
+    assert waits == [2, 4, 1, 2, 4]
+
+
+def test_wakeup_resets_to_fast_polling(client, scheduler):
+    client.tasks["t1"] = {"task_id": "t1", "status": "pending"}
+
+    waits, checks = scheduler(4, woken={2})
+
+    # 第2次等待被唤醒（如提交了新任务），按最小间隔1秒后再次检查
+    assert waits == [2, 4, 1, 2]
+    assert checks == [0, 2, 7]
+
+
+def test_no_polling_without_active_tasks(client, scheduler):
+    client.tasks["t1"] = {"task_id": "t1", "status": "completed"}
+
+    waits, checks = scheduler(3)
+
+    assert checks == []
+    assert waits == [60, 60, 60]
@@ -0,0 +1,77 @@
+"""
+批量提交：按服务器限制切分URL，优先走批量接口，不支持时并发逐个提交，离线时进入队列
+"""
+import json
+
+import pytest
+
+from cloudflare_client import MAX_BATCH_SIZE
+from conftest import make_response
+
+
+def json_response(data, status=200):
+    return make_response(status, {"Content-Type": "application/json"}, json.dumps(data).encode())
+
+
+@pytest.fixture
+def online(client):
+    client.authenticated = client.license_valid = True
+    client.user_id, client.username = "u1", "alice"
+    client.config["connection"]["use_push"] = False
+    return client
+
+
+def urls(count):
+    return [f"https://example.com/{i}" for i in range(count)]
+
+
+def test_uses_batch_endpoint(online, serve):
+    batches = []
+
+    def handler(method, path, json=None, **kwargs):
+        assert (method, path) == ("POST", "/api/tasks:batch")
+        batches.append(json["tasks"])
+        return json_response({"results": [{"success": True, "task": {"task_id": f"t{len(batches)}_{i}"}}
+                                          for i in range(len(json["tasks"]))]})
+
+    serve(handler)
+
+    result = online.submit_many(urls(MAX_BATCH_SIZE * 3 + 5), "alice@example.com", chunk_size=3)
+
+    # 每3个URL一个任务，每 MAX_BATCH_SIZE 个任务一个批量请求
+    assert [len(batch) for batch in batches] == [MAX_BATCH_SIZE, 2]
+    assert result["submitted"] == MAX_BATCH_SIZE + 2 and result["failed"] == 0
+    assert all(chunk["task_id"] and chunk["error"] is None for chunk in result["chunks"].values())
+    assert result["chunks"][MAX_BATCH_SIZE + 1]["url_count"] == 2
+    assert set(online.tasks) == {chunk["task_id"] for chunk in result["chunks"].values()}
+
+
+def test_falls_back_to_single_submissions(online, serve):
+    submitted = []
+
+    def handler(method, path, json=None, **kwargs):
+        if path == "/api/tasks:batch":
+            return make_response(404)
+        submitted.append(json["urls"])
+        if json["urls"][0] == "https://example.com/4":
+            return json_response({"success": False, "error": "bad"}, 400)
+        return json_response({"success": True, "task": {"task_id": f"t_{json['urls'][0][-1]}"}})
+
+    calls = serve(handler)
+
+    result = online.submit_many(urls(6), "alice@example.com", chunk_size=2)
+
+    assert calls.count(("POST", "/api/tasks:batch")) == 1
+    assert sorted(submitted) == [urls(6)[i:i + 2] for i in (0, 2, 4)]
+    assert result["submitted"] == 2 and result["failed"] == 1
+    assert result["chunks"][2]["task_id"] is None and result["chunks"][2]["error"]
+
+
+def test_offline_chunks_go_to_the_queue(client, serve):
+    calls = serve(lambda *args, **kwargs: pytest.fail("离线时不应发送请求"))
+
+    result = client.submit_many(urls(5), "alice@example.com", chunk_size=2)
+
+    assert calls == []
+    assert result["submitted"] == 3
+    assert client.pending_queue.count() == 3
@@ -0,0 +1,168 @@
+"""
+流式ZIP解压：stored/deflate 条目、数据描述符、CRC 校验和路径穿越；
+并发下载：经注入的请求函数发送、重名文件、Range 续传
+"""
+import io
+import zipfile
+
+import pytest
+
+from cloudflare_downloader import TaskDownloader, extract_zip_stream
+
+
+class _Unseekable(io.RawIOBase):
+    """只能顺序写入的输出，zipfile 会为每个条目写数据描述符（与服务器流式生成的ZIP一致）"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data.extend(b)
+        return len(b)
+
+
+class _Trickle(io.RawIOBase):
+    """每次最多返回 step 个字节，模拟网络分段到达"""
+
+    def __init__(self, data, step=61):
+        self._data = io.BytesIO(data)
+        self._step = step
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._data.read(self._step if size < 0 else min(size, self._step))
+
+
+FILES = {
+    "report.pdf": b"%PDF-1.4 " + bytes(range(256)) * 40,
+    "notes.txt": "中文内容\n".encode("utf-8") * 500,
+    "empty.txt": b"",
+}
+
+
+def build_zip(compression, streaming):
+    target = _Unseekable() if streaming else io.BytesIO()
+    with zipfile.ZipFile(target, "w", compression=compression) as archive:
+        for name, data in FILES.items():
+            archive.writestr(name, data)
+    return bytes(target.data) if streaming else target.getvalue()
+
+
+@pytest.mark.parametrize("compression, streaming", [
+    (zipfile.ZIP_STORED, False),
+    (zipfile.ZIP_DEFLATED, False),
+    (zipfile.ZIP_DEFLATED, True),
+])
+def test_extracts_all_entries(tmp_path, compression, streaming):
+    seen = []
+    entries = extract_zip_stream(_Trickle(build_zip(compression, streaming)), str(tmp_path),
+                                 chunk_size=64, entry_callback=seen.append)
+
+    assert [e["name"] for e in entries] == list(FILES)
+    assert seen == entries
+    for entry in entries:
+        assert entry["crc_ok"]
+        assert entry["size"] == len(FILES[entry["name"]])
+        with open(entry["path"], "rb") as f:
+            assert f.read() == FILES[entry["name"]]
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_detects_corrupted_entry(tmp_path):
+    data = bytearray(build_zip(zipfile.ZIP_STORED, False))
+    offset = data.index(b"%PDF")
+    data[offset + 100] ^= 0xFF
+
+    entries = extract_zip_stream(io.BytesIO(bytes(data)), str(tmp_path))
+
+    assert [e["crc_ok"] for e in entries] == [False, True, True]
+
+
+def test_truncated_stream_raises(tmp_path):
+    data = build_zip(zipfile.ZIP_DEFLATED, True)
+    with pytest.raises(EOFError):
+        extract_zip_stream(io.BytesIO(data[:len(data) // 2]), str(tmp_path))
+
+
+def test_entry_names_cannot_escape_destination(tmp_path):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("../../evil.txt", b"x")
+        archive.writestr("dir\\nested.txt", b"y")
+
+    dest = tmp_path / "out"
+    entries = extract_zip_stream(io.BytesIO(buffer.getvalue()), str(dest))
+
+    assert sorted(p.name for p in dest.iterdir()) == ["evil.txt", "nested.txt"]
+    assert all(e["path"].startswith(str(dest)) for e in entries)
+    assert not (tmp_path / "evil.txt").exists()
+
+
+class _FakeResponse:
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self._body), chunk_size):
+            yield self._body[i:i + chunk_size]
+
+
+class _FakeServer:
+    """按URL返回内容、支持 Range 的请求函数，记录每次调用"""
+
+    def __init__(self, files):
+        self.files = files
+        self.calls = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.calls.append((method, url, dict(headers or {})))
+        body = self.files[url]
+        range_header = (headers or {}).get("Range")
+        if range_header:
+            start = int(range_header[len("bytes="):-1])
+            return _FakeResponse(206, body[start:], {"Content-Range": f"bytes {start}-{len(body) - 1}/{len(body)}"})
+        return _FakeResponse(200, body, {"Content-Length": str(len(body))})
+
+
+def test_downloads_through_request_function_with_unique_names(tmp_path):
+    server = _FakeServer({
+        "https://a.example/files/report.pdf": b"a" * 300,
+        "https://b.example/other/report.pdf": b"b" * 200,
+        "https://c.example/report_2.pdf": b"c" * 100,
+    })
+    urls = list(server.files)
+
+    result = TaskDownloader(server.request, chunk_size=64).download(urls, str(tmp_path))
+
+    assert result["succeeded"] == 3
+    assert sorted(call[1] for call in server.calls) == sorted(urls)
+    assert [f["path"] for f in result["files"]] == [str(tmp_path / name) for name in
+                                                    ("report.pdf", "report_2.pdf", "report_2_2.pdf")]
+    for url, entry in zip(urls, result["files"]):
+        with open(entry["path"], "rb") as f:
+            assert f.read() == server.files[url]
+
+
+def test_resumes_partial_file_with_range(tmp_path):
+    url = "https://a.example/data.bin"
+    server = _FakeServer({url: bytes(range(256)) * 4})
+    (tmp_path / "data.bin.part").write_bytes(server.files[url][:100])
+
+    result = TaskDownloader(server.request).download([url], str(tmp_path))
+
+    assert server.calls == [("GET", url, {"Range": "bytes=100-"})]
+    assert result["files"][0]["resumed"]
+    assert (tmp_path / "data.bin").read_bytes() == server.files[url]
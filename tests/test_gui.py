@@ -0,0 +1,376 @@
+"""
+GUI：网络调用在线程池中执行，结果经界面事件队列交回主线程处理；列表和状态面板只更新有变化的部分（不创建真实窗口）
+"""
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("tkinter")
+import cloudflare_gui
+from cloudflare_gui import CloudflareClientGUI
+
+
+class FakeRoot:
+    """记录 after 安排的回调，不真正计时"""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, callback):
+        self.scheduled.append((ms, callback))
+
+    def after_idle(self, callback):
+        self.scheduled.append((0, callback))
+
+
+class FakeWidget:
+    """记录 config 调用的控件"""
+
+    def __init__(self):
+        self.options = {}
+        self.configs = []
+
+    def config(self, **options):
+        self.options.update(options)
+        self.configs.append(options)
+
+    def cget(self, key):
+        return self.options.get(key, "")
+
+
+class FakeText:
+    """记录内容替换次数的文本框"""
+
+    def __init__(self):
+        self.text = ""
+        self.writes = 0
+
+    def delete(self, start, end):
+        self.text = ""
+
+    def insert(self, index, text):
+        self.text += text
+        self.writes += 1
+
+
+class FakeTree:
+    """Treeview 替身：保存行顺序和值，记录每种操作的次数"""
+
+    def __init__(self):
+        self.order = []
+        self.values = {}
+        self.ops = {"insert": 0, "item": 0, "delete": 0, "move": 0}
+
+    def insert(self, parent, index, iid, values):
+        self.order.insert(index, iid)
+        self.values[iid] = values
+        self.ops["insert"] += 1
+
+    def item(self, iid, values):
+        self.values[iid] = values
+        self.ops["item"] += 1
+
+    def delete(self, iid):
+        self.order.remove(iid)
+        del self.values[iid]
+        self.ops["delete"] += 1
+
+    def move(self, iid, parent, index):
+        self.order.remove(iid)
+        self.order.insert(index, iid)
+        self.ops["move"] += 1
+
+    def reset_ops(self):
+        self.ops = dict.fromkeys(self.ops, 0)
+
+
+class InlineExecutor:
+    """在调用线程中立即执行的线程池替身"""
+
+    def __init__(self):
+        self.stopped = False
+
+    def submit(self, fn):
+        if self.stopped:
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        future = Future()
+        future.set_result(fn())
+        return future
+
+    def shutdown(self, **kwargs):
+        self.stopped = True
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    """记录弹出的消息框 (类型, 标题, 内容)"""
+    shown = []
+    for kind in ("showinfo", "showerror", "showwarning"):
+        monkeypatch.setattr(cloudflare_gui.messagebox, kind,
+                            lambda title, text, kind=kind: shown.append((kind, title, text)))
+    return shown
+
+
+@pytest.fixture
+def gui():
+    """不创建窗口的 GUI 实例：界面事件队列是真实的，线程池和控件用替身"""
+    app = CloudflareClientGUI.__new__(CloudflareClientGUI)
+    app.root = FakeRoot()
+    app.logger = logging.getLogger("CloudflareGUI")
+    app.executor = InlineExecutor()
+    app.ui_queue = queue.Queue()
+    return app
+
+
+def test_results_are_applied_only_when_queue_is_drained(gui):
+    gui.executor = ThreadPoolExecutor(max_workers=1)
+    threads = []
+
+    def work():
+        threads.append(threading.current_thread())
+        return 42
+
+    applied = []
+    gui._run_in_background(work, on_done=lambda result: applied.append((result, threading.current_thread()))).result()
+    gui.executor.shutdown()
+
+    assert threads[0] is not threading.current_thread()
+    assert applied == []
+
+    gui._drain_ui_queue()
+
+    assert applied == [(42, threading.current_thread())]
+    # 处理完后安排下一轮
+    assert gui.root.scheduled == [(gui.UI_POLL_MS, gui._drain_ui_queue)]
+
+
+def test_background_failure_is_reported(gui, messages, caplog):
+    def fail():
+        raise ValueError("网络不可用")
+
+    gui._run_in_background(fail, on_done=lambda result: pytest.fail("失败时不应调用 on_done"))
+    gui._drain_ui_queue()
+
+    assert "后台任务失败" in caplog.text
+    assert messages == [("showerror", "错误", "发生错误:\n\n网络不可用")]
+
+
+def test_drain_is_bounded_and_survives_callback_errors(gui, caplog):
+    handled = []
+
+    def broken():
+        raise RuntimeError("控件已销毁")
+
+    gui.post_to_ui(broken)
+    for i in range(gui.UI_BATCH + 5):
+        gui.post_to_ui(handled.append, i)
+
+    gui._drain_ui_queue()
+    assert "界面更新失败" in caplog.text
+    assert len(handled) == gui.UI_BATCH - 1
+
+    gui._drain_ui_queue()
+    assert handled == list(range(gui.UI_BATCH + 5))
+
+
+def test_no_work_is_scheduled_after_close(gui):
+    gui.root.destroy = lambda: None
+    gui.on_close()
+
+    assert gui._run_in_background(lambda: pytest.fail("关闭后不应执行")) is None
+
+
+def test_check_status_reads_in_background(gui, messages):
+    calls = []
+
+    class Client:
+        def get_server_stats(self):
+            calls.append("stats")
+            return {"total_users": 3, "total_tasks": 7}
+
+        def get_status(self):
+            calls.append("status")
+            return {"connected": True, "authenticated": True, "license_valid": False,
+                    "pending_tasks": 1, "active_tasks": 2}
+
+    gui.client = Client()
+    gui.check_status()
+
+    assert calls == ["stats", "status"] and messages == []
+    gui._drain_ui_queue()
+
+    [(kind, title, text)] = messages
+    assert (kind, title) == ("showinfo", "状态检查")
+    assert "总任务数: 7" in text and "❌未激活" in text
+
+
+
+class HistoryClient:
+    """按顺序返回 tasks 中前 limit 条的历史记录"""
+
+    def __init__(self):
+        self.tasks = []
+
+    def get_history(self, limit):
+        return self.tasks[:limit]
+
+    def count_history(self):
+        return len(self.tasks)
+
+
+def task(task_id, status="processing", progress=0):
+    return {"task_id": task_id, "status": status, "progress": progress,
+            "created_at": "2024-05-01T08:00:00.000Z", "completed_at": None}
+
+
+@pytest.fixture
+def history(gui):
+    gui.client = HistoryClient()
+    gui.history_tree = FakeTree()
+    gui.history_count_label = FakeWidget()
+    gui._history_rows = {}
+    gui._history_limit = gui.HISTORY_PAGE_SIZE
+    gui._history_total = 0
+    return gui
+
+
+def test_history_updates_only_changed_rows(history):
+    tree = history.history_tree
+    history.client.tasks = [task("c"), task("b"), task("a")]
+    history._render_history()
+    assert tree.order == ["c", "b", "a"] and tree.ops["insert"] == 3
+
+    tree.reset_ops()
+    history._render_history()
+    assert tree.ops == {"insert": 0, "item": 0, "delete": 0, "move": 0}
+
+    # 新任务在最前，一个任务状态变化，一个任务被清理
+    history.client.tasks = [task("d"), task("c"), task("b", "completed", 100)]
+    history._render_history()
+
+    assert tree.order == ["d", "c", "b"]
+    assert tree.values["b"][1:3] == ("completed", "100%")
+    assert tree.ops == {"insert": 1, "item": 1, "delete": 1, "move": 0}
+    assert history.history_count_label.options["text"] == "显示 3 / 3 条"
+
+
+def test_history_reorders_when_order_changes(history):
+    tree = history.history_tree
+    history.client.tasks = [task("a"), task("b"), task("c")]
+    history._render_history()
+    tree.reset_ops()
+
+    history.client.tasks = [task("c"), task("a"), task("b")]
+    history._render_history()
+
+    assert tree.order == ["c", "a", "b"]
+    assert tree.ops["insert"] == 0 and tree.ops["move"] == 3
+
+
+def test_history_loads_pages(history):
+    tree = history.history_tree
+    history.client.tasks = [task(f"t{i:03d}") for i in range(history.HISTORY_PAGE_SIZE + 10)]
+    history._render_history()
+    assert len(tree.order) == history.HISTORY_PAGE_SIZE
+
+    tree.reset_ops()
+    history.load_more_history()
+
+    assert len(tree.order) == history.HISTORY_PAGE_SIZE + 10
+    assert tree.ops == {"insert": 10, "item": 0, "delete": 0, "move": 0}
+    assert history.history_count_label.options["text"] == f"显示 {len(tree.order)} / {len(tree.order)} 条"
+
+
+def test_status_panel_updates_only_changed_widgets(gui):
+    status = {"connected": True, "server_url": "https://api.example.com", "authenticated": False,
+              "username": None, "user_id": None, "license_valid": False, "pending_tasks": 0, "active_tasks": 0}
+
+    class Client:
+        def get_status(self):
+            return dict(status)
+
+        def get_metrics(self):
+            return {}
+
+    gui.client = Client()
+    gui._render_metrics = lambda metrics: None
+    for name in ("conn_status", "connect_btn", "login_status", "login_btn", "logout_btn",
+                 "license_status", "license_btn", "download_btn"):
+        setattr(gui, name, FakeWidget())
+    gui.status_text = FakeText()
+
+    def tick():
+        """执行下一轮状态更新并处理界面事件"""
+        [callback] = [cb for ms, cb in gui.root.scheduled if ms == 2000]
+        gui.root.scheduled.clear()
+        callback()
+        gui._drain_ui_queue()
+
+    gui._start_status_updater()
+    gui._drain_ui_queue()
+    assert gui.conn_status.options["text"] == "状态: 已连接 (https://api.example.com)"
+    assert gui.status_text.writes == 1
+
+    tick()
+    assert len(gui.conn_status.configs) == 1 and len(gui.login_status.configs) == 1
+    assert gui.status_text.writes == 1
+
+    status.update(authenticated=True, username="alice", user_id="u1")
+    tick()
+    assert gui.login_status.options["text"] == "登录状态: 已登录 (alice)"
+    assert gui.logout_btn.options["state"] == "normal"
+    assert len(gui.conn_status.configs) == 1 and len(gui.license_status.configs) == 1
+    assert gui.status_text.writes == 2 and "用户名: alice" in gui.status_text.text
+
+
+def test_export_metrics_writes_in_background(gui, messages, monkeypatch, tmp_path):
+    path = tmp_path / "metrics.prom"
+    monkeypatch.setattr(cloudflare_gui.filedialog, "asksaveasfilename", lambda **kwargs: str(path))
+
+    class Client:
+        def get_metrics_prometheus(self):
+            return "client_requests_total 1\n"
+
+    gui.client = Client()
+    gui.export_metrics()
+    assert path.read_text(encoding="utf-8") == "client_requests_total 1\n"
+    gui._drain_ui_queue()
+    assert messages[0][0] == "showinfo"
+
+    monkeypatch.setattr(cloudflare_gui.filedialog, "asksaveasfilename",
+                        lambda **kwargs: str(tmp_path / "missing" / "metrics.prom"))
+    gui.export_metrics()
+    gui._drain_ui_queue()
+    assert messages[1][0] == "showerror"
+
+
+@pytest.fixture
+def metrics_panel(gui):
+    from cloudflare_metrics import ClientMetrics
+
+    gui.metrics_tree = FakeTree()
+    gui.task_metrics_label = FakeWidget()
+    gui._metrics_rows = {}
+    return ClientMetrics()
+
+
+def test_metrics_panel_updates_only_changed_endpoints(gui, metrics_panel):
+    tree, metrics = gui.metrics_tree, metrics_panel
+    metrics.record_request("GET", "/api/users/u1", 200, 0.05)
+    metrics.record_request("POST", "/api/tasks", 200, 0.1)
+    gui._render_metrics(metrics.snapshot())
+    assert tree.order == ["GET /api/users/{id}", "POST /api/tasks"]
+    assert gui.task_metrics_label.options["text"].endswith("暂无数据，进行中 0 个")
+
+    tree.reset_ops()
+    gui._render_metrics(metrics.snapshot())
+    assert tree.ops == {"insert": 0, "item": 0, "delete": 0, "move": 0}
+    assert len(gui.task_metrics_label.configs) == 1
+
+    metrics.record_request("GET", "/api/users/u2", 503, 0.2)
+    gui._render_metrics(metrics.snapshot())
+    assert tree.ops == {"insert": 0, "item": 1, "delete": 0, "move": 0}
+    assert tree.values["GET /api/users/{id}"][1:3] == (2, 1)
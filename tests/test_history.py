@@ -0,0 +1,98 @@
+"""
+本地任务历史：合并写入、按状态和时间查询、保留条数、created_at 统一为UTC
+"""
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+import pytest
+
+from cloudflare_history import TaskHistoryStore, normalize_timestamp, utc_isoformat
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = TaskHistoryStore(str(tmp_path / "history.db"), max_entries=1000)
+    yield s
+    s.close()
+
+
+def test_upsert_merges_with_existing_record(store):
+    store.upsert({"task_id": "a", "status": "pending", "urls": ["u1"],
+                  "created_at": "2024-01-01T00:00:00.000Z"})
+    store.upsert({"task_id": "a", "status": "completed", "progress": 100})
+
+    task = store.get("a")
+    assert task["status"] == "completed"
+    assert task["urls"] == ["u1"]
+    assert task["progress"] == 100
+    assert store.count() == 1
+    assert store.count("completed") == 1
+
+
+def test_upsert_many_ignores_entries_without_id(store):
+    assert store.upsert_many([{"task_id": "a"}, {"status": "pending"}, {"task_id": "b"}])
+    assert store.count() == 2
+
+
+def test_query_orders_and_filters(store):
+    store.upsert_many([
+        {"task_id": "a", "status": "completed", "created_at": "2024-01-01T00:00:00.000Z"},
+        {"task_id": "b", "status": "failed", "created_at": "2024-01-02T00:00:00.000Z"},
+        {"task_id": "c", "status": "completed", "created_at": "2024-01-03T00:00:00.000Z"},
+    ])
+
+    assert [t["task_id"] for t in store.query()] == ["c", "b", "a"]
+    assert [t["task_id"] for t in store.query(status="completed")] == ["c", "a"]
+    assert [t["task_id"] for t in store.query(since="2024-01-02T00:00:00Z")] == ["c", "b"]
+    assert [t["task_id"] for t in store.query(limit=1, offset=1)] == ["b"]
+
+
+def test_prune_keeps_newest_entries(tmp_path):
+    s = TaskHistoryStore(str(tmp_path / "history.db"), max_entries=2)
+    try:
+        s.upsert_many([{"task_id": f"t{i}", "created_at": f"2024-01-0{i + 1}T00:00:00.000Z"}
+                       for i in range(4)])
+        assert s.prune() == 2
+        assert [t["task_id"] for t in s.query()] == ["t3", "t2"]
+    finally:
+        s.close()
+
+
+def test_normalize_timestamp():
+    assert normalize_timestamp("2024-01-01T08:00:00+08:00") == "2024-01-01T00:00:00.000Z"
+    assert normalize_timestamp("2024-01-01T00:00:00.123456Z") == "2024-01-01T00:00:00.123Z"
+    assert normalize_timestamp("") == ""
+    assert normalize_timestamp("not a date") == "not a date"
+
+    # 不带时区的值按本地时间处理
+    local = datetime(2024, 1, 1, 12, 0, 0)
+    assert normalize_timestamp(local.isoformat()) == utc_isoformat(local.astimezone(timezone.utc))
+
+
+def test_local_and_server_times_sort_together(store):
+    store.upsert({"task_id": "server", "created_at": "2024-01-01T00:00:00.000Z"})
+    store.upsert({"task_id": "local", "created_at": "2024-01-01T01:00:00+00:00"})
+
+    assert store.get("local")["created_at"] == "2024-01-01T01:00:00.000Z"
+    assert [t["task_id"] for t in store.query()] == ["local", "server"]
+
+
+def test_migrates_existing_rows_to_utc(tmp_path):
+    path = str(tmp_path / "history.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE task_history (task_id TEXT PRIMARY KEY, status TEXT, created_at TEXT, "
+                 "updated_at REAL NOT NULL, payload TEXT NOT NULL)")
+    for task_id, created_at in [("a", "2024-01-01T09:00:00+08:00"), ("b", "2024-01-01T00:30:00.000Z")]:
+        conn.execute("INSERT INTO task_history VALUES (?, 'completed', ?, 0, ?)",
+                     (task_id, created_at, json.dumps({"task_id": task_id, "created_at": created_at})))
+    conn.commit()
+    conn.close()
+
+    s = TaskHistoryStore(path)
+    try:
+        assert s.get("a")["created_at"] == "2024-01-01T01:00:00.000Z"
+        assert [t["task_id"] for t in s.query()] == ["a", "b"]
+        assert s._conn.execute("PRAGMA user_version").fetchone()[0] >= 1
+    finally:
+        s.close()
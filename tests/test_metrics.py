@@ -0,0 +1,71 @@
+"""
+客户端指标：路径归并、延迟直方图分位数、Server-Timing 解析和 Prometheus 导出
+"""
+import pytest
+
+from cloudflare_metrics import ClientMetrics, LatencyHistogram, normalize_path, parse_server_timing
+
+
+def test_normalize_path():
+    assert normalize_path("/api/users/u1/tasks?limit=5") == "/api/users/{id}/tasks"
+    assert normalize_path("/api/tasks/task_1/status") == "/api/tasks/{id}/status"
+    assert normalize_path("/api/tasks/status:batch") == "/api/tasks/status:batch"
+    assert normalize_path("/api/ping") == "/api/ping"
+
+
+def test_download_paths_share_one_series():
+    metrics = ClientMetrics()
+    for task_id in ("task_a", "task_b"):
+        metrics.record_request("GET", f"/download/{task_id}/all.zip?compression=store", 200, 0.1)
+        metrics.record_request("GET", f"/download/{task_id}/file_1.bin", 200, 0.1)
+
+    assert normalize_path("/download/task_a/all.zip") == "/download/{id}/{file}"
+    assert list(metrics.snapshot()["endpoints"]) == ["GET /download/{id}/{file}"]
+
+
+def test_histogram_quantiles_within_bucket_error():
+    histogram = LatencyHistogram()
+    for ms in range(1, 1001):
+        histogram.record(ms / 1000)
+
+    for q, expected in ((0.5, 0.5), (0.95, 0.95), (0.99, 0.99)):
+        assert histogram.quantile(q) == pytest.approx(expected, rel=1 / LatencyHistogram.SUB_BUCKETS)
+    assert histogram.quantile(1.0) == pytest.approx(1.0)
+
+    summary = histogram.summary()
+    assert summary["count"] == 1000
+    assert summary["min_ms"] == pytest.approx(1)
+    assert summary["max_ms"] == pytest.approx(1000)
+
+
+def test_empty_histogram():
+    assert LatencyHistogram().quantile(0.5) is None
+    assert LatencyHistogram().summary()["p99_ms"] is None
+
+
+def test_parse_server_timing():
+    assert parse_server_timing('total;dur=12.5, kv;dur=3;desc="KV 4"') == {"total": 0.0125, "kv": 0.003}
+    assert parse_server_timing(None) == {}
+
+
+def test_snapshot_and_prometheus():
+    metrics = ClientMetrics()
+    metrics.record_request("GET", "/api/users/u1", 200, 0.05, bytes_received=100,
+                           server_timing="total;dur=10")
+    metrics.record_request("GET", "/api/users/u2", 503, 0.2)
+    metrics.record_error("GET", "/api/users/u3", TimeoutError(), 1.0)
+    metrics.record_retry("GET", "/api/users/u3")
+    metrics.task_submitted("t1")
+    metrics.task_finished("t1", "completed")
+
+    endpoint = metrics.snapshot()["endpoints"]["GET /api/users/{id}"]
+    assert endpoint["requests"] == 3
+    assert endpoint["statuses"] == {"2xx": 1, "5xx": 1}
+    assert endpoint["errors"] == {"http_503": 1, "TimeoutError": 1}
+    assert endpoint["retries"] == 1
+    assert endpoint["server_latency"]["count"] == 1
+
+    text = metrics.to_prometheus({"cloudflare_client_pending_tasks": (2, "等待提交")})
+    assert 'cloudflare_client_requests_total{method="GET",path="/api/users/{id}",status="2xx"} 1' in text
+    assert 'cloudflare_client_task_duration_seconds_count{status="completed"} 1' in text
+    assert "cloudflare_client_pending_tasks 2" in text
@@ -0,0 +1,134 @@
+"""
+离线任务队列：租约、确认、失败重试与重试上限
+"""
+import time
+
+import pytest
+
+from cloudflare_queue import OfflineTaskQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = OfflineTaskQueue(str(tmp_path / "pending.db"), max_attempts=2, lease_seconds=60)
+    yield q
+    q.close()
+
+
+def test_enqueue_is_idempotent_per_task_id(queue):
+    assert queue.enqueue({"task_id": "a", "urls": ["u1"]})
+    assert queue.enqueue({"task_id": "a", "urls": ["u2"]})
+    assert queue.count() == 1
+    assert queue.list_tasks()[0]["urls"] == ["u1"]
+
+
+def test_claim_leases_entries_in_order(queue):
+    for i in range(3):
+        queue.enqueue({"task_id": f"t{i}"})
+
+    claimed = queue.claim(limit=2)
+    assert [e["task_id"] for e in claimed] == ["t0", "t1"]
+    assert all(e["attempts"] == 1 for e in claimed)
+
+    # 已加租约的任务不会被再次取出
+    assert [e["task_id"] for e in queue.claim()] == ["t2"]
+    assert queue.claim() == []
+
+
+def test_ack_removes_entry(queue):
+    queue.enqueue({"task_id": "a"})
+    queue.claim()
+    queue.ack("a")
+    assert queue.count() == 0
+    assert queue.next_ready_time() is None
+
+
+def test_nack_releases_lease_after_delay(queue):
+    queue.enqueue({"task_id": "a"})
+    queue.claim()
+    queue.nack("a", "boom", retry_delay=30)
+
+    assert queue.claim() == []
+    assert queue.next_ready_time() > time.time() + 20
+    assert queue.list_tasks()[0]["last_error"] == "boom"
+
+    queue.nack("a", "boom")
+    assert [e["attempts"] for e in queue.claim()] == [2]
+
+
+def test_nack_marks_failed_after_max_attempts(queue):
+    queue.enqueue({"task_id": "a"})
+    for _ in range(2):
+        queue.claim()
+        queue.nack("a", "boom")
+
+    assert queue.count() == 0
+    assert queue.count("failed") == 1
+    assert queue.claim() == []
+
+    assert queue.requeue_failed() == 1
+    assert [e["attempts"] for e in queue.claim()] == [1]
+
+
+def test_expired_lease_becomes_visible_again(tmp_path):
+    q = OfflineTaskQueue(str(tmp_path / "pending.db"), lease_seconds=0)
+    try:
+        q.enqueue({"task_id": "a"})
+        assert len(q.claim()) == 1
+        # 租约到期（进程崩溃未确认）后重新可见
+        assert [e["attempts"] for e in q.claim()] == [2]
+    finally:
+        q.close()
+
+
+def test_queue_survives_reopen(tmp_path):
+    path = str(tmp_path / "pending.db")
+    q = OfflineTaskQueue(path)
+    q.enqueue({"task_id": "a", "email": "a@example.com"})
+    q.close()
+
+    q = OfflineTaskQueue(path)
+    try:
+        assert q.claim()[0]["task"] == {"task_id": "a", "email": "a@example.com"}
+    finally:
+        q.close()
+
+
+def _licensed(client):
+    client.authenticated = client.license_valid = True
+    client.user_id, client.username = "u1", "alice"
+    return client
+
+
+def test_drain_submits_every_batch(client):
+    for i in range(250):
+        client.pending_queue.enqueue({"task_id": f"t{i}", "urls": ["u"], "email": "a@example.com"})
+    submitted = []
+    client._submit_task_online = lambda task: submitted.append(task["task_id"]) or f"srv_{task['task_id']}"
+
+    result = _licensed(client)._submit_pending_tasks()
+
+    assert result == {"submitted": 250, "failed": 0}
+    assert sorted(submitted) == sorted(f"t{i}" for i in range(250))
+    assert client.pending_queue.count() == 0
+
+
+def test_drain_backs_off_failed_entries(client):
+    client.config["offline_queue"]["retry_backoff"] = 30
+    for i in range(3):
+        client.pending_queue.enqueue({"task_id": f"t{i}", "urls": ["u"], "email": "a@example.com"})
+    client._submit_task_online = lambda task: None
+
+    result = _licensed(client)._submit_pending_tasks()
+
+    # 整批失败后停止，失败的任务按退避时间延后，不会在本轮被反复取出
+    assert result == {"submitted": 0, "failed": 3}
+    assert client.pending_queue.count() == 3
+    assert client.pending_queue.next_ready_time() > time.time() + 20
+
+
+def test_drain_requires_license(client):
+    client.pending_queue.enqueue({"task_id": "t0"})
+    client.authenticated = True
+    assert client._submit_pending_tasks() == {"submitted": 0, "failed": 0}
+    assert client.pending_queue.count() == 1
@@ -0,0 +1,139 @@
+"""
+传输适配器：Http2Adapter 在 httpx 上实现 requests 的发送语义（证书、代理、超时、流式响应），缺少依赖时回退到 HTTP/1.1
+"""
+import ssl
+import importlib.util
+
+import pytest
+import requests
+
+from cloudflare_transport import Http2Adapter, KeepAliveAdapter, mount_transport
+
+httpx = pytest.importorskip("httpx")
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    """httpx 客户端改用 MockTransport：返回 (已挂载适配器的会话, 创建客户端的参数列表, 收到的请求列表)"""
+    created, received = [], []
+    handler = {"respond": lambda request: httpx.Response(200, json={"ok": True})}
+
+    def respond(request):
+        received.append(request)
+        return handler["respond"](request)
+
+    real_client = httpx.Client
+
+    def client_factory(**kwargs):
+        created.append(kwargs)
+        return real_client(transport=httpx.MockTransport(respond))
+
+    monkeypatch.setattr(httpx, "Client", client_factory)
+    session = requests.Session()
+    # 不读取环境中的代理设置
+    session.trust_env = False
+    adapter = Http2Adapter(http2=False)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.handler = handler
+    yield session, created, received
+    session.close()
+
+
+def test_round_trip(transport):
+    session, created, received = transport
+    session.handler["respond"] = lambda request: httpx.Response(
+        201, headers={"Content-Type": "application/json", "ETag": 'W/"1"'}, content=b'{"id": "t1"}')
+
+    response = session.post("https://api.example.com/api/tasks", json={"urls": ["a"]},
+                            headers={"Upgrade": "h2c", "Proxy-Connection": "keep-alive", "X-User-ID": "u1"})
+
+    assert response.status_code == 201
+    assert response.json() == {"id": "t1"}
+    assert response.headers["etag"] == 'W/"1"'
+    request = received[0]
+    assert request.method == "POST" and str(request.url) == "https://api.example.com/api/tasks"
+    assert request.headers["X-User-ID"] == "u1"
+    # HTTP/2 禁止的逐跳头不转发
+    assert "upgrade" not in request.headers and "proxy-connection" not in request.headers
+    assert request.content == b'{"urls": ["a"]}'
+    assert created[0]["http2"] is False and created[0]["trust_env"] is False
+
+
+def test_streamed_body(transport):
+    session, _, _ = transport
+    session.handler["respond"] = lambda request: httpx.Response(200, content=b"x" * 100000)
+
+    response = session.get("https://api.example.com/download/f", stream=True)
+
+    assert sum(len(chunk) for chunk in response.iter_content(8192)) == 100000
+
+
+def test_one_client_per_tls_and_proxy_settings(transport):
+    session, created, _ = transport
+
+    session.get("https://api.example.com/a")
+    session.get("https://api.example.com/b")
+    assert len(created) == 1
+    assert created[0]["verify"].verify_mode == ssl.CERT_REQUIRED
+
+    session.get("https://api.example.com/a", verify=False)
+    assert len(created) == 2
+    assert created[1]["verify"].verify_mode == ssl.CERT_NONE
+
+    session.get("https://api.example.com/a", proxies={"https": "http://proxy:3128"})
+    assert created[2]["proxy"] == "http://proxy:3128"
+
+    # 明文请求忽略证书设置
+    session.get("http://api.example.com/a", verify=False)
+    assert len(created) == 3
+
+
+def test_missing_ca_file_is_ssl_error(transport, tmp_path):
+    session, _, _ = transport
+
+    with pytest.raises(requests.exceptions.SSLError):
+        session.get("https://api.example.com/a", verify=str(tmp_path / "missing.pem"))
+
+
+@pytest.mark.parametrize("error, expected", [
+    (httpx.ConnectTimeout, requests.exceptions.ConnectTimeout),
+    (httpx.ReadTimeout, requests.exceptions.ReadTimeout),
+    (httpx.ConnectError, requests.exceptions.ConnectionError),
+])
+def test_transport_errors_map_to_requests(transport, error, expected):
+    session, _, _ = transport
+
+    def fail(request):
+        raise error("boom", request=request)
+
+    session.handler["respond"] = fail
+    with pytest.raises(expected):
+        session.get("https://api.example.com/a", timeout=(3, 7))
+
+
+def test_timeout_tuple_is_connect_and_read(transport):
+    session, _, received = transport
+
+    session.get("https://api.example.com/a", timeout=(3, 7))
+
+    timeout = received[0].extensions["timeout"]
+    assert (timeout["connect"], timeout["read"]) == (3, 7)
+
+
+def test_mount_falls_back_without_h2():
+    if importlib.util.find_spec("h2") is not None:
+        pytest.skip("已安装 h2")
+    session = requests.Session()
+
+    protocol = mount_transport(session, {"http2": True})
+
+    assert protocol == "HTTP/1.1"
+    assert isinstance(session.get_adapter("https://api.example.com"), KeepAliveAdapter)
+
+
+def test_mount_without_keep_alive_closes_connections():
+    session = requests.Session()
+
+    assert mount_transport(session, {"keep_alive": False, "http2": True}) == "HTTP/1.1"
+    assert session.headers["Connection"] == "close"
@@ -0,0 +1,83 @@
+"""
+worker 账户存储：用户和许可证按键存储，登录/注册/激活码验证通过索引直接查找
+"""
+import json
+import hashlib
+
+import pytest
+
+from conftest import keyed_accounts
+
+PASSWORD = hashlib.sha256(b"pw").hexdigest()
+
+
+@pytest.fixture
+def worker(worker_factory):
+    return worker_factory(seed=keyed_accounts())
+
+
+def login(worker, username, password=PASSWORD):
+    return worker.post("/api/auth/login", {"username": username, "password": password, "device_id": "d1"})
+
+
+def test_login_by_name_index(worker):
+    response = login(worker, "alice")
+
+    assert response.status_code == 200
+    info = response.json()["user_info"]
+    assert info["user_id"] == "u1"
+    # 许可证来自 user_licenses 索引
+    assert info["license_valid"] and info["license_info"]["license_key"] == "K1"
+    assert json.loads(worker.kv("user:u1")["user:u1"])["device_id"] == "d1"
+
+
+def test_login_failures(worker):
+    assert login(worker, "alice", "wrong").status_code == 401
+    assert login(worker, "nobody").status_code == 401
+
+
+def test_disabled_account_is_rejected(worker_factory):
+    seed = keyed_accounts()
+    seed["user:u1"] = {**seed["user:u1"], "is_active": False}
+    worker = worker_factory(seed=seed)
+
+    assert login(worker, "alice").status_code == 403
+
+
+def test_keyed_storage_needs_no_defaults_or_migration(worker):
+    login(worker, "alice")
+
+    assert set(worker.kv("user:")) == {"user:u1"}
+    assert worker.kv("users") == {} and worker.kv("job:") == {}
+
+
+def test_create_user_writes_indexes(worker):
+    created = worker.post("/api/users", {"username": "bob", "email": "bob@example.com", "password": "secret"})
+
+    assert created.status_code == 200
+    user_id = created.json()["user_id"]
+    assert worker.kv("user_by_name:bob") == {"user_by_name:bob": user_id}
+    assert worker.kv("user_by_email:bob@example.com") == {"user_by_email:bob@example.com": user_id}
+    assert login(worker, "bob", "secret").json()["user_id"] == user_id
+
+
+@pytest.mark.parametrize("body", [
+    {"username": "alice", "email": "other@example.com", "password": "x"},
+    {"username": "other", "email": "alice@example.com", "password": "x"},
+])
+def test_create_user_rejects_duplicates(worker, body):
+    response = worker.post("/api/users", body)
+
+    assert response.status_code == 400
+    assert set(worker.kv("user:")) == {"user:u1"}
+
+
+def test_validate_license_by_key(worker):
+    valid = worker.post("/api/license/validate", {"license_key": "K1", "user_id": "u1", "device_id": "d1"})
+    assert valid.json()["valid"]
+    license = json.loads(worker.kv("license:K1")["license:K1"])
+    assert license["used_count"] == 1 and license["device_id"] == "d1"
+
+    assert worker.post("/api/license/validate", {"license_key": "K9"}).status_code == 404
+    assert worker.post("/api/license/validate", {"license_key": "K1", "user_id": "u2"}).status_code == 400
+    assert worker.post("/api/license/validate", {"license_key": "K1", "device_id": "d2"}).status_code == 400
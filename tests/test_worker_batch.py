@@ -0,0 +1,74 @@
+"""
+worker 批量接口：一次请求创建多个任务（逐项校验、整体准入），一次请求查询多个任务状态
+"""
+import json
+
+import pytest
+
+from conftest import keyed_accounts
+
+
+@pytest.fixture
+def worker(worker_factory):
+    return worker_factory(env={"MAX_URLS_PER_TASK": "3", "MAX_TASKS_PER_USER": "4"}, seed=keyed_accounts())
+
+
+def item(*names, email="alice@example.com"):
+    return {"urls": [f"https://example.com/{name}" for name in names], "email": email}
+
+
+def create_batch(worker, tasks, user_id="u1"):
+    return worker.post("/api/tasks:batch", {"user_id": user_id, "tasks": tasks})
+
+
+def test_results_follow_request_order(worker):
+    response = create_batch(worker, [item("a"), {"urls": []}, item("b", "c", "d", "e"), item("f", "g")])
+
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["created"], data["failed"]) == (2, 2)
+    assert [result["success"] for result in data["results"]] == [True, False, False, True]
+    assert data["results"][3]["task"]["urls"] == ["https://example.com/f", "https://example.com/g"]
+
+    # 任务、用户索引各写入一次
+    created = [result["task"]["task_id"] for result in data["results"] if result["success"]]
+    assert {f"task:{task_id}" for task_id in created} == set(worker.kv("task:"))
+    index = json.loads(worker.kv("user_tasks:u1")["user_tasks:u1"])
+    assert [entry["id"] for entry in index] == created
+
+
+def test_invalid_batches_are_rejected(worker):
+    assert create_batch(worker, []).status_code == 400
+    assert create_batch(worker, [item(str(i)) for i in range(101)]).status_code == 400
+    assert create_batch(worker, [item("a")], user_id="nobody").status_code == 404
+    assert worker.kv("task:") == {}
+
+
+def test_admission_applies_to_whole_batch(worker):
+    assert create_batch(worker, [item("a"), item("b"), item("c")]).json()["created"] == 3
+
+    rejected = create_batch(worker, [item("d"), item("e")])
+
+    assert rejected.status_code == 429
+    assert rejected.headers["retry-after"] == "120"
+    assert rejected.json()["active_tasks"] == 3
+    # 整批拒绝，不部分创建
+    assert len(worker.kv("task:")) == 3
+
+
+def test_status_batch_reports_missing(worker):
+    created = create_batch(worker, [item("a"), item("b")]).json()["results"]
+    task_ids = [result["task"]["task_id"] for result in created]
+
+    response = worker.post("/api/tasks/status:batch", {"task_ids": [task_ids[1], "task_missing", task_ids[0]],
+                                                      "fields": "task_id,status"})
+
+    data = response.json()
+    assert [task["task_id"] for task in data["tasks"]] == [task_ids[1], task_ids[0]]
+    assert all(set(task) == {"task_id", "status"} for task in data["tasks"])
+    assert data["missing"] == ["task_missing"]
+
+
+def test_status_batch_limits(worker):
+    assert worker.post("/api/tasks/status:batch", {"task_ids": []}).status_code == 400
+    assert worker.post("/api/tasks/status:batch", {"task_ids": [f"t{i}" for i in range(101)]}).status_code == 400
@@ -0,0 +1,81 @@
+"""
+worker 定时任务：各项维护任务共用一次调用的 KV 操作预算，依次分配，未用完的预算顺延给后面的任务
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import keyed_accounts
+
+BUDGET = 100
+NOW = datetime.now(timezone.utc)
+
+
+def pending_tasks(count):
+    """尚未写入任务索引的新版任务"""
+    tasks = {}
+    for i in range(count):
+        created = (NOW - timedelta(minutes=i)).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        tasks[f"task:t{i:04d}"] = {"task_id": f"t{i:04d}", "user_id": "u1", "urls": ["https://example.com"],
+                                   "status": "pending", "progress": 0, "created_at": created, "updated_at": created}
+    return tasks
+
+
+def last_run(worker):
+    runs = [json.loads(value) for value in worker.kv("logs:").values()]
+    return [run for run in runs if run["type"] == "scheduled_run"][-1]["data"]
+
+
+@pytest.fixture
+def worker(worker_factory):
+    # 已有统计基准，统计只做分片合并
+    seed = {**keyed_accounts(), **pending_tasks(60), "stats": {"total_users": 1, "folded_through": None}}
+    return worker_factory(env={"CRON_KV_BUDGET": str(BUDGET)}, seed=seed)
+
+
+def test_run_stays_within_budget(worker):
+    counted = worker.scheduled()
+
+    result = last_run(worker)
+    assert result["kv_ops"] <= BUDGET
+    # 预算之外只有记录本次运行的一条日志
+    assert counted["kv_ops"] <= result["kv_ops"] + 1
+    assert 0 < result["task_index"]["indexed"] < 60 and not result["task_index"]["complete"]
+
+
+def test_unused_share_rolls_over(worker):
+    worker.scheduled()
+    result = last_run(worker)
+
+    # 统计、日志整理和备份几乎不用操作，省下的预算由后面的任务用掉
+    assert result["stats"] == {"compact": {"folded": 0, "removed": 0}} and result["backup"] is None
+    assert result["kv_ops"] >= BUDGET * 0.8
+    # 过期清理排在最后，扫描量远多于平均分配的五分之一预算
+    assert result["tasks"]["scanned"] > BUDGET / 5
+
+
+def test_backfill_resumes_until_complete(worker):
+    for _ in range(20):
+        worker.scheduled()
+        if last_run(worker)["task_index"]["complete"]:
+            break
+
+    assert last_run(worker)["task_index"]["complete"]
+    assert len(worker.kv("idx:tasks:")) == 60
+    assert worker.kv("task_index_ready") and worker.kv("task_index_cursor") == {}
+
+
+def test_migration_share_leaves_room_for_other_jobs(worker_factory):
+    legacy = [{"task_id": f"legacy{i:04d}", "user_id": "u1", "urls": ["https://example.com"], "status": "pending",
+               "created_at": NOW.isoformat().replace("+00:00", "Z")} for i in range(200)]
+    worker = worker_factory(env={"CRON_KV_BUDGET": str(BUDGET)}, seed={**keyed_accounts(), "tasks": legacy})
+
+    counted = worker.scheduled()
+
+    result = last_run(worker)
+    assert not result["migration"]["complete"]
+    assert counted["kv_ops"] <= BUDGET + 1
+    # 迁移完成前不补写索引、不备份、不清理过期任务，统计和日志整理照常执行
+    assert "stats" in result and "cleaned_logs" in result
+    assert not {"task_index", "backup", "tasks"} & set(result)
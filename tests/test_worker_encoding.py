@@ -0,0 +1,99 @@
+"""
+worker 响应编码：MessagePack 协商与编码、按表示区分的 ETag、条件请求、压缩与字段投影
+"""
+import pytest
+
+msgpack = pytest.importorskip("msgpack")
+
+MSGPACK = {"Accept": "application/msgpack", "X-Client-Version": "2.1.0"}
+
+
+@pytest.fixture
+def worker(worker_factory):
+    w = worker_factory()
+    # 覆盖 MessagePack 各种长度前缀：长字符串、多元素数组、中文、null/布尔/数字
+    response = w.post("/api/tasks", {
+        "user_id": "u1", "email": "alice@example.com",
+        "urls": [f"https://example.com/{'长路径' * 30}/{i}.pdf" for i in range(20)],
+        "notes": "备注" * 200
+    })
+    assert response.status_code == 200
+    return w
+
+
+def without_clock(data):
+    """去掉每次请求都会变化的服务器时间"""
+    if isinstance(data, dict):
+        return {k: v for k, v in data.items() if k not in ("server_time", "timestamp")}
+    return data
+
+
+@pytest.mark.parametrize("path", ["/api/users/u1", "/api/tasks", "/api/stats", "/api/ping"])
+def test_msgpack_matches_json(worker, path):
+    as_json = worker.get(path, headers={"X-Client-Version": "2.1.0"})
+    as_msgpack = worker.get(path, headers=MSGPACK)
+
+    assert as_json.headers["content-type"].startswith("application/json")
+    assert as_msgpack.headers["content-type"] == "application/msgpack"
+    assert without_clock(msgpack.unpackb(as_msgpack.content, raw=False)) == without_clock(as_json.json())
+
+
+def test_old_clients_get_json(worker):
+    response = worker.get("/api/users/u1", headers={**MSGPACK, "X-Client-Version": "2.0.0"})
+
+    assert response.headers["content-type"].startswith("application/json")
+    assert response.json()["id"] == "u1"
+
+
+def test_errors_are_encoded_too(worker):
+    response = worker.get("/api/tasks/missing", headers=MSGPACK)
+
+    assert response.status_code == 404
+    assert "error" in msgpack.unpackb(response.content, raw=False)
+
+
+def test_etag_depends_on_representation(worker):
+    as_json = worker.get("/api/users/u1", headers={"X-Client-Version": "2.1.0"})
+    as_msgpack = worker.get("/api/users/u1", headers=MSGPACK)
+
+    assert as_json.headers["etag"] != as_msgpack.headers["etag"]
+    for response in (as_json, as_msgpack):
+        vary = [v.strip() for v in response.headers["vary"].split(",")]
+        assert "Accept" in vary and "Accept-Encoding" in vary
+
+
+def test_conditional_get_uses_variant_etag(worker):
+    json_etag = worker.get("/api/users/u1", headers={"X-Client-Version": "2.1.0"}).headers["etag"]
+    msgpack_etag = worker.get("/api/users/u1", headers=MSGPACK).headers["etag"]
+
+    same = worker.get("/api/users/u1", headers={**MSGPACK, "If-None-Match": msgpack_etag})
+    assert same.status_code == 304
+    assert same.content == b""
+    assert same.headers["etag"] == msgpack_etag
+
+    assert worker.get("/api/users/u1", headers={"X-Client-Version": "2.1.0",
+                                                "If-None-Match": json_etag}).status_code == 304
+
+    # 另一种表示的 ETag 不能命中
+    crossed = worker.get("/api/users/u1", headers={**MSGPACK, "If-None-Match": json_etag})
+    assert crossed.status_code == 200
+    assert msgpack.unpackb(crossed.content, raw=False)["id"] == "u1"
+    assert worker.get("/api/users/u1", headers={"If-None-Match": msgpack_etag}).status_code == 200
+
+
+def test_content_encoding_negotiation(worker):
+    large = worker.get("/api/tasks", headers={"Accept-Encoding": "gzip, br"})
+    assert large.headers.get("content-encoding") == "br"
+    assert worker.get("/api/tasks", headers={"Accept-Encoding": "gzip"}).headers.get("content-encoding") == "gzip"
+    assert "content-encoding" not in worker.get("/api/tasks", headers={"Accept-Encoding": "identity"}).headers
+
+    # 小响应不压缩
+    assert "content-encoding" not in worker.get("/api/ping", headers={"Accept-Encoding": "gzip"}).headers
+
+
+def test_field_projection(worker):
+    task_id = worker.get("/api/tasks").json()[0]["task_id"]
+
+    task = worker.get(f"/api/tasks/{task_id}?fields=status,progress").json()
+
+    assert task == {"task_id": task_id, "status": "pending", "progress": 0}
@@ -0,0 +1,157 @@
+"""
+worker 旧版整体存储的分段迁移：迁移由定时任务按操作预算推进，完成前读取接口回退到旧数据
+"""
+import json
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from conftest import seed_accounts
+
+# 保留期内的时间，迁移完成后的过期清理不会删除这些任务
+START = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(days=1)
+
+
+def iso(moment):
+    return moment.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def legacy_tasks(count):
+    """旧版 tasks 数组：u1 / u2 交替，每个任务间隔一分钟，任务ID与 generateId 一样内含创建时间"""
+    tasks = []
+    for i in range(count):
+        created = START + timedelta(minutes=i)
+        millis = int(created.timestamp() * 1000)
+        tasks.append({"task_id": f"task_{format_base36(millis)}_{i:04d}", "user_id": f"u{i % 2 + 1}",
+                      "urls": [f"https://example.com/{i}"], "status": "completed", "progress": 100,
+                      "created_at": iso(created), "completed_at": iso(created + timedelta(seconds=30))})
+    return tasks
+
+
+def format_base36(number):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while number:
+        number, rest = divmod(number, 36)
+        text = digits[rest] + text
+    return text
+
+
+def walk(worker, path, limit):
+    ids, cursor = [], None
+    while True:
+        page = worker.get(f"{path}?limit={limit}" + (f"&cursor={cursor}" if cursor else "")).json()
+        ids.extend(task["task_id"] for task in page["tasks"])
+        cursor = page["cursor"]
+        if not cursor:
+            return ids
+
+
+def start(worker_factory, tasks, budget="40"):
+    return worker_factory(env={"CRON_KV_BUDGET": budget, "QUEUE_MIGRATION_KV_BUDGET": "0"},
+                          seed={**seed_accounts(), "tasks": tasks})
+
+
+def test_requests_do_not_migrate_and_read_legacy_tasks(worker_factory):
+    tasks = legacy_tasks(6)
+    worker = start(worker_factory, tasks)
+
+    assert worker.get(f"/api/tasks/{tasks[0]['task_id']}").json()["task_id"] == tasks[0]["task_id"]
+    assert len(worker.get("/api/tasks").json()) == 6
+    assert walk(worker, "/api/users/u1/tasks", 2) == [t["task_id"] for t in reversed(tasks) if t["user_id"] == "u1"]
+
+    # 请求路径不做迁移
+    assert "tasks" in worker.kv("tasks")
+    assert worker.kv("task:") == {}
+
+
+def test_cron_migrates_in_budgeted_slices(worker_factory):
+    tasks = legacy_tasks(20)
+    worker = start(worker_factory, tasks)
+    expected = [t["task_id"] for t in reversed(tasks)]
+
+    worker.scheduled()
+    assert "tasks" in worker.kv("tasks")
+    done = json.loads(worker.kv("job:task_migration")["job:task_migration"])["done"]
+    assert 0 < done < len(tasks)
+
+    # 迁移中途：已迁移的任务来自索引，其余来自旧数据，不重复也不遗漏
+    assert walk(worker, "/api/tasks", 3) == expected
+
+    for _ in range(20):
+        if "tasks" not in worker.kv("tasks"):
+            break
+        worker.scheduled()
+
+    assert "tasks" not in worker.kv("tasks")
+    assert worker.kv("job:task_migration") == {}
+    assert len(worker.kv("task:")) == 20
+    assert walk(worker, "/api/tasks", 7) == expected
+    u1_index = json.loads(worker.kv("user_tasks:u1")["user_tasks:u1"])
+    assert [entry["id"] for entry in u1_index] == [t["task_id"] for t in tasks if t["user_id"] == "u1"]
+
+
+def test_migration_keeps_tasks_updated_meanwhile(worker_factory):
+    tasks = legacy_tasks(2)
+    # 迁移前已写入新版数据的任务（迁移期间被更新过）不被旧数据覆盖
+    newer = {**tasks[0], "status": "failed", "error_message": "updated"}
+    worker = worker_factory(seed={**seed_accounts(), "tasks": tasks, f"task:{newer['task_id']}": newer})
+
+    worker.scheduled()
+
+    assert "tasks" not in worker.kv("tasks")
+    assert worker.get(f"/api/tasks/{newer['task_id']}").json()["status"] == "failed"
+    assert worker.get(f"/api/tasks/{tasks[1]['task_id']}").json()["status"] == "completed"
+
+
+def legacy_accounts(count):
+    """count 个旧版用户，每人一个激活码"""
+    accounts = seed_accounts()
+    user, license = accounts["users"][0], accounts["licenses"][0]
+    for i in range(2, count + 1):
+        accounts["users"].append({**user, "id": f"u{i}", "username": f"user{i}", "email": f"user{i}@example.com"})
+        accounts["licenses"].append({**license, "id": f"l{i}", "license_key": f"K{i}", "user_id": f"u{i}",
+                                     "username": f"user{i}"})
+    return accounts
+
+
+def login(worker, username):
+    return worker.post("/api/auth/login", {"username": username,
+                                           "password": hashlib.sha256(b"pw").hexdigest()})
+
+
+def test_accounts_readable_before_migration(worker_factory):
+    worker = worker_factory(env={"QUEUE_MIGRATION_KV_BUDGET": "0"}, seed=legacy_accounts(3))
+
+    assert login(worker, "user3").status_code == 200
+    assert worker.post("/api/license/validate", {"license_key": "K2", "user_id": "u2"}).json()["valid"]
+    assert len(worker.get("/api/users").json()) == 3
+    # 旧版用户名/邮箱同样不能重复注册
+    duplicate = worker.post("/api/users", {"username": "user2", "email": "new@example.com", "password": "x"})
+    assert duplicate.status_code == 400
+    assert "users" in worker.kv("users") and "licenses" in worker.kv("licenses")
+
+
+def test_cron_migrates_accounts_in_budgeted_slices(worker_factory):
+    worker = worker_factory(env={"CRON_KV_BUDGET": "40", "QUEUE_MIGRATION_KV_BUDGET": "0"},
+                            seed=legacy_accounts(30))
+
+    worker.scheduled()
+    assert "users" in worker.kv("users")
+    assert "job:account_migration" in worker.kv("job:")
+    # 迁移中途：已迁移和未迁移的用户都能登录
+    assert login(worker, "alice").status_code == 200
+    assert login(worker, "user30").status_code == 200
+
+    for _ in range(20):
+        if "licenses" not in worker.kv("licenses"):
+            break
+        worker.scheduled()
+
+    assert "users" not in worker.kv("users") and "licenses" not in worker.kv("licenses")
+    assert "job:account_migration" not in worker.kv("job:")
+    assert len(worker.kv("user:")) == 30
+    assert worker.kv("user_by_name:user17") == {"user_by_name:user17": "u17"}
+    assert json.loads(worker.kv("user_licenses:u17")["user_licenses:u17"]) == ["K17"]
+    # 迁移前登录更新过的用户保留新数据
+    assert json.loads(worker.kv("user:u30")["user:u30"])["last_login"]
+    assert worker.post("/api/license/validate", {"license_key": "K30", "user_id": "u30"}).json()["valid"]
@@ -0,0 +1,62 @@
+"""
+worker 本地任务队列：处理请求交给队列执行，超时视为失败并重新投递，超过最大次数进入死信并标记任务失败
+"""
+import time
+
+import pytest
+
+from conftest import keyed_accounts
+
+
+def create_task(worker):
+    response = worker.post("/api/tasks", {"user_id": "u1", "email": "alice@example.com",
+                                          "urls": ["https://example.com/a", "https://example.com/b"]})
+    return response.json()["task"]["task_id"]
+
+
+def test_task_runs_to_completion(worker_factory):
+    worker = worker_factory(env={"TASK_STEP_DELAY_MS": "1"}, seed=keyed_accounts())
+    task_id = create_task(worker)
+
+    started = worker.post(f"/api/tasks/{task_id}/process")
+    assert started.status_code == 200 and started.json()["task"]["status"] == "processing"
+
+    # 测试桩等待 waitUntil 中的队列排空后才返回
+    task = worker.get(f"/api/tasks/{task_id}").json()
+    assert task["status"] == "completed" and task["progress"] == 100
+    assert len(task["direct_links"]) == 2
+    queue = worker.get("/api/queue").json()
+    assert (queue["backend"], queue["queued"], queue["active"], queue["dead_letters"]) == ("local", 0, 0, [])
+
+    # 只能处理待处理的任务
+    assert worker.post(f"/api/tasks/{task_id}/process").status_code == 400
+    assert worker.post("/api/tasks/task_missing/process").status_code == 404
+
+
+def test_timeouts_end_in_dead_letter(worker_factory):
+    worker = worker_factory(env={"TASK_STEP_DELAY_MS": "300", "TASK_TIMEOUT": "0.1", "TASK_MAX_ATTEMPTS": "2",
+                                 "TASK_RETRY_DELAY": "0"}, seed=keyed_accounts())
+    task_id = create_task(worker)
+
+    worker.post(f"/api/tasks/{task_id}/process")
+
+    task = worker.get(f"/api/tasks/{task_id}").json()
+    assert task["status"] == "failed"
+    dead_letters = worker.get("/api/queue").json()["dead_letters"]
+    assert [(d["body"]["task_id"], d["attempts"]) for d in dead_letters] == [(task_id, 2)]
+
+    # 超时的执行仍在运行，租约失效后不会覆盖失败结果
+    time.sleep(0.5)
+    task = worker.get(f"/api/tasks/{task_id}").json()
+    assert task["status"] == "failed" and task["progress"] == 10
+
+
+@pytest.mark.parametrize("attempts", ["1", "3"])
+def test_max_attempts_is_configurable(worker_factory, attempts):
+    worker = worker_factory(env={"TASK_STEP_DELAY_MS": "300", "TASK_TIMEOUT": "0.1", "TASK_MAX_ATTEMPTS": attempts,
+                                 "TASK_RETRY_DELAY": "0"}, seed=keyed_accounts())
+    task_id = create_task(worker)
+
+    worker.post(f"/api/tasks/{task_id}/process")
+
+    assert worker.get("/api/queue").json()["dead_letters"][0]["attempts"] == int(attempts)
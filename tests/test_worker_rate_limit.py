@@ -0,0 +1,58 @@
+"""
+worker 限流：按客户端IP+用户的令牌桶、限流响应头，以及与之区分的任务准入拒绝
+"""
+import pytest
+
+ALICE = {"X-User-ID": "u1", "X-Device-ID": "device-a", "CF-Connecting-IP": "203.0.113.1"}
+
+
+@pytest.fixture
+def worker(worker_factory):
+    return worker_factory(env={"ENABLE_RATE_LIMIT": "true", "RATE_LIMIT_REQUESTS": "3",
+                               "RATE_LIMIT_PERIOD": "60", "MAX_TASKS_PER_USER": "1"})
+
+
+def test_token_bucket_limits_requests(worker):
+    remaining = []
+    for _ in range(3):
+        response = worker.get("/api/users/u1", headers=ALICE)
+        assert response.status_code == 200
+        assert response.headers["x-ratelimit-limit"] == "3"
+        remaining.append(response.headers["x-ratelimit-remaining"])
+    assert remaining == ["2", "1", "0"]
+
+    limited = worker.get("/api/users/u1", headers=ALICE)
+    assert limited.status_code == 429
+    assert limited.headers["x-ratelimit-remaining"] == "0"
+    # 每 20 秒恢复一个令牌
+    assert 1 <= int(limited.headers["retry-after"]) <= 20
+
+
+def test_buckets_are_per_ip_and_user(worker):
+    for _ in range(4):
+        worker.get("/api/users/u1", headers=ALICE)
+
+    # 只更换自报的设备ID不会得到新的配额
+    assert worker.get("/api/users/u1", headers={**ALICE, "X-Device-ID": "device-b"}).status_code == 429
+    assert worker.get("/api/users/u1", headers={**ALICE, "X-User-ID": "u2"}).status_code != 429
+    assert worker.get("/api/users/u1", headers={**ALICE, "CF-Connecting-IP": "203.0.113.2"}).status_code != 429
+
+
+def test_ping_is_exempt(worker):
+    for _ in range(5):
+        response = worker.get("/api/ping", headers=ALICE)
+        assert response.status_code == 200
+        assert "x-ratelimit-remaining" not in response.headers
+
+
+def test_admission_rejection_keeps_quota(worker):
+    task = {"user_id": "u1", "urls": ["https://example.com/a"], "email": "alice@example.com"}
+    assert worker.post("/api/tasks", task, headers=ALICE).status_code == 200
+
+    rejected = worker.post("/api/tasks", task, headers=ALICE)
+
+    # 未完成任务超限的429带 Retry-After，但限流配额仍有剩余，客户端据此区分，不应重试
+    assert rejected.status_code == 429
+    assert rejected.headers["retry-after"] == "120"
+    assert rejected.headers["x-ratelimit-remaining"] != "0"
+    assert rejected.json()["max_tasks"] == 1
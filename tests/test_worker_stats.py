@@ -0,0 +1,105 @@
+"""
+worker 统计计数：请求增量写入按小时的分片，定时任务把已结束的小时合并进基准，全量重建由定时任务分段执行
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import keyed_accounts
+
+NOW = datetime.now(timezone.utc)
+
+
+def bucket(hours_ago):
+    return (NOW - timedelta(hours=hours_ago)).strftime("%Y-%m-%d-%H")
+
+
+def counters(**fields):
+    return {"total_users": 0, "active_users": 0, "total_tasks": 0, "task_status": {}, "total_licenses": 0,
+            "license_expiries": {}, "tasks_by_hour": {}, **fields}
+
+
+@pytest.fixture
+def worker(worker_factory):
+    seed = {
+        **keyed_accounts(),
+        "stats": {**counters(total_users=1, active_users=1, total_tasks=10, task_status={"completed": 10}),
+                  "rebuilt_at": None, "folded_through": bucket(10)},
+        # 已合并过的分片（读取时跳过，合并时删除）
+        f"stats:shard:{bucket(12)}:old": counters(total_tasks=100),
+        f"stats:shard:{bucket(6)}:a": counters(total_tasks=2, task_status={"completed": 2}),
+        f"stats:shard:{bucket(3)}:b": counters(total_tasks=1, task_status={"failed": 1}),
+        f"stats:shard:{bucket(0)}:c": counters(total_tasks=1, task_status={"pending": 1}),
+    }
+    return worker_factory(seed=seed)
+
+
+def stats_base(worker):
+    return json.loads(worker.kv("stats")["stats"])
+
+
+def test_reads_base_plus_unfolded_shards(worker):
+    stats = worker.get("/api/stats").json()
+
+    assert stats["total_tasks"] == 14
+    assert (stats["completed_tasks"], stats["failed_tasks"], stats["pending_tasks"]) == (12, 1, 1)
+
+
+def test_requests_write_own_shard(worker):
+    worker.post("/api/users", {"username": "bob", "email": "bob@example.com", "password": "x"})
+
+    own = [value for key, value in worker.kv(f"stats:shard:{bucket(0)}:").items() if not key.endswith(":c")]
+    assert [json.loads(value)["total_users"] for value in own] == [1]
+    assert worker.get("/api/stats").json()["total_users"] == 2
+
+
+def test_cron_folds_finished_hours(worker):
+    worker.scheduled()
+
+    base = stats_base(worker)
+    assert base["total_tasks"] == 13
+    assert base["task_status"] == {"completed": 12, "failed": 1}
+    # 当前和上一小时的分片仍可能被写入，不合并
+    assert base["folded_through"] == bucket(3)
+    assert list(worker.kv("stats:shard:")) == [f"stats:shard:{bucket(0)}:c"]
+    assert worker.get("/api/stats").json()["total_tasks"] == 14
+
+
+def test_rebuild_runs_in_cron(worker):
+    response = worker.post("/api/stats/rebuild")
+    assert response.status_code == 202
+    # 请求中只登记重建
+    assert "stats_rebuild_requested" in worker.kv("stats_rebuild")
+    assert stats_base(worker)["rebuilt_at"] is None
+
+    worker.scheduled()
+
+    assert worker.kv("stats_rebuild") == {} and worker.kv("job:stats_rebuild") == {}
+    base = stats_base(worker)
+    assert base["rebuilt_at"]
+    assert base["folded_through"] == bucket(2)
+    # 按实际数据重建：1个用户、1个许可证、没有任务；上一小时之后的分片照常叠加
+    stats = worker.get("/api/stats").json()
+    assert (stats["total_users"], stats["total_licenses"], stats["active_licenses"]) == (1, 1, 1)
+    assert stats["total_tasks"] == 0 and stats["pending_tasks"] == 0
+
+
+def test_rebuild_resumes_across_runs(worker_factory):
+    seed = keyed_accounts()
+    for i in range(2, 40):
+        seed[f"user:u{i}"] = {**seed["user:u1"], "id": f"u{i}", "username": f"user{i}"}
+    # 没有基准计数时定时任务直接开始重建
+    worker = worker_factory(env={"CRON_KV_BUDGET": "100"}, seed=seed)
+
+    worker.scheduled()
+    job = json.loads(worker.kv("job:stats_rebuild")["job:stats_rebuild"])
+    assert job["section"] == 0 and job["cursor"]
+
+    for _ in range(10):
+        if not worker.kv("job:stats_rebuild"):
+            break
+        worker.scheduled()
+
+    assert worker.kv("job:stats_rebuild") == {}
+    assert stats_base(worker)["total_users"] == 39
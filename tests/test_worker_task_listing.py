@@ -0,0 +1,91 @@
+"""
+worker 任务列表：按索引键分页、状态过滤、since 增量游标（在 Node 中运行 worker.js）
+"""
+import pytest
+
+
+@pytest.fixture
+def worker(worker_factory):
+    return worker_factory(env={"MAX_TASKS_PER_USER": "100"})
+
+
+def create_tasks(worker, count):
+    ids = []
+    for i in range(count):
+        response = worker.post("/api/tasks", {"user_id": "u1", "urls": [f"https://example.com/{i}"],
+                                              "email": "alice@example.com"})
+        assert response.status_code == 200
+        ids.append(response.json()["task"]["task_id"])
+    return ids
+
+
+def walk(worker, path, limit):
+    """沿 cursor 取完所有页，返回 (任务列表, 页数)"""
+    tasks, pages, cursor = [], 0, None
+    while True:
+        url = f"{path}?limit={limit}" + (f"&cursor={cursor}" if cursor else "")
+        page = worker.get(url).json()
+        tasks.extend(page["tasks"])
+        pages += 1
+        cursor = page["cursor"]
+        if not cursor:
+            assert not page["has_more"]
+            return tasks, pages
+        assert page["has_more"]
+
+
+@pytest.mark.parametrize("path", ["/api/tasks", "/api/users/u1/tasks"])
+def test_pagination_visits_every_task_once(worker, path):
+    ids = create_tasks(worker, 12)
+
+    tasks, pages = walk(worker, path, limit=5)
+
+    assert sorted(t["task_id"] for t in tasks) == sorted(ids)
+    assert pages == 3
+    # 按创建时间倒序
+    created = [t["created_at"] for t in tasks]
+    assert created == sorted(created, reverse=True)
+
+
+def test_status_filter(worker):
+    create_tasks(worker, 3)
+
+    assert len(worker.get("/api/tasks?limit=50&status=pending").json()["tasks"]) == 3
+    assert worker.get("/api/tasks?limit=50&status=completed").json()["tasks"] == []
+
+
+def test_since_cursor_includes_updates_at_cursor(worker):
+    ids = create_tasks(worker, 4)
+
+    first = worker.get("/api/users/u1/tasks?since=").json()
+    assert sorted(t["task_id"] for t in first["tasks"]) == sorted(ids)
+    cursor = first["cursor"]
+    assert cursor == max(t["updated_at"] for t in first["tasks"])
+
+    # 游标是最后一次更新时间；与游标同一时刻的更新也要返回（由客户端去重），不能漏掉
+    again = worker.get(f"/api/users/u1/tasks?since={cursor}").json()
+    assert again["tasks"]
+    assert all(t["updated_at"] >= cursor for t in again["tasks"])
+    assert {t["task_id"] for t in again["tasks"]} == {t["task_id"] for t in first["tasks"]
+                                                      if t["updated_at"] == cursor}
+
+    later = create_tasks(worker, 1)
+    changed = worker.get(f"/api/users/u1/tasks?since={cursor}").json()
+    assert set(later) <= {t["task_id"] for t in changed["tasks"]}
+
+
+def test_since_cursor_in_future_returns_nothing(worker):
+    create_tasks(worker, 2)
+
+    page = worker.get("/api/users/u1/tasks?since=2999-01-01T00:00:00.000Z").json()
+
+    assert page["tasks"] == []
+    assert not page["has_more"]
+
+
+def test_invalid_cursor_restarts_from_first_page(worker):
+    ids = create_tasks(worker, 2)
+
+    page = worker.get("/api/tasks?limit=5&cursor=not-a-cursor").json()
+
+    assert sorted(t["task_id"] for t in page["tasks"]) == sorted(ids)
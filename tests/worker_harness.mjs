@@ -0,0 +1,106 @@
+// 测试用：在 Node 中加载 worker 模块，用内存 KV 逐行处理 stdin 中的 JSON 请求，每个响应输出一行 JSON。
+// 另外两种消息：{ scheduled: cron } 触发定时任务并返回本次的 KV 操作数，{ kv: prefix } 返回该前缀下的键值
+import readline from 'node:readline';
+import { pathToFileURL } from 'node:url';
+
+// 与 Workers KV 行为一致的内存实现：get 的 type、put 的 metadata、按前缀有序 list 和不透明游标
+class MemoryKV {
+  constructor() {
+    this.values = new Map();
+    this.metadata = new Map();
+    this.ops = 0;
+  }
+  
+  async get(key, options) {
+    this.ops += 1;
+    const type = typeof options === 'string' ? options : options && options.type;
+    if (!this.values.has(key)) {
+      return null;
+    }
+    const value = this.values.get(key);
+    return type === 'json' ? JSON.parse(value) : value;
+  }
+  
+  async put(key, value, options = {}) {
+    this.ops += 1;
+    this.values.set(key, String(value));
+    if (options.metadata) {
+      this.metadata.set(key, options.metadata);
+    } else {
+      this.metadata.delete(key);
+    }
+  }
+  
+  async delete(key) {
+    this.ops += 1;
+    this.values.delete(key);
+    this.metadata.delete(key);
+  }
+  
+  async list({ prefix = '', limit = 1000, cursor } = {}) {
+    this.ops += 1;
+    const after = cursor ? Buffer.from(cursor, 'base64').toString() : null;
+    const keys = [...this.values.keys()]
+      .filter(key => key.startsWith(prefix) && (after === null || key > after))
+      .sort();
+    const page = keys.slice(0, limit);
+    const complete = page.length === keys.length;
+    return {
+      keys: page.map(name => this.metadata.has(name) ? { name, metadata: this.metadata.get(name) } : { name }),
+      list_complete: complete,
+      cursor: complete ? undefined : Buffer.from(page[page.length - 1]).toString('base64')
+    };
+  }
+}
+
+// stdout 只用于输出响应，worker 的日志改写到 stderr
+console.log = console.info = console.debug = console.warn = console.error;
+
+const worker = (await import(pathToFileURL(process.argv[2]).href)).default;
+const env = { KV_NAMESPACE: new MemoryKV(), ...JSON.parse(process.env.WORKER_ENV || '{}') };
+for (const [key, value] of Object.entries(JSON.parse(process.env.WORKER_SEED || '{}'))) {
+  env.KV_NAMESPACE.values.set(key, typeof value === 'string' ? value : JSON.stringify(value));
+}
+
+const lines = readline.createInterface({ input: process.stdin });
+for await (const line of lines) {
+  const { method = 'GET', path, headers = {}, body, scheduled, kv } = JSON.parse(line);
+  const pending = [];
+  const ctx = { waitUntil(promise) { pending.push(promise); }, passThroughOnException() {} };
+  
+  if (scheduled !== undefined) {
+    env.KV_NAMESPACE.ops = 0;
+    await worker.scheduled({ cron: scheduled, scheduledTime: Date.now() }, env, ctx);
+    await Promise.allSettled(pending);
+    process.stdout.write(JSON.stringify({
+      status: 200,
+      headers: {},
+      body: Buffer.from(JSON.stringify({ kv_ops: env.KV_NAMESPACE.ops })).toString('base64')
+    }) + '\n');
+    continue;
+  }
+  if (kv !== undefined) {
+    const entries = Object.fromEntries([...env.KV_NAMESPACE.values].filter(([key]) => key.startsWith(kv)));
+    process.stdout.write(JSON.stringify({
+      status: 200,
+      headers: {},
+      body: Buffer.from(JSON.stringify(entries)).toString('base64')
+    }) + '\n');
+    continue;
+  }
+  
+  const request = new Request(`http://worker.test${path}`, {
+    method,
+    headers,
+    body: body === undefined ? undefined : JSON.stringify(body)
+  });
+  const response = await worker.fetch(request, env, ctx);
+  await Promise.allSettled(pending);
+  
+  process.stdout.write(JSON.stringify({
+    status: response.status,
+    headers: Object.fromEntries(response.headers),
+    body: Buffer.from(await response.arrayBuffer()).toString('base64')
+  }) + '\n');
+}
+process.exit(0);
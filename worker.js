@@ -1,84 +1,132 @@
 // Cloudflare Worker - 完整版本
 export default {
-  async fetch(request, env) {
-    const url = new URL(request.url);
-    const path = url.pathname;
-    const method = request.method;
+  async fetch(request, env, ctx) {
+    // 按用户和设备限流
+    const rateLimit = checkRateLimit(request, env);
+    if (rateLimit && !rateLimit.allowed) {
+      return applyRateLimitHeaders(jsonResponse({
+        error: '请求过于频繁，请稍后再试',
+        retry_after: rateLimit.retryAfter
+      }, 429), rateLimit);
+    }
+    
+    // 统计本次请求的处理耗时和KV耗时，通过 Server-Timing 返回给客户端
+    const started = Date.now();
+    const timing = { kv: 0, kvOps: 0 };
+    const timedEnv = withKVTiming(env, timing);
+    
+    // 未匹配到子路由时 routeRequest 不返回响应
+    const response = await routeRequest(request, timedEnv, ctx) || jsonResponse({ error: 'Not Found' }, 404);
+    // 条件请求在编码协商之后判断，按所选表示的ETag比较
+    const encoded = applyConditionalGet(request, await negotiateResponseEncoding(request, response));
+    return applyServerTiming(applyRateLimitHeaders(encoded, rateLimit), timing, started);
+  },
+  
+  async queue(batch, env, ctx) {
+    await handleQueueBatch(batch, env);
+    await continueLegacyMigration(env);
+  },
+  
+  async scheduled(event, env, ctx) {
+    ctx.waitUntil(runScheduledJobs(event.cron, env));
+  },
+};
 
-    // CORS 头
-    const corsHeaders = {
-      'Access-Control-Allow-Origin': '*',
-      'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-      'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Client-Version',
-      'Access-Control-Max-Age': '86400',
-    };
+async function routeRequest(request, env, ctx) {
+  const url = new URL(request.url);
+  const path = url.pathname;
+  const method = request.method;
 
-    // 处理预检请求
-    if (method === 'OPTIONS') {
-      return new Response(null, {
-        headers: corsHeaders,
-      });
-    }
+  // CORS 头
+  const corsHeaders = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Client-Version, X-Device-ID, X-User-ID, If-None-Match',
+    'Access-Control-Expose-Headers': 'ETag, Retry-After, X-RateLimit-Limit, X-RateLimit-Remaining, X-RateLimit-Reset, Content-Encoding, Server-Timing',
+    'Access-Control-Max-Age': '86400',
+  };
 
-    try {
-      // API 路由
-      if (path === '/' || path === '/index.html') {
-        return serveFrontend();
-      } else if (path === '/api/ping') {
-        return handlePing();
-      } else if (path === '/api/auth/login' && method === 'POST') {
-        return await handleLogin(request, env);
-      } else if (path === '/api/auth/logout' && method === 'POST') {
-        return await handleLogout(request, env);
-      } else if (path === '/api/license/validate' && method === 'POST') {
-        return await handleValidateLicense(request, env);
-      } else if (path === '/api/users' && method === 'GET') {
-        return await handleGetUsers(env);
-      } else if (path === '/api/users' && method === 'POST') {
-        return await handleCreateUser(request, env);
-      } else if (path.startsWith('/api/users/')) {
-        const userId = path.split('/')[3];
-        if (method === 'GET') {
-          return await handleGetUser(userId, env);
-        } else if (path.endsWith('/activity') && method === 'POST') {
-          return await handleUserActivity(userId, env);
-        } else if (path.endsWith('/tasks') && method === 'GET') {
-          return await handleGetUserTasks(userId, env);
-        }
-      } else if (path === '/api/tasks' && method === 'GET') {
-        return await handleGetTasks(env);
-      } else if (path === '/api/tasks' && method === 'POST') {
-        return await handleCreateTask(request, env);
-      } else if (path.startsWith('/api/tasks/')) {
-        const taskId = path.split('/')[3];
-        if (method === 'GET') {
-          return await handleGetTask(taskId, env);
-        } else if (path.endsWith('/process') && method === 'POST') {
-          return await handleProcessTask(taskId, env);
-        } else if (path.endsWith('/download') && method === 'GET') {
-          return await handleDownloadTask(taskId, env);
-        } else if (path.endsWith('/status') && method === 'GET') {
-          return await handleGetTaskStatus(taskId, env);
+  // 处理预检请求
+  if (method === 'OPTIONS') {
+    return new Response(null, {
+      headers: corsHeaders,
+    });
+  }
+
+  try {
+    // 旧版账户数据迁移到按键存储（每个实例只检查一次）；旧版任务由定时任务分段迁移
+    await ensureAccountStorage(env);
+    
+    // API 路由
+    if (path === '/' || path === '/index.html') {
+      return serveFrontend();
+    } else if (path === '/api/ping') {
+      return handlePing();
+    } else if (path === '/api/auth/login' && method === 'POST') {
+      return await handleLogin(request, env);
+    } else if (path === '/api/auth/logout' && method === 'POST') {
+      return await handleLogout(request, env);
+    } else if (path === '/api/license/validate' && method === 'POST') {
+      return await handleValidateLicense(request, env);
+    } else if (path === '/api/users' && method === 'GET') {
+      return await handleGetUsers(env);
+    } else if (path === '/api/users' && method === 'POST') {
+      return await handleCreateUser(request, env);
+    } else if (path.startsWith('/api/users/')) {
+      const userId = path.split('/')[3];
+      if (path.endsWith('/activity') && method === 'POST') {
+        return await handleUserActivity(userId, env);
+      } else if (path.endsWith('/tasks') && method === 'GET') {
+        return await handleGetUserTasks(userId, url, env);
+      } else if (method === 'GET') {
+        return await handleGetUser(userId, env);
+      }
+    } else if (path === '/api/tasks' && method === 'GET') {
+      return await handleGetTasks(url, env);
+    } else if (path === '/api/tasks' && method === 'POST') {
+      return await handleCreateTask(request, env);
+    } else if (path === '/api/tasks:batch' && method === 'POST') {
+      return await handleCreateTasksBatch(request, env);
+    } else if (path === '/api/tasks/status:batch' && method === 'POST') {
+      return await handleGetTaskStatusBatch(request, env);
+    } else if (path.startsWith('/api/tasks/')) {
+      const taskId = path.split('/')[3];
+      if (path.endsWith('/process') && method === 'POST') {
+        return await handleProcessTask(taskId, env, ctx);
+      } else if (path.endsWith('/download') && method === 'GET') {
+        return await handleDownloadTask(taskId, env);
+      } else if (path.endsWith('/status') && method === 'GET') {
+        if ((request.headers.get('Accept') || '').includes('text/event-stream')) {
+          return handleTaskStatusStream(taskId, env, ctx);
         }
-      } else if (path === '/api/stats' && method === 'GET') {
-        return await handleGetStats(env);
-      } else if (path === '/api/settings' && method === 'POST') {
-        return await handleSaveSettings(request, env);
-      } else if (path === '/api/backup' && method === 'GET') {
-        return await handleBackup(env);
-      } else if (path === '/api/cleanup' && method === 'POST') {
-        return await handleCleanup(env);
-      } else if (path.startsWith('/download/')) {
-        return await handleDownload(request, env);
-      } else {
-        return jsonResponse({ error: 'Not Found' }, 404);
+        return await handleGetTaskStatus(taskId, url, env);
+      } else if (method === 'GET') {
+        return await handleGetTask(taskId, url, env);
       }
-    } catch (error) {
-      console.error('处理请求失败:', error);
-      return jsonResponse({ error: 'Internal Server Error', details: error.message }, 500);
+    } else if (path === '/api/stats' && method === 'GET') {
+      return await handleGetStats(env);
+    } else if (path === '/api/stats/rebuild' && method === 'POST') {
+      return await handleRebuildStats(env);
+    } else if (path === '/api/settings' && method === 'POST') {
+      return await handleSaveSettings(request, env);
+    } else if (path === '/api/backup' && method === 'GET') {
+      return await handleBackup(env);
+    } else if (path === '/api/queue' && method === 'GET') {
+      return handleGetQueueStatus(env);
+    } else if (path === '/api/logs' && method === 'GET') {
+      return await handleGetLogs(url, env);
+    } else if (path === '/api/cleanup' && method === 'POST') {
+      return await handleCleanup(env);
+    } else if (path.startsWith('/download/')) {
+      return await handleDownload(request, env, ctx);
+    } else {
+      return jsonResponse({ error: 'Not Found' }, 404);
     }
-  },
-};
+  } catch (error) {
+    console.error('处理请求失败:', error);
+    return jsonResponse({ error: 'Internal Server Error', details: error.message }, 500);
+  }
+}
 
 // ========== 前端页面 ==========
 function serveFrontend() {
@@ -101,7 +149,9 @@ function handlePing() {
     status: 'ok',
     timestamp: new Date().toISOString(),
     service: 'xueke-download-system',
-    version: '2.0.0'
+    version: '2.0.0',
+    // 客户端据此决定是否启用 MessagePack 等可选格式
+    features: SERVER_FEATURES
   });
 }
 
@@ -116,14 +166,9 @@ async function handleLogin(request, env) {
       return jsonResponse({ success: false, error: '用户名和密码不能为空' }, 400);
     }
     
-    // 获取用户列表
-    const users = await getUsers(env);
-    
-    // 查找用户
-    const user = users.find(u => 
-      u.username === username && 
-      u.password_hash === password // 注意：实际应该使用加密验证
-    );
+    // 按用户名索引查找用户
+    const found = await getUserByName(env, username);
+    const user = found && found.password_hash === password ? found : null; // 注意：实际应该使用加密验证
     
     if (!user) {
       // 记录登录失败
@@ -143,11 +188,10 @@ async function handleLogin(request, env) {
     user.device_id = device_id;
     
     // 保存用户信息
-    await saveUsers(env, users);
+    await saveUser(env, user);
     
     // 获取用户许可证信息
-    const licenses = await getLicenses(env);
-    const userLicenses = licenses.filter(l => l.user_id === user.id);
+    const userLicenses = await getUserLicenses(env, user.id);
     const activeLicense = userLicenses.find(l => l.is_active && new Date(l.expires_at) > new Date());
     
     // 创建用户信息响应
@@ -208,11 +252,8 @@ async function handleValidateLicense(request, env) {
       return jsonResponse({ valid: false, error: '激活码不能为空' }, 400);
     }
     
-    // 获取许可证列表
-    const licenses = await getLicenses(env);
-    
-    // 查找许可证
-    const license = licenses.find(l => l.license_key === license_key);
+    // 按激活码直接读取许可证
+    const license = await getLicense(env, license_key);
     
     if (!license) {
       return jsonResponse({ valid: false, error: '激活码不存在' }, 404);
@@ -258,7 +299,7 @@ async function handleValidateLicense(request, env) {
     }
     
     // 保存许可证
-    await saveLicenses(env, licenses);
+    await saveLicense(env, license);
     
     // 计算剩余天数
     const daysLeft = Math.ceil((expiresAt - now) / (1000 * 60 * 60 * 24));
@@ -338,16 +379,13 @@ async function handleCreateUser(request, env) {
       return jsonResponse({ success: false, error: '缺少必要字段' }, 400);
     }
     
-    // 获取现有用户
-    const users = await getUsers(env);
-    
     // 检查用户名是否已存在
-    if (users.some(u => u.username === username)) {
+    if (await getUserByName(env, username)) {
       return jsonResponse({ success: false, error: '用户名已存在' }, 400);
     }
     
     // 检查邮箱是否已存在
-    if (users.some(u => u.email === email)) {
+    if (await getUserByEmail(env, email)) {
       return jsonResponse({ success: false, error: '邮箱已存在' }, 400);
     }
     
@@ -365,10 +403,10 @@ async function handleCreateUser(request, env) {
       device_id: null
     };
     
-    users.push(newUser);
-    
-    // 保存用户
-    await saveUsers(env, users);
+    // 保存用户并建立索引
+    await saveUser(env, newUser);
+    await indexUser(env, newUser);
+    await statsUserCreated(env, newUser);
     
     // 记录事件
     await logEvent(env, 'user_created', {
@@ -398,21 +436,18 @@ async function handleCreateUser(request, env) {
 
 async function handleGetUser(userId, env) {
   try {
-    const users = await getUsers(env);
-    const user = users.find(u => u.id === userId);
+    const user = await getUser(env, userId);
     
     if (!user) {
       return jsonResponse({ error: '用户不存在' }, 404);
     }
     
     // 获取用户许可证
-    const licenses = await getLicenses(env);
-    const userLicenses = licenses.filter(l => l.user_id === userId);
+    const userLicenses = await getUserLicenses(env, userId);
     const activeLicense = userLicenses.find(l => l.is_active && new Date(l.expires_at) > new Date());
     
-    // 获取用户任务
-    const tasks = await getTasks(env);
-    const userTasks = tasks.filter(t => t.user_id === userId);
+    // 任务计数只读用户索引中的摘要
+    const taskIndex = await getUserTaskIndex(env, userId);
     
     // 安全返回用户信息
     const safeUser = {
@@ -427,9 +462,9 @@ async function handleGetUser(userId, env) {
       license_count: userLicenses.length,
       license_valid: !!activeLicense,
       license_info: activeLicense || null,
-      task_count: userTasks.length,
-      completed_tasks: userTasks.filter(t => t.status === 'completed').length,
-      pending_tasks: userTasks.filter(t => t.status === 'pending').length
+      task_count: taskIndex.length,
+      completed_tasks: taskIndex.filter(t => t.status === 'completed').length,
+      pending_tasks: taskIndex.filter(t => t.status === 'pending').length
     };
     
     return jsonResponse(safeUser);
@@ -441,18 +476,17 @@ async function handleGetUser(userId, env) {
 
 async function handleUserActivity(userId, env) {
   try {
-    const users = await getUsers(env);
-    const userIndex = users.findIndex(u => u.id === userId);
+    const user = await getUser(env, userId);
     
-    if (userIndex === -1) {
+    if (!user) {
       return jsonResponse({ error: '用户不存在' }, 404);
     }
     
     // 更新最后活动时间
-    users[userIndex].last_activity = new Date().toISOString();
+    user.last_activity = new Date().toISOString();
     
     // 保存用户
-    await saveUsers(env, users);
+    await saveUser(env, user);
     
     return jsonResponse({ success: true, message: '活动时间已更新' });
   } catch (error) {
@@ -461,36 +495,292 @@ async function handleUserActivity(userId, env) {
   }
 }
 
-async function handleGetUserTasks(userId, env) {
+async function handleGetUserTasks(userId, url, env) {
   try {
-    const tasks = await getTasks(env);
-    const userTasks = tasks.filter(t => t.user_id === userId);
+    // 分页模式：按用户任务索引取一页，不加载全部任务
+    const listOptions = parseTaskListOptions(url);
+    if (listOptions) {
+      return jsonResponse(projectTaskPage(await paginateUserTasks(env, userId, listOptions), url));
+    }
+    
+    const fields = parseFieldsParam(url.searchParams.get('fields'));
+    
+    // 增量同步：带 since 参数时只返回此后有变化的任务，并附带新的游标
+    if (url.searchParams.has('since')) {
+      const since = url.searchParams.get('since') || '';
+      const page = await getChangedUserTasks(env, userId, since);
+      
+      return jsonResponse({
+        tasks: page.tasks.map(task => projectTask(task, fields)),
+        cursor: page.cursor,
+        has_more: page.has_more
+      });
+    }
+    
+    // 完整列表最多返回最新的 USER_TASK_READ_LIMIT 个任务，更多任务请使用分页参数
+    const userTasks = await getUserTasks(env, userId);
     
     // 按创建时间排序
     userTasks.sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
     
-    return jsonResponse(userTasks);
+    return jsonResponse(userTasks.map(task => projectTask(task, fields)));
   } catch (error) {
     console.error('获取用户任务失败:', error);
     return jsonResponse({ error: '获取任务失败' }, 500);
   }
 }
 
+// 用户索引摘要的 updated_at 只随状态变化更新，未结束任务的进度变化需读取详情才能判断；
+// 候选任务按摘要时间从旧到新读取，超过读取上限时游标只推进到已读取部分。
+// since 包含等于游标的更新（同一毫秒内的后续更新不会漏掉），客户端按任务ID去重
+async function getChangedUserTasks(env, userId, since) {
+  const entries = await getUserTaskIndex(env, userId);
+  const candidates = entries
+    .filter(entry => !entry.status || ACTIVE_TASK_STATUSES.includes(entry.status)
+      || (entry.updated_at || '') >= since)
+    .sort((a, b) => (a.updated_at || '').localeCompare(b.updated_at || ''));
+  
+  const hasMore = candidates.length > USER_TASK_READ_LIMIT;
+  const batch = candidates.slice(0, USER_TASK_READ_LIMIT);
+  const loaded = await Promise.all(batch.map(entry => getTask(env, entry.id)));
+  
+  let cursor = since;
+  const changed = [];
+  
+  for (const task of loaded.filter(Boolean)) {
+    const updatedAt = getTaskUpdatedAt(task);
+    if (updatedAt >= since) {
+      changed.push(task);
+    }
+    if (!hasMore && updatedAt > cursor) {
+      cursor = updatedAt;
+    }
+  }
+  
+  if (hasMore) {
+    // 未读取的候选摘要时间都不早于已读取的最后一个
+    const lastRead = batch[batch.length - 1].updated_at || since;
+    cursor = lastRead > cursor ? lastRead : cursor;
+  }
+  
+  changed.sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
+  
+  return { tasks: changed, cursor, has_more: hasMore };
+}
+
 // ========== 任务管理 ==========
-async function handleGetTasks(env) {
+async function handleGetTasks(url, env) {
   try {
+    // 分页模式：按创建时间倒序遍历任务索引键，按页读取任务
+    const listOptions = parseTaskListOptions(url);
+    if (listOptions) {
+      return jsonResponse(projectTaskPage(await paginateTaskIndex(env, listOptions), url));
+    }
+    
+    const fields = parseFieldsParam(url.searchParams.get('fields'));
     const tasks = await getTasks(env);
     
     // 按创建时间排序
     tasks.sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
     
-    return jsonResponse(tasks);
+    return jsonResponse(tasks.map(task => projectTask(task, fields)));
   } catch (error) {
     console.error('获取任务列表失败:', error);
     return jsonResponse({ error: '获取任务列表失败' }, 500);
   }
 }
 
+// 分页参数：limit、cursor、status（可逗号分隔多个）、since（只返回此后有变化的任务）
+const DEFAULT_TASK_PAGE_SIZE = 50;
+const MAX_TASK_PAGE_SIZE = 200;
+// 每页最多读取的任务详情数和最多的 list 调用次数，超过后返回不满一页的结果和游标
+const TASK_LIST_READ_BUDGET = 300;
+const TASK_LIST_MAX_LIST_CALLS = 5;
+
+function parseTaskListOptions(url) {
+  const params = url.searchParams;
+  if (!params.has('limit') && !params.has('cursor')) {
+    // 未带分页参数时保持旧版的完整列表响应
+    return null;
+  }
+  
+  const limit = parseInt(params.get('limit') || DEFAULT_TASK_PAGE_SIZE, 10);
+  const status = params.get('status');
+  
+  return {
+    limit: Math.min(Math.max(limit || DEFAULT_TASK_PAGE_SIZE, 1), MAX_TASK_PAGE_SIZE),
+    cursor: params.get('cursor') || null,
+    statuses: status ? new Set(status.split(',').map(s => s.trim()).filter(Boolean)) : null,
+    since: params.get('since') || null
+  };
+}
+
+// 按摘要（{ id, status, updated_at }，已按创建时间倒序）过滤并读取任务，结果追加到 state.tasks；
+// 摘要的 updated_at 只随状态变化更新，带 since 时未结束的任务需读取详情再判断。
+// 返回已处理的摘要数，达到 limit 或读取预算用完时提前停止
+async function collectTaskPage(env, entries, options, state) {
+  const { limit, statuses, since } = options;
+  let consumed = 0;
+  
+  while (consumed < entries.length && state.tasks.length < limit && state.reads < TASK_LIST_READ_BUDGET) {
+    // 先按摘要过滤，再并行读取一批候选任务
+    const batch = [];
+    let end = consumed;
+    const room = Math.min(limit - state.tasks.length, TASK_LIST_READ_BUDGET - state.reads);
+    while (end < entries.length && batch.length < room) {
+      const entry = entries[end];
+      if ((!statuses || statuses.has(entry.status))
+          && (!since || ACTIVE_TASK_STATUSES.includes(entry.status) || (entry.updated_at || '') >= since)) {
+        batch.push(end);
+      }
+      end++;
+    }
+    
+    const loaded = await Promise.all(batch.map(index => getTask(env, entries[index].id)));
+    state.reads += batch.length;
+    consumed = end;
+    
+    for (let i = 0; i < loaded.length; i++) {
+      const task = loaded[i];
+      if (task
+          && (!statuses || statuses.has(task.status))
+          && (!since || getTaskUpdatedAt(task) >= since)) {
+        state.tasks.push(task);
+        if (state.tasks.length >= limit) {
+          consumed = batch[i] + 1;
+          break;
+        }
+      }
+    }
+  }
+  
+  return consumed;
+}
+
+// 用户任务分页：摘要在用户索引中，任务ID内含创建时间（generateId），游标为上一页最后处理的任务ID
+async function paginateUserTasks(env, userId, options) {
+  const entries = await getUserTaskIndex(env, userId);
+  const ordered = entries
+    .filter(entry => !options.cursor || entry.id < options.cursor)
+    .sort((a, b) => (a.id < b.id ? 1 : -1));
+  
+  const state = { tasks: [], reads: 0 };
+  const consumed = await collectTaskPage(env, ordered, options, state);
+  const hasMore = consumed < ordered.length;
+  
+  return {
+    tasks: state.tasks,
+    cursor: hasMore ? ordered[consumed - 1].id : null,
+    has_more: hasMore
+  };
+}
+
+// 全部任务分页：遍历 idx:tasks: 索引键（键名按创建时间倒序，元数据含状态摘要），
+// 游标为 KV list 游标加上该页已处理的键数。旧版任务迁移完成前，索引遍历完后继续返回
+// 尚未迁移的旧版任务（都早于已迁移的任务），游标改为上一页最后处理的旧版任务索引键
+async function paginateTaskIndex(env, options) {
+  let { listCursor, skip, legacyAfter } = decodeTaskListCursor(options.cursor);
+  const filtered = Boolean(options.statuses || options.since);
+  const state = { tasks: [], reads: 0 };
+  let next = null;
+  
+  for (let calls = 0; legacyAfter === null && calls < TASK_LIST_MAX_LIST_CALLS; calls++) {
+    const page = await env.KV_NAMESPACE.list({
+      prefix: TASK_INDEX_KEY_PREFIX,
+      cursor: listCursor || undefined,
+      limit: filtered ? 1000 : Math.min(1000, skip + options.limit + 1)
+    });
+    const entries = page.keys.slice(skip).map(parseTaskIndexEntry);
+    const consumed = await collectTaskPage(env, entries, options, state);
+    
+    if (consumed < entries.length) {
+      next = { listCursor, skip: skip + consumed };
+      break;
+    }
+    if (page.list_complete) {
+      legacyAfter = '';
+      next = null;
+      break;
+    }
+    
+    listCursor = page.cursor;
+    skip = 0;
+    next = { listCursor, skip };
+    if (state.tasks.length >= options.limit || state.reads >= TASK_LIST_READ_BUDGET) {
+      break;
+    }
+  }
+  
+  if (legacyAfter !== null) {
+    const legacy = (await getUnmigratedLegacyTasks(env)).filter(item => item.key > legacyAfter);
+    const entries = legacy.map(({ task }) => ({ ...summarizeTask(task), user_id: task.user_id }));
+    const consumed = await collectTaskPage(env, entries, options, state);
+    if (consumed < entries.length) {
+      next = { legacyAfter: consumed > 0 ? legacy[consumed - 1].key : legacyAfter };
+    }
+  }
+  
+  return {
+    tasks: state.tasks,
+    cursor: next ? encodeTaskListCursor(next) : null,
+    has_more: Boolean(next)
+  };
+}
+
+function encodeTaskListCursor(position) {
+  if (position.legacyAfter !== undefined) {
+    return btoa(JSON.stringify(['', 0, position.legacyAfter]));
+  }
+  return btoa(JSON.stringify([position.listCursor || '', position.skip]));
+}
+
+function decodeTaskListCursor(cursor) {
+  if (!cursor) {
+    return { listCursor: null, skip: 0, legacyAfter: null };
+  }
+  
+  try {
+    const [listCursor, skip, legacyAfter] = JSON.parse(atob(cursor));
+    return {
+      listCursor: listCursor || null,
+      skip: Math.max(0, parseInt(skip, 10) || 0),
+      legacyAfter: typeof legacyAfter === 'string' ? legacyAfter : null
+    };
+  } catch (error) {
+    return { listCursor: null, skip: 0, legacyAfter: null };
+  }
+}
+
+// 字段投影：?fields=status,progress 只返回指定字段，task_id 始终保留
+function parseFieldsParam(value) {
+  if (!value) {
+    return null;
+  }
+  
+  const fields = new Set(String(value).split(',').map(field => field.trim()).filter(Boolean));
+  fields.add('task_id');
+  return fields;
+}
+
+function projectTask(task, fields) {
+  if (!fields) {
+    return task;
+  }
+  
+  const projected = {};
+  for (const field of fields) {
+    if (field in task) {
+      projected[field] = task[field];
+    }
+  }
+  return projected;
+}
+
+function projectTaskPage(page, url) {
+  const fields = parseFieldsParam(url.searchParams.get('fields'));
+  return fields ? { ...page, tasks: page.tasks.map(task => projectTask(task, fields)) } : page;
+}
+
 async function handleCreateTask(request, env) {
   try {
     const data = await request.json();
@@ -501,44 +791,33 @@ async function handleCreateTask(request, env) {
       return jsonResponse({ success: false, error: '缺少必要字段或格式错误' }, 400);
     }
     
+    const maxUrls = getMaxUrlsPerTask(env);
+    if (urls.length > maxUrls) {
+      return jsonResponse({ success: false, error: `单个任务最多${maxUrls}个链接` }, 400);
+    }
+    
     // 验证用户是否存在
-    const users = await getUsers(env);
-    const user = users.find(u => u.id === user_id);
+    const user = await getUser(env, user_id);
     
     if (!user) {
       return jsonResponse({ success: false, error: '用户不存在' }, 404);
     }
     
-    // 创建任务ID
-    const taskId = generateId('task');
+    // 准入控制：未完成的任务数不超过上限
+    const rejection = await checkTaskAdmission(env, user_id, 1);
+    if (rejection) {
+      return rejection;
+    }
     
     // 创建新任务
-    const newTask = {
-      task_id: taskId,
-      user_id,
-      username: user.username,
-      urls,
-      email,
-      notes,
-      status: 'pending',
-      progress: 0,
-      submitted_by: submitted_by || 'system',
-      created_at: new Date().toISOString(),
-      started_at: null,
-      completed_at: null,
-      downloaded_files: [],
-      direct_links: [],
-      error_message: null
-    };
-    
-    // 获取现有任务
-    const tasks = await getTasks(env);
+    const newTask = buildNewTask(request, user, { urls, email, notes }, submitted_by);
+    const taskId = newTask.task_id;
     
-    // 添加到列表
-    tasks.push(newTask);
-    
-    // 保存任务
-    await saveTasks(env, tasks);
+    // 保存任务并加入用户索引
+    await saveTask(env, newTask);
+    await putTaskIndexEntries(env, [newTask]);
+    await addUserTasks(env, user_id, [newTask]);
+    await statsTaskCreated(env, newTask);
     
     // 记录事件
     await logEvent(env, 'task_created', {
@@ -569,33 +848,184 @@ async function handleCreateTask(request, env) {
   }
 }
 
-async function handleGetTask(taskId, env) {
+function buildNewTask(request, user, item, submittedBy) {
+  const now = new Date().toISOString();
+  return {
+    task_id: generateId('task'),
+    user_id: user.id,
+    username: user.username,
+    urls: item.urls,
+    email: item.email,
+    notes: item.notes || '',
+    status: 'pending',
+    progress: 0,
+    submitted_by: submittedBy || 'system',
+    base_url: new URL(request.url).origin,
+    created_at: now,
+    started_at: null,
+    completed_at: null,
+    updated_at: now,
+    downloaded_files: [],
+    direct_links: [],
+    error_message: null
+  };
+}
+
+// 单次批量请求最多包含的任务数
+const MAX_BATCH_SIZE = 100;
+
+async function handleCreateTasksBatch(request, env) {
   try {
-    const tasks = await getTasks(env);
-    const task = tasks.find(t => t.task_id === taskId);
+    const data = await request.json();
+    const { user_id, tasks, submitted_by } = data;
+    
+    if (!user_id || !Array.isArray(tasks) || tasks.length === 0) {
+      return jsonResponse({ success: false, error: '缺少必要字段或格式错误' }, 400);
+    }
+    
+    if (tasks.length > MAX_BATCH_SIZE) {
+      return jsonResponse({ success: false, error: `单次最多提交${MAX_BATCH_SIZE}个任务` }, 400);
+    }
+    
+    const user = await getUser(env, user_id);
+    
+    if (!user) {
+      return jsonResponse({ success: false, error: '用户不存在' }, 404);
+    }
+    
+    // 逐项校验，结果与请求顺序一一对应
+    const maxUrls = getMaxUrlsPerTask(env);
+    const results = [];
+    const created = [];
+    
+    for (const item of tasks) {
+      const { urls, email } = item || {};
+      if (!Array.isArray(urls) || urls.length === 0 || !email) {
+        results.push({ success: false, error: '缺少必要字段或格式错误' });
+      } else if (urls.length > maxUrls) {
+        results.push({ success: false, error: `单个任务最多${maxUrls}个链接` });
+      } else {
+        const newTask = buildNewTask(request, user, item, submitted_by);
+        created.push(newTask);
+        results.push({ success: true, task: newTask });
+      }
+    }
+    
+    if (created.length > 0) {
+      const rejection = await checkTaskAdmission(env, user_id, created.length);
+      if (rejection) {
+        return rejection;
+      }
+      
+      // 任务并行写入，用户索引和统计各只写一次
+      await Promise.all(created.map(task => saveTask(env, task)));
+      await putTaskIndexEntries(env, created);
+      await addUserTasks(env, user_id, created);
+      await updateStats(env, counters => {
+        for (const task of created) {
+          countTask(counters, task, 1);
+        }
+      });
+      
+      await logEvent(env, 'tasks_created_batch', {
+        task_ids: created.map(task => task.task_id),
+        user_id,
+        username: user.username,
+        url_count: created.reduce((sum, task) => sum + task.urls.length, 0),
+        submitted_by
+      });
+    }
+    
+    return jsonResponse({
+      success: created.length > 0,
+      created: created.length,
+      failed: results.length - created.length,
+      results
+    });
+    
+  } catch (error) {
+    console.error('批量创建任务失败:', error);
+    return jsonResponse({ success: false, error: '批量创建任务失败' }, 500);
+  }
+}
+
+function getMaxUrlsPerTask(env) {
+  return parseInt(env.MAX_URLS_PER_TASK || '50', 10);
+}
+
+// 准入控制拒绝时建议客户端等待的秒数
+const ADMISSION_RETRY_AFTER_SECONDS = 120;
+
+async function checkTaskAdmission(env, userId, newTaskCount) {
+  const maxTasks = parseInt(env.MAX_TASKS_PER_USER || '100', 10);
+  
+  // 按用户索引中的状态摘要计数，无需读取任务详情
+  const entries = await getUserTaskIndex(env, userId);
+  const active = entries.filter(entry => ACTIVE_TASK_STATUSES.includes(entry.status)).length;
+  if (active + newTaskCount <= maxTasks) {
+    return null;
+  }
+  
+  const response = jsonResponse({
+    success: false,
+    error: `未完成的任务过多（最多${maxTasks}个），请等待已有任务完成后再提交`,
+    active_tasks: active,
+    max_tasks: maxTasks
+  }, 429);
+  response.headers.set('Retry-After', String(ADMISSION_RETRY_AFTER_SECONDS));
+  return response;
+}
+
+async function handleGetTaskStatusBatch(request, env) {
+  try {
+    const data = await request.json();
+    const taskIds = data.task_ids;
+    
+    if (!Array.isArray(taskIds) || taskIds.length === 0) {
+      return jsonResponse({ error: '缺少任务ID' }, 400);
+    }
+    
+    if (taskIds.length > MAX_BATCH_SIZE) {
+      return jsonResponse({ error: `单次最多查询${MAX_BATCH_SIZE}个任务` }, 400);
+    }
+    
+    const tasks = await Promise.all(taskIds.map(taskId => getTask(env, taskId)));
+    const fields = parseFieldsParam(data.fields);
+    
+    return jsonResponse({
+      tasks: tasks.filter(Boolean).map(task => projectTask(buildTaskStatus(task), fields)),
+      missing: taskIds.filter((taskId, index) => !tasks[index])
+    });
+    
+  } catch (error) {
+    console.error('批量获取任务状态失败:', error);
+    return jsonResponse({ error: '批量获取任务状态失败' }, 500);
+  }
+}
+
+async function handleGetTask(taskId, url, env) {
+  try {
+    const task = await getTask(env, taskId);
     
     if (!task) {
       return jsonResponse({ error: '任务不存在' }, 404);
     }
     
-    return jsonResponse(task);
+    return jsonResponse(projectTask(task, parseFieldsParam(url.searchParams.get('fields'))));
   } catch (error) {
     console.error('获取任务信息失败:', error);
     return jsonResponse({ error: '获取任务信息失败' }, 500);
   }
 }
 
-async function handleProcessTask(taskId, env) {
+async function handleProcessTask(taskId, env, ctx) {
   try {
-    const tasks = await getTasks(env);
-    const taskIndex = tasks.findIndex(t => t.task_id === taskId);
+    const task = await getTask(env, taskId);
     
-    if (taskIndex === -1) {
+    if (!task) {
       return jsonResponse({ success: false, error: '任务不存在' }, 404);
     }
     
-    const task = tasks[taskIndex];
-    
     // 检查任务状态
     if (task.status !== 'pending') {
       return jsonResponse({ 
@@ -608,9 +1038,12 @@ async function handleProcessTask(taskId, env) {
     task.status = 'processing';
     task.started_at = new Date().toISOString();
     task.progress = 10;
+    touchTask(task);
     
     // 保存任务
-    await saveTasks(env, tasks);
+    await saveTask(env, task);
+    await updateTaskSummaries(env, task);
+    await statsTaskStatusChanged(env, 'pending', 'processing');
     
     // 记录事件
     await logEvent(env, 'task_processing', {
@@ -618,8 +1051,8 @@ async function handleProcessTask(taskId, env) {
       user_id: task.user_id
     });
     
-    // 异步处理任务
-    processTaskAsync(task, env);
+    // 交给任务队列执行
+    await enqueueTaskJob(env, ctx, { task_id: taskId });
     
     return jsonResponse({
       success: true,
@@ -633,96 +1066,295 @@ async function handleProcessTask(taskId, env) {
   }
 }
 
-async function processTaskAsync(task, env) {
-  try {
-    const tasks = await getTasks(env);
-    const taskIndex = tasks.findIndex(t => t.task_id === task.task_id);
-    
-    if (taskIndex === -1) return;
-    
-    const currentTask = tasks[taskIndex];
-    
-    // 模拟处理过程
-    const steps = [20, 40, 60, 80, 100];
-    for (const progress of steps) {
-      await new Promise(resolve => setTimeout(resolve, 2000)); // 模拟延迟
-      
-      // 更新进度
-      currentTask.progress = progress;
-      await saveTasks(env, tasks);
-      
-      // 记录进度
-      await logEvent(env, 'task_progress', {
-        task_id: task.task_id,
-        progress
-      });
+// ========== 任务队列 ==========
+// 配置了 Cloudflare Queues 绑定（TASK_QUEUE）时由 queue() 消费；否则使用实例内的本地队列
+
+let localTaskQueue = null;
+
+async function enqueueTaskJob(env, ctx, job) {
+  if (env.TASK_QUEUE) {
+    await env.TASK_QUEUE.send(job);
+    return;
+  }
+  
+  const queue = getLocalTaskQueue(env);
+  queue.send(job);
+  if (ctx) {
+    ctx.waitUntil(queue.drained());
+  }
+}
+
+function getTaskQueueOptions(env) {
+  return {
+    concurrency: parseInt(env.TASK_QUEUE_CONCURRENCY || '4', 10),
+    visibilityTimeoutMs: Math.max(100, parseFloat(env.TASK_TIMEOUT || '300') * 1000),
+    maxAttempts: parseInt(env.TASK_MAX_ATTEMPTS || '3', 10),
+    retryDelayMs: parseFloat(env.TASK_RETRY_DELAY || '5') * 1000
+  };
+}
+
+function getLocalTaskQueue(env) {
+  if (!localTaskQueue) {
+    localTaskQueue = new LocalTaskQueue({
+      ...getTaskQueueOptions(env),
+      handler: (job, isCurrent) => runTaskJob(job, localTaskQueue.env, isCurrent),
+      onDeadLetter: (job, error) => deadLetterTaskJob(job, localTaskQueue.env, error)
+    });
+  }
+  localTaskQueue.env = env;
+  return localTaskQueue;
+}
+
+class LocalTaskQueue {
+  // 内存队列：限制并发消费者数量，消息在可见性超时内未确认则重新投递，超过最大次数进入死信
+  constructor({ concurrency, visibilityTimeoutMs, maxAttempts, retryDelayMs, handler, onDeadLetter }) {
+    this.concurrency = Math.max(1, concurrency);
+    this.visibilityTimeoutMs = visibilityTimeoutMs;
+    this.maxAttempts = Math.max(1, maxAttempts);
+    this.retryDelayMs = retryDelayMs;
+    this.handler = handler;
+    this.onDeadLetter = onDeadLetter;
+    this.messages = [];
+    this.deadLetters = [];
+    this.active = 0;
+    this.nextId = 1;
+    this.timer = null;
+    this.waiters = [];
+  }
+  
+  send(body) {
+    this.messages.push({ id: this.nextId++, body, attempts: 0, visibleAt: 0, lease: 0 });
+    this.pump();
+  }
+  
+  drained() {
+    if (this.messages.length === 0 && this.active === 0) {
+      return Promise.resolve();
     }
+    return new Promise(resolve => this.waiters.push(resolve));
+  }
+  
+  pump() {
+    const now = Date.now();
     
-    // 完成处理
-    currentTask.status = 'completed';
-    currentTask.progress = 100;
-    currentTask.completed_at = new Date().toISOString();
+    while (this.active < this.concurrency) {
+      const message = this.messages.find(m => m.visibleAt <= now);
+      if (!message) {
+        break;
+      }
+      this.deliver(message, now);
+    }
     
-    // 生成模拟文件
-    const files = [];
-    const links = [];
+    this.scheduleWakeup(now);
     
-    for (let i = 0; i < Math.min(currentTask.urls.length, 5); i++) {
-      const fileName = `xueke_doc_${currentTask.task_id}_${i + 1}.pdf`;
-      files.push(fileName);
-      links.push(`https://xuke.ambition.qzz.io/download/${currentTask.task_id}/${fileName}`);
+    if (this.messages.length === 0 && this.active === 0) {
+      this.waiters.splice(0).forEach(resolve => resolve());
     }
+  }
+  
+  deliver(message, now) {
+    message.attempts += 1;
+    message.lease += 1;
+    message.visibleAt = now + this.visibilityTimeoutMs;
+    this.active += 1;
+    
+    const lease = message.lease;
+    const isCurrent = () => message.lease === lease && this.messages.includes(message);
+    
+    // 超过可见性超时视为失败，消息重新可见，旧的执行通过 isCurrent() 得知租约已失效
+    let timeoutId;
+    const timeout = new Promise((_, reject) => {
+      timeoutId = setTimeout(() => reject(new Error('任务执行超时')), this.visibilityTimeoutMs);
+    });
     
-    currentTask.downloaded_files = files;
-    currentTask.direct_links = links;
-    
-    // 保存任务
-    await saveTasks(env, tasks);
+    Promise.race([Promise.resolve().then(() => this.handler(message.body, isCurrent)), timeout])
+      .then(() => this.ack(message, lease))
+      .catch(error => this.fail(message, lease, error))
+      .finally(() => {
+        clearTimeout(timeoutId);
+        this.active -= 1;
+        this.pump();
+      });
+  }
+  
+  ack(message, lease) {
+    if (message.lease === lease) {
+      this.messages = this.messages.filter(m => m !== message);
+    }
+  }
+  
+  fail(message, lease, error) {
+    if (message.lease !== lease) {
+      return;
+    }
     
-    // 记录完成事件
-    await logEvent(env, 'task_completed', {
-      task_id: task.task_id,
-      user_id: task.user_id,
-      file_count: files.length
-    });
+    // 使仍在运行的旧执行失效
+    message.lease += 1;
     
-    // 发送完成通知
-    await sendNotification(env, 'task_completed', {
-      task_id: task.task_id,
-      username: task.username,
-      email: task.email,
-      file_count: files.length,
-      download_links: links.slice(0, 3) // 只发送前3个链接
-    });
+    if (message.attempts >= this.maxAttempts) {
+      this.messages = this.messages.filter(m => m !== message);
+      this.deadLetters.push({ body: message.body, attempts: message.attempts, error: error.message });
+      return Promise.resolve(this.onDeadLetter(message.body, error)).catch(e => console.error('死信处理失败:', e));
+    }
     
-  } catch (error) {
-    console.error('异步处理任务失败:', error);
+    console.error(`任务执行失败，${this.retryDelayMs}ms 后重试 (${message.attempts}/${this.maxAttempts}):`, error.message);
+    message.visibleAt = Date.now() + this.retryDelayMs;
+  }
+  
+  scheduleWakeup(now) {
+    if (this.timer) {
+      clearTimeout(this.timer);
+      this.timer = null;
+    }
     
-    // 更新任务状态为失败
-    try {
-      const tasks = await getTasks(env);
-      const taskIndex = tasks.findIndex(t => t.task_id === task.task_id);
-      
-      if (taskIndex !== -1) {
-        tasks[taskIndex].status = 'failed';
-        tasks[taskIndex].error_message = error.message;
-        await saveTasks(env, tasks);
-        
-        await logEvent(env, 'task_failed', {
-          task_id: task.task_id,
-          error: error.message
-        });
-      }
-    } catch (e) {
-      console.error('更新失败状态失败:', e);
+    const pending = this.messages.filter(m => m.visibleAt > now);
+    if (pending.length === 0) {
+      return;
     }
+    
+    const next = Math.min(...pending.map(m => m.visibleAt));
+    this.timer = setTimeout(() => {
+      this.timer = null;
+      this.pump();
+    }, next - now);
   }
 }
 
-async function handleDownloadTask(taskId, env) {
-  try {
-    const tasks = await getTasks(env);
-    const task = tasks.find(t => t.task_id === taskId);
+function handleGetQueueStatus(env) {
+  if (env.TASK_QUEUE) {
+    return jsonResponse({ backend: 'cloudflare_queues' });
+  }
+  
+  const queue = getLocalTaskQueue(env);
+  return jsonResponse({
+    backend: 'local',
+    concurrency: queue.concurrency,
+    queued: queue.messages.length,
+    active: queue.active,
+    dead_letters: queue.deadLetters
+  });
+}
+
+async function handleQueueBatch(batch, env) {
+  // Cloudflare Queues 消费者：重试与死信由队列配置（max_retries / dead_letter_queue）负责
+  const { maxAttempts, retryDelayMs } = getTaskQueueOptions(env);
+  
+  await Promise.all(batch.messages.map(async message => {
+    try {
+      await runTaskJob(message.body, env, () => true);
+      message.ack();
+    } catch (error) {
+      if (message.attempts >= maxAttempts) {
+        await deadLetterTaskJob(message.body, env, error);
+        message.ack();
+      } else {
+        message.retry({ delaySeconds: Math.ceil(retryDelayMs / 1000) });
+      }
+    }
+  }));
+}
+
+async function runTaskJob(job, env, isCurrent) {
+  // 可重复执行：已结束的任务直接确认，进度从上次保存处继续
+  const currentTask = await getTask(env, job.task_id);
+  
+  if (!currentTask || currentTask.status !== 'processing') {
+    return;
+  }
+  
+  const stepDelay = parseInt(env.TASK_STEP_DELAY_MS || '2000', 10);
+  
+  // 模拟处理过程
+  const steps = [20, 40, 60, 80, 100].filter(progress => progress > (currentTask.progress || 0));
+  for (const progress of steps) {
+    await new Promise(resolve => setTimeout(resolve, stepDelay)); // 模拟延迟
+    
+    if (!isCurrent()) {
+      return;
+    }
+    
+    // 更新进度
+    currentTask.progress = progress;
+    touchTask(currentTask);
+    await saveTask(env, currentTask);
+    
+    // 记录进度
+    await logEvent(env, 'task_progress', {
+      task_id: currentTask.task_id,
+      progress
+    });
+  }
+  
+  if (!isCurrent()) {
+    return;
+  }
+  
+  // 完成处理
+  currentTask.status = 'completed';
+  currentTask.progress = 100;
+  currentTask.completed_at = new Date().toISOString();
+  touchTask(currentTask);
+  
+  // 生成模拟文件
+  const files = [];
+  const links = [];
+  
+  for (let i = 0; i < Math.min(currentTask.urls.length, 5); i++) {
+    const fileName = `xueke_doc_${currentTask.task_id}_${i + 1}.pdf`;
+    files.push(fileName);
+    links.push(`${getTaskBaseUrl(currentTask)}/download/${currentTask.task_id}/${fileName}`);
+  }
+  
+  currentTask.downloaded_files = files;
+  currentTask.direct_links = links;
+  
+  // 保存任务
+  await saveTask(env, currentTask);
+  await updateTaskSummaries(env, currentTask);
+  await statsTaskStatusChanged(env, 'processing', 'completed');
+  
+  // 记录完成事件
+  await logEvent(env, 'task_completed', {
+    task_id: currentTask.task_id,
+    user_id: currentTask.user_id,
+    file_count: files.length
+  });
+  
+  // 发送完成通知
+  await sendNotification(env, 'task_completed', {
+    task_id: currentTask.task_id,
+    username: currentTask.username,
+    email: currentTask.email,
+    file_count: files.length,
+    download_links: links.slice(0, 3) // 只发送前3个链接
+  });
+}
+
+async function deadLetterTaskJob(job, env, error) {
+  // 多次重试仍失败：任务标记为失败并记录死信
+  console.error('任务进入死信:', job.task_id, error.message);
+  
+  const failedTask = await getTask(env, job.task_id);
+  
+  if (failedTask && failedTask.status === 'processing') {
+    failedTask.status = 'failed';
+    failedTask.error_message = error.message;
+    touchTask(failedTask);
+    await saveTask(env, failedTask);
+    await updateTaskSummaries(env, failedTask);
+    await statsTaskStatusChanged(env, 'processing', 'failed');
+  }
+  
+  await logEvent(env, 'task_failed', {
+    task_id: job.task_id,
+    error: error.message,
+    dead_lettered: true
+  });
+}
+
+async function handleDownloadTask(taskId, env) {
+  try {
+    const task = await getTask(env, taskId);
     
     if (!task) {
       return jsonResponse({ error: '任务不存在' }, 404);
@@ -736,7 +1368,7 @@ async function handleDownloadTask(taskId, env) {
       task_id: taskId,
       direct_links: task.direct_links || [],
       files: task.downloaded_files || [],
-      download_all: `https://xuke.ambition.qzz.io/download/${taskId}/all.zip`
+      download_all: `${getTaskBaseUrl(task)}/download/${taskId}/all.zip`
     });
   } catch (error) {
     console.error('获取下载链接失败:', error);
@@ -744,62 +1376,135 @@ async function handleDownloadTask(taskId, env) {
   }
 }
 
-async function handleGetTaskStatus(taskId, env) {
+async function handleGetTaskStatus(taskId, url, env) {
   try {
-    const tasks = await getTasks(env);
-    const task = tasks.find(t => t.task_id === taskId);
+    const task = await getTask(env, taskId);
     
     if (!task) {
       return jsonResponse({ error: '任务不存在' }, 404);
     }
     
-    return jsonResponse({
-      task_id: taskId,
-      status: task.status,
-      progress: task.progress,
-      started_at: task.started_at,
-      completed_at: task.completed_at,
-      downloaded_count: task.downloaded_files ? task.downloaded_files.length : 0
-    });
+    return jsonResponse(projectTask(buildTaskStatus(task), parseFieldsParam(url.searchParams.get('fields'))));
   } catch (error) {
     console.error('获取任务状态失败:', error);
     return jsonResponse({ error: '获取任务状态失败' }, 500);
   }
 }
 
+// 任务状态推送（SSE）：连接保持到任务结束或超时，状态变化时推送事件
+const STATUS_STREAM_POLL_MS = 1000;
+const STATUS_STREAM_KEEPALIVE_MS = 15000;
+const STATUS_STREAM_MAX_MS = 5 * 60 * 1000;
+
+function handleTaskStatusStream(taskId, env, ctx) {
+  const { readable, writable } = new TransformStream();
+  const writer = writable.getWriter();
+  const encoder = new TextEncoder();
+  
+  const send = (event, data) =>
+    writer.write(encoder.encode(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`));
+  
+  const pump = async () => {
+    const deadline = Date.now() + STATUS_STREAM_MAX_MS;
+    let lastUpdatedAt = null;
+    let lastSentAt = Date.now();
+    
+    try {
+      while (Date.now() < deadline) {
+        const task = await getTask(env, taskId);
+        
+        if (!task) {
+          await send('error', { task_id: taskId, error: '任务不存在' });
+          break;
+        }
+        
+        const updatedAt = getTaskUpdatedAt(task);
+        const finished = task.status === 'completed' || task.status === 'failed';
+        
+        if (updatedAt !== lastUpdatedAt) {
+          lastUpdatedAt = updatedAt;
+          lastSentAt = Date.now();
+          // 结束时推送完整任务（包含文件和直链），过程中只推送状态
+          await send('status', finished ? task : buildTaskStatus(task));
+        } else if (Date.now() - lastSentAt >= STATUS_STREAM_KEEPALIVE_MS) {
+          lastSentAt = Date.now();
+          await writer.write(encoder.encode(': keepalive\n\n'));
+        }
+        
+        if (finished) {
+          break;
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, STATUS_STREAM_POLL_MS));
+      }
+    } catch (error) {
+      // 客户端断开时写入会失败，直接结束
+      console.error('任务状态推送中断:', error);
+    } finally {
+      try {
+        await writer.close();
+      } catch (e) {
+        // 忽略已关闭的流
+      }
+    }
+  };
+  
+  if (ctx && ctx.waitUntil) {
+    ctx.waitUntil(pump());
+  } else {
+    pump();
+  }
+  
+  return new Response(readable, {
+    headers: {
+      'Content-Type': 'text/event-stream',
+      'Cache-Control': 'no-cache',
+      'Access-Control-Allow-Origin': '*'
+    }
+  });
+}
+
 // ========== 统计信息 ==========
 async function handleGetStats(env) {
   try {
-    const [users, tasks, licenses] = await Promise.all([
-      getUsers(env),
-      getTasks(env),
-      getLicenses(env)
-    ]);
+    // 读取增量维护的计数器，不再扫描全部数据
+    const counters = await getStatsCounters(env);
+    const now = Date.now();
+    
+    let activeLicenses = 0;
+    let expiredLicenses = 0;
+    for (const [expiresAt, [active, total]] of Object.entries(counters.license_expiries)) {
+      const expiresTime = new Date(expiresAt).getTime();
+      if (expiresTime > now) {
+        activeLicenses += active;
+      } else if (expiresTime < now) {
+        expiredLicenses += total;
+      }
+    }
+    
+    // 24小时任务趋势（按小时分桶）
+    const since = now - 24 * HOUR_MS;
+    const tasksLast24h = Object.entries(counters.tasks_by_hour)
+      .filter(([bucket]) => getHourBucketTime(bucket) + HOUR_MS > since)
+      .reduce((sum, [, count]) => sum + count, 0);
     
-    // 计算统计
     const stats = {
-      total_users: users.length,
-      active_users: users.filter(u => u.is_active).length,
-      total_tasks: tasks.length,
-      pending_tasks: tasks.filter(t => t.status === 'pending').length,
-      processing_tasks: tasks.filter(t => t.status === 'processing').length,
-      completed_tasks: tasks.filter(t => t.status === 'completed').length,
-      failed_tasks: tasks.filter(t => t.status === 'failed').length,
-      total_licenses: licenses.length,
-      active_licenses: licenses.filter(l => l.is_active && new Date(l.expires_at) > new Date()).length,
-      expired_licenses: licenses.filter(l => new Date(l.expires_at) < new Date()).length,
-      server_time: new Date().toISOString(),
-      uptime: process.uptime ? Math.floor(process.uptime()) : 0
+      total_users: counters.total_users,
+      active_users: counters.active_users,
+      total_tasks: counters.total_tasks,
+      pending_tasks: counters.task_status.pending || 0,
+      processing_tasks: counters.task_status.processing || 0,
+      completed_tasks: counters.task_status.completed || 0,
+      failed_tasks: counters.task_status.failed || 0,
+      total_licenses: counters.total_licenses,
+      active_licenses: activeLicenses,
+      expired_licenses: expiredLicenses,
+      server_time: new Date(now).toISOString(),
+      uptime: typeof process !== 'undefined' && process.uptime ? Math.floor(process.uptime()) : 0,
+      tasks_last_24h: tasksLast24h,
+      stats_rebuilt_at: counters.rebuilt_at
     };
     
-    // 24小时任务趋势
-    const now = new Date();
-    const last24h = new Date(now.getTime() - 24 * 60 * 60 * 1000);
-    
-    stats.tasks_last_24h = tasks.filter(t => 
-      new Date(t.created_at) > last24h
-    ).length;
-    
     return jsonResponse(stats);
   } catch (error) {
     console.error('获取统计信息失败:', error);
@@ -807,6 +1512,21 @@ async function handleGetStats(env) {
   }
 }
 
+async function handleRebuildStats(env) {
+  try {
+    // 全量重建会扫描全部数据，交给定时任务执行
+    await requestStatsRebuild(env);
+    
+    return jsonResponse({
+      success: true,
+      message: '统计将在下次定时任务中重建'
+    }, 202);
+  } catch (error) {
+    console.error('重建统计失败:', error);
+    return jsonResponse({ success: false, error: '重建统计失败' }, 500);
+  }
+}
+
 // ========== 系统设置 ==========
 async function handleSaveSettings(request, env) {
   try {
@@ -850,88 +1570,93 @@ async function handleSaveSettings(request, env) {
   }
 }
 
+// 下载最近一次完成的分段备份：按块读取，不在请求中扫描全部数据
+const BACKUP_MAX_DOWNLOAD_CHUNKS = 500;
+
 async function handleBackup(env) {
   try {
-    const [users, tasks, licenses, settings, logs] = await Promise.all([
-      getUsers(env),
-      getTasks(env),
-      getLicenses(env),
-      env.KV_NAMESPACE.get('settings'),
-      getLogs(env, 1000) // 获取最近1000条日志
-    ]);
+    const backupId = await env.KV_NAMESPACE.get(BACKUP_LATEST_KEY);
+    const metaData = backupId ? await env.KV_NAMESPACE.get(`${BACKUP_KEY_PREFIX}${backupId}:meta`) : null;
+    
+    if (!metaData) {
+      // 尚无可用备份：登记一次备份，由定时任务分段完成
+      const started = await startBackup(env);
+      return jsonResponse({
+        success: false,
+        message: '备份生成中，请在下次定时任务完成后重试',
+        backup_id: started.backup_id
+      }, 202);
+    }
+    
+    const meta = JSON.parse(metaData);
+    const chunkCount = Object.values(meta.sections).reduce((sum, section) => sum + section.chunks, 0);
+    if (chunkCount > BACKUP_MAX_DOWNLOAD_CHUNKS) {
+      return jsonResponse({ error: '备份过大，请直接从KV读取备份块', backup: meta }, 413);
+    }
+    
+    const data = {};
+    for (const [section, info] of Object.entries(meta.sections)) {
+      const chunks = await Promise.all(Array.from({ length: info.chunks }, (_, index) =>
+        env.KV_NAMESPACE.get(`${BACKUP_KEY_PREFIX}${backupId}:${section}:${index}`)
+      ));
+      data[section] = chunks.filter(Boolean).flatMap(chunk => JSON.parse(chunk));
+    }
+    
+    const logPage = await getLogs(env, 1000); // 获取最近1000条日志
+    const logs = logPage.logs;
     
     const backup = {
-      timestamp: new Date().toISOString(),
-      version: '2.0.0',
-      users: users,
-      tasks: tasks,
-      licenses: licenses,
-      settings: settings ? JSON.parse(settings) : {},
+      timestamp: meta.completed_at || meta.backup_id,
+      version: meta.version,
+      backup_id: backupId,
+      users: data.users || [],
+      tasks: data.tasks || [],
+      licenses: data.licenses || [],
+      settings: meta.settings,
       logs: logs,
       summary: {
-        user_count: users.length,
-        task_count: tasks.length,
-        license_count: licenses.length,
+        user_count: (data.users || []).length,
+        task_count: (data.tasks || []).length,
+        license_count: (data.licenses || []).length,
         log_count: logs.length
       }
     };
     
-    // 记录备份事件
-    await logEvent(env, 'backup_created', {
-      backup_size: JSON.stringify(backup).length
-    });
-    
     return jsonResponse(backup);
   } catch (error) {
-    console.error('创建备份失败:', error);
-    return jsonResponse({ error: '创建备份失败' }, 500);
+    console.error('获取备份失败:', error);
+    return jsonResponse({ error: '获取备份失败' }, 500);
   }
 }
 
 async function handleCleanup(env) {
   try {
-    const tasks = await getTasks(env);
-    const now = new Date();
-    const days30 = new Date(now.getTime() - 30 * 24 * 60 * 60 * 1000);
-    
-    // 过滤任务：保留30天内或未完成的任务
-    const filteredTasks = tasks.filter(task => {
-      const createdDate = new Date(task.created_at);
-      
-      // 保留未完成的任务
-      if (task.status !== 'completed') {
-        return true;
-      }
-      
-      // 保留30天内的任务
-      return createdDate > days30;
-    });
-    
-    // 计算清理数量
-    const cleanedCount = tasks.length - filteredTasks.length;
-    
-    // 保存清理后的任务
-    await saveTasks(env, filteredTasks);
-    
-    // 清理日志（保留最近1000条）
-    const logs = await getLogs(env, 2000); // 获取2000条
-    if (logs.length > 1000) {
-      logs.splice(0, logs.length - 1000);
-      await saveLogs(env, logs);
-    }
+    // 手动清理与定时任务共用游标，按操作预算处理一段，未完成的部分由定时任务继续
+    // 日志分片正常情况下由 expirationTtl 自动过期，这里只清理残留和迁移旧版日志
+    const budget = createKVBudget(env, getCronKVBudget(env));
+    const cleanedLogs = await compactLogs(env, budget.share(Math.floor(budget.limit / 4)));
+    // 旧版数据迁移完成前先推进迁移，过期清理等迁移完成后再执行
+    const migration = await migrateLegacyStorage(budget);
+    const result = migration.complete
+      ? await expireCompletedTasks(budget)
+      : { removed: 0, scanned: 0, complete: false };
     
     // 记录清理事件
     await logEvent(env, 'system_cleanup', {
-      cleaned_tasks: cleanedCount,
-      remaining_tasks: filteredTasks.length,
-      remaining_logs: Math.min(logs.length, 1000)
+      cleaned_tasks: result.removed,
+      scanned_tasks: result.scanned,
+      cleaned_logs: cleanedLogs,
+      complete: result.complete
     });
     
     return jsonResponse({
       success: true,
-      message: `系统清理完成，移除了 ${cleanedCount} 个旧任务`,
-      cleaned_tasks: cleanedCount,
-      remaining_tasks: filteredTasks.length
+      message: result.complete
+        ? `系统清理完成，移除了 ${result.removed} 个旧任务`
+        : `已清理一部分，移除了 ${result.removed} 个旧任务，其余由定时任务继续`,
+      cleaned_tasks: result.removed,
+      remaining_tasks: result.scanned - result.removed,
+      complete: result.complete
     });
   } catch (error) {
     console.error('系统清理失败:', error);
@@ -939,192 +1664,1474 @@ async function handleCleanup(env) {
   }
 }
 
-// ========== 文件下载 ==========
-async function handleDownload(request, env) {
-  const url = new URL(request.url);
-  const path = url.pathname;
-  
-  // 解析下载路径：/download/:taskId/:filename
-  const parts = path.split('/').filter(p => p);
+// ========== 定时任务 ==========
+// 每次调用约有1000次KV操作上限：各项维护任务按操作预算分段执行，未完成时把游标/进度保存在KV中，
+// 下次定时触发时继续。每日触发只登记统计重建和备份，由每小时的维护任务分段完成
+
+const HOURLY_CRON = '0 * * * *';
+const DAILY_CRON = '0 0 * * *';
+const CLEANUP_CURSOR_KEY = 'cleanup_cursor';
+const CLEANUP_PAGE_SIZE = 200;
+const BACKUP_KEY_PREFIX = 'backup:';
+const BACKUP_LATEST_KEY = 'backup_latest';
+const BACKUP_JOB_KEY = 'job:backup';
+const BACKUP_CHUNK_SIZE = 500;
+const STATS_REBUILD_JOB_KEY = 'job:stats_rebuild';
+// 每段任务收尾时保存进度等写入所需的预留操作数
+const CRON_BUDGET_RESERVE = 5;
+// 旧版数据迁移期间，每小时预算中分给迁移的比例
+const MIGRATION_BUDGET_SHARE = 0.75;
+
+function getCronKVBudget(env) {
+  return parseInt(env.CRON_KV_BUDGET || '800', 10);
+}
+
+// KV 操作计数：env 中的 KV 调用都计入预算，share 划出的子预算同时计入上级
+function createKVBudget(env, limit) {
+  const kv = env.KV_NAMESPACE;
+  const budget = { limit, used: 0 };
+  const counted = {};
   
-  if (parts.length < 3) {
-    return new Response('Invalid download path', { status: 400 });
+  for (const method of ['get', 'put', 'delete', 'list']) {
+    counted[method] = (...args) => {
+      budget.used += 1;
+      return kv[method](...args);
+    };
   }
   
-  const taskId = parts[1];
-  const filename = parts[2];
+  budget.env = { ...env, KV_NAMESPACE: counted };
+  budget.remaining = () => budget.limit - budget.used;
+  budget.share = amount => createKVBudget(budget.env, Math.max(0, Math.min(amount, budget.remaining())));
+  return budget;
+}
+
+async function runScheduledJobs(cron, env) {
+  const started = Date.now();
+  const result = { cron };
   
   try {
-    // 获取任务信息
-    const tasks = await getTasks(env);
-    const task = tasks.find(t => t.task_id === taskId);
-    
-    if (!task) {
-      return new Response('Task not found', { status: 404 });
-    }
-    
-    // 检查文件是否存在于任务中
-    if (task.downloaded_files && !task.downloaded_files.includes(filename)) {
-      return new Response('File not found', { status: 404 });
-    }
-    
-    // 生成模拟文件内容
-    let fileContent;
-    
-    if (filename === 'all.zip') {
-      // 生成包含所有文件的ZIP文件（模拟）
-      fileContent = `This is a simulated ZIP file containing all downloaded files for task ${taskId}.
-      
-Task Information:
-- Task ID: ${taskId}
-- User: ${task.username}
-- Email: ${task.email}
-- Files: ${task.downloaded_files ? task.downloaded_files.join(', ') : 'None'}
-- Created: ${task.created_at}
-
-This is a placeholder file. In a real system, this would contain the actual downloaded files.`;
-      
-      return new Response(fileContent, {
-        headers: {
-          'Content-Type': 'application/zip',
-          'Content-Disposition': `attachment; filename="xueke_${taskId}.zip"`,
-          'Cache-Control': 'no-cache'
-        }
-      });
+    if (cron === DAILY_CRON) {
+      // 每日：登记统计重建和备份（同一时刻的每小时触发会开始执行）
+      await requestStatsRebuild(env);
+      result.backup = await startBackup(env);
     } else {
-      // 生成单个文件
-      fileContent = `学科网下载文件 - ${filename}
-
-任务信息：
-- 任务ID: ${taskId}
-- 用户: ${task.username}
-- 邮箱: ${task.email}
-- 下载时间: ${new Date().toISOString()}
-
-文件内容：
-这是学科网文档的模拟下载文件。
-在实际系统中，这里应该是从学科网下载的实际文档内容。
-
-文档ID: ${filename.replace('.pdf', '').split('_').pop()}
-生成时间: ${new Date().toISOString()}`;
+      // 每小时：在操作预算内依次推进各项维护任务，剩余预算顺延给后面的任务。
+      // 旧版数据迁移优先；迁移完成前索引补写、备份和过期清理看不到旧版数据，暂不执行
+      const budget = createKVBudget(env, getCronKVBudget(env));
+      result.migration = await migrateLegacyStorage(budget.share(Math.floor(budget.limit * MIGRATION_BUDGET_SHARE)));
+      const jobs = [
+        ['stats', share => runStatsMaintenance(share)],
+        ['cleaned_logs', share => compactLogs(share.env, share)]
+      ];
+      if (result.migration.complete) {
+        jobs.push(
+          ['task_index', share => backfillTaskIndex(share)],
+          ['backup', share => continueBackup(share)],
+          ['tasks', share => expireCompletedTasks(share)]
+        );
+      }
       
-      return new Response(fileContent, {
-        headers: {
-          'Content-Type': 'application/pdf',
-          'Content-Disposition': `attachment; filename="${filename}"`,
-          'Cache-Control': 'no-cache'
-        }
-      });
+      for (let i = 0; i < jobs.length; i++) {
+        const [name, job] = jobs[i];
+        result[name] = await job(budget.share(Math.floor(budget.remaining() / (jobs.length - i))));
+      }
+      result.kv_ops = budget.used;
     }
-    
   } catch (error) {
-    console.error('处理下载请求失败:', error);
-    return new Response('Download failed', { status: 500 });
+    console.error('定时任务失败:', error);
+    result.error = error.message;
   }
+  
+  result.elapsed_ms = Date.now() - started;
+  await logEvent(env, 'scheduled_run', result);
+  return result;
 }
 
-// ========== 数据访问辅助函数 ==========
-async function getUsers(env) {
+// 队列消费者每批消息后也推进一段旧版数据迁移，迁移完成后每个实例不再检查
+let legacyMigrationComplete = false;
+
+async function continueLegacyMigration(env) {
+  if (legacyMigrationComplete) {
+    return;
+  }
+  
   try {
-    const usersData = await env.KV_NAMESPACE.get('users');
-    return usersData ? JSON.parse(usersData) : getDefaultUsers();
+    const budget = createKVBudget(env, parseInt(env.QUEUE_MIGRATION_KV_BUDGET || '100', 10));
+    const result = await migrateLegacyStorage(budget);
+    legacyMigrationComplete = result.complete;
   } catch (error) {
-    console.error('获取用户数据失败:', error);
-    return getDefaultUsers();
+    console.error('迁移旧版数据失败:', error);
   }
 }
 
-async function saveUsers(env, users) {
-  try {
-    await env.KV_NAMESPACE.put('users', JSON.stringify(users));
-  } catch (error) {
-    console.error('保存用户数据失败:', error);
+async function listKeysPage(env, prefix, cursor, limit) {
+  const page = await env.KV_NAMESPACE.list({ prefix, cursor: cursor || undefined, limit });
+  return {
+    keys: page.keys.map(k => k.name),
+    cursor: page.list_complete ? null : page.cursor
+  };
+}
+
+// 清理超过保留期的已完成任务，未完成的任务始终保留。任务索引补写完成后只需 list 索引键，
+// 否则逐个读取任务；从上次的游标继续，预算用完时保存游标，扫描完一轮后从头开始
+const CLEANUP_INDEX_CURSOR_KEY = 'cleanup_index_cursor';
+
+async function expireCompletedTasks(budget) {
+  const retentionDays = parseInt(budget.env.TASK_RETENTION_DAYS || '30', 10);
+  const cutoff = Date.now() - retentionDays * 24 * HOUR_MS;
+  const isExpired = task => task.status === 'completed' && new Date(task.created_at).getTime() < cutoff;
+  
+  return await budget.env.KV_NAMESPACE.get(TASK_INDEX_READY_KEY)
+    ? await expireFromTaskIndex(budget, isExpired)
+    : await expireFromTaskKeys(budget, isExpired);
+}
+
+async function expireFromTaskIndex(budget, isExpired) {
+  const env = budget.env;
+  let cursor = await env.KV_NAMESPACE.get(CLEANUP_INDEX_CURSOR_KEY);
+  let scanned = 0;
+  let removed = 0;
+  
+  while (budget.remaining() - CRON_BUDGET_RESERVE > 1) {
+    const page = await env.KV_NAMESPACE.list({ prefix: TASK_INDEX_KEY_PREFIX, cursor: cursor || undefined });
+    const entries = page.keys.map(parseTaskIndexEntry);
+    const expired = entries.filter(isExpired);
+    
+    // 每个任务删除任务和索引键各1次，按用户更新索引最多2次
+    const batch = expired.slice(0, Math.max(0, Math.floor((budget.remaining() - CRON_BUDGET_RESERVE) / 4)));
+    const tasks = await Promise.all(batch.map(entry => entry.user_id
+      ? { task_id: entry.id, user_id: entry.user_id, status: entry.status, created_at: entry.created_at }
+      : getTask(env, entry.id)));
+    await deleteTasks(env, tasks.filter(Boolean));
+    
+    scanned += entries.length;
+    removed += batch.length;
+    
+    if (batch.length < expired.length) {
+      // 本页未删完：保留游标，下次从同一位置继续（已删除的键不会再出现）
+      break;
+    }
+    
+    cursor = page.list_complete ? null : page.cursor;
+    if (!cursor) {
+      break;
+    }
+  }
+  
+  if (cursor) {
+    await env.KV_NAMESPACE.put(CLEANUP_INDEX_CURSOR_KEY, cursor);
+  } else {
+    await env.KV_NAMESPACE.delete(CLEANUP_INDEX_CURSOR_KEY);
   }
+  
+  return { scanned, removed, complete: !cursor };
 }
 
-async function getTasks(env) {
-  try {
-    const tasksData = await env.KV_NAMESPACE.get('tasks');
-    return tasksData ? JSON.parse(tasksData) : [];
-  } catch (error) {
-    console.error('获取任务数据失败:', error);
-    return [];
+async function expireFromTaskKeys(budget, isExpired) {
+  const env = budget.env;
+  let cursor = await env.KV_NAMESPACE.get(CLEANUP_CURSOR_KEY);
+  let scanned = 0;
+  let removed = 0;
+  
+  do {
+    // 每个任务最多：读取1次、删除任务和索引键各1次、按用户更新索引2次
+    const pageSize = Math.min(CLEANUP_PAGE_SIZE, Math.floor((budget.remaining() - CRON_BUDGET_RESERVE) / 5));
+    if (pageSize < 1) {
+      break;
+    }
+    
+    const page = await listKeysPage(env, TASK_KEY_PREFIX, cursor, pageSize);
+    const tasks = (await Promise.all(
+      page.keys.map(key => getTask(env, key.slice(TASK_KEY_PREFIX.length)))
+    )).filter(Boolean);
+    
+    const expired = tasks.filter(isExpired);
+    await deleteTasks(env, expired);
+    
+    scanned += tasks.length;
+    removed += expired.length;
+    cursor = page.cursor;
+  } while (cursor);
+  
+  if (cursor) {
+    await env.KV_NAMESPACE.put(CLEANUP_CURSOR_KEY, cursor);
+  } else {
+    await env.KV_NAMESPACE.delete(CLEANUP_CURSOR_KEY);
   }
+  
+  return { scanned, removed, complete: !cursor };
 }
 
-async function saveTasks(env, tasks) {
-  try {
-    await env.KV_NAMESPACE.put('tasks', JSON.stringify(tasks));
-  } catch (error) {
-    console.error('保存任务数据失败:', error);
+// 为索引上线前创建的任务补写 idx:tasks: 索引键，全部完成后不再扫描
+const TASK_INDEX_CURSOR_KEY = 'task_index_cursor';
+const TASK_INDEX_READY_KEY = 'task_index_ready';
+
+async function backfillTaskIndex(budget) {
+  const env = budget.env;
+  if (await env.KV_NAMESPACE.get(TASK_INDEX_READY_KEY)) {
+    return { indexed: 0, complete: true };
+  }
+  
+  let cursor = await env.KV_NAMESPACE.get(TASK_INDEX_CURSOR_KEY);
+  let indexed = 0;
+  
+  do {
+    // 每个任务读取和写入索引各1次
+    const pageSize = Math.min(CLEANUP_PAGE_SIZE, Math.floor((budget.remaining() - CRON_BUDGET_RESERVE) / 2));
+    if (pageSize < 1) {
+      break;
+    }
+    
+    const page = await listKeysPage(env, TASK_KEY_PREFIX, cursor, pageSize);
+    const tasks = (await Promise.all(
+      page.keys.map(key => getTask(env, key.slice(TASK_KEY_PREFIX.length)))
+    )).filter(Boolean);
+    
+    await putTaskIndexEntries(env, tasks);
+    indexed += tasks.length;
+    cursor = page.cursor;
+  } while (cursor);
+  
+  if (cursor) {
+    await env.KV_NAMESPACE.put(TASK_INDEX_CURSOR_KEY, cursor);
+  } else {
+    await env.KV_NAMESPACE.put(TASK_INDEX_READY_KEY, new Date().toISOString());
+    await env.KV_NAMESPACE.delete(TASK_INDEX_CURSOR_KEY);
   }
+  
+  return { indexed, complete: !cursor };
 }
 
-async function getLicenses(env) {
-  try {
-    const licensesData = await env.KV_NAMESPACE.get('licenses');
-    return licensesData ? JSON.parse(licensesData) : getDefaultLicenses();
-  } catch (error) {
-    console.error('获取许可证数据失败:', error);
-    return getDefaultLicenses();
+// 有重建请求、重建进行中或尚无基准计数时推进重建，否则合并统计分片
+async function runStatsMaintenance(budget) {
+  const env = budget.env;
+  const [rebuildRequested, rebuildJob, statsBase] = await Promise.all([
+    env.KV_NAMESPACE.get(STATS_REBUILD_KEY),
+    env.KV_NAMESPACE.get(STATS_REBUILD_JOB_KEY),
+    env.KV_NAMESPACE.get(STATS_KEY)
+  ]);
+  
+  if (rebuildRequested || rebuildJob || !statsBase) {
+    return { rebuild: await rebuildStats(budget, rebuildJob ? JSON.parse(rebuildJob) : null) };
   }
+  return { compact: await compactStats(budget) };
 }
 
-async function saveLicenses(env, licenses) {
-  try {
-    await env.KV_NAMESPACE.put('licenses', JSON.stringify(licenses));
-  } catch (error) {
-    console.error('保存许可证数据失败:', error);
+// 分段备份：每页数据写为一个块，进度保存在 job:backup 中
+function getBackupSections() {
+  return [
+    ['users', USER_KEY_PREFIX],
+    ['tasks', TASK_KEY_PREFIX],
+    ['licenses', LICENSE_KEY_PREFIX]
+  ];
+}
+
+async function startBackup(env) {
+  const existing = await env.KV_NAMESPACE.get(BACKUP_JOB_KEY);
+  if (existing) {
+    // 上一次备份尚未完成时不重复开始
+    return { backup_id: JSON.parse(existing).backup_id, started: false };
   }
+  
+  const job = {
+    backup_id: new Date().toISOString(),
+    section: 0,
+    cursor: null,
+    chunk: 0,
+    count: 0,
+    sections: {}
+  };
+  await env.KV_NAMESPACE.put(BACKUP_JOB_KEY, JSON.stringify(job));
+  return { backup_id: job.backup_id, started: true };
 }
 
-async function getLogs(env, limit = 1000) {
-  try {
-    const logsData = await env.KV_NAMESPACE.get('logs');
-    const logs = logsData ? JSON.parse(logsData) : [];
+async function continueBackup(budget) {
+  const env = budget.env;
+  const jobData = await env.KV_NAMESPACE.get(BACKUP_JOB_KEY);
+  if (!jobData) {
+    return null;
+  }
+  
+  const job = JSON.parse(jobData);
+  const sections = getBackupSections();
+  const ttl = parseInt(env.BACKUP_RETENTION_DAYS || '7', 10) * 24 * 3600;
+  
+  while (job.section < sections.length) {
+    // 每页：list 1次、逐个读取、写入1个块
+    const pageSize = Math.min(BACKUP_CHUNK_SIZE, budget.remaining() - CRON_BUDGET_RESERVE - 2);
+    if (pageSize < 1) {
+      break;
+    }
     
-    // 按时间排序，最新的在前面
-    logs.sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp));
+    const [section, prefix] = sections[job.section];
+    const page = await listKeysPage(env, prefix, job.cursor, pageSize);
+    const values = (await Promise.all(page.keys.map(key => env.KV_NAMESPACE.get(key)))).filter(Boolean);
+    
+    if (values.length > 0) {
+      await env.KV_NAMESPACE.put(
+        `${BACKUP_KEY_PREFIX}${job.backup_id}:${section}:${job.chunk}`,
+        `[${values.join(',')}]`,
+        { expirationTtl: ttl }
+      );
+      job.chunk += 1;
+      job.count += values.length;
+    }
     
-    // 限制数量
-    return logs.slice(0, limit);
-  } catch (error) {
-    console.error('获取日志失败:', error);
-    return [];
+    job.cursor = page.cursor;
+    if (!job.cursor) {
+      job.sections[section] = { count: job.count, chunks: job.chunk };
+      job.section += 1;
+      job.chunk = 0;
+      job.count = 0;
+    }
+  }
+  
+  if (job.section < sections.length) {
+    await env.KV_NAMESPACE.put(BACKUP_JOB_KEY, JSON.stringify(job));
+    return { backup_id: job.backup_id, complete: false, section: sections[job.section][0] };
   }
+  
+  const settings = await env.KV_NAMESPACE.get('settings');
+  const meta = {
+    backup_id: job.backup_id,
+    version: '2.0.0',
+    completed_at: new Date().toISOString(),
+    settings: settings ? JSON.parse(settings) : {},
+    sections: job.sections
+  };
+  
+  await env.KV_NAMESPACE.put(`${BACKUP_KEY_PREFIX}${job.backup_id}:meta`, JSON.stringify(meta), { expirationTtl: ttl });
+  await env.KV_NAMESPACE.put(BACKUP_LATEST_KEY, job.backup_id);
+  await env.KV_NAMESPACE.delete(BACKUP_JOB_KEY);
+  
+  await logEvent(env, 'backup_created', {
+    backup_id: job.backup_id,
+    sections: job.sections
+  });
+  
+  return { backup_id: job.backup_id, complete: true, sections: job.sections };
 }
 
-async function saveLogs(env, logs) {
+// ========== 日志查询 ==========
+async function handleGetLogs(url, env) {
   try {
-    await env.KV_NAMESPACE.put('logs', JSON.stringify(logs));
+    const limit = Math.min(parseInt(url.searchParams.get('limit') || '100', 10) || 100, 1000);
+    const cursor = url.searchParams.get('cursor') || null;
+    
+    return jsonResponse(await getLogs(env, limit, cursor));
   } catch (error) {
-    console.error('保存日志失败:', error);
+    console.error('获取日志失败:', error);
+    return jsonResponse({ error: '获取日志失败' }, 500);
   }
 }
 
-async function logEvent(env, type, data) {
-  try {
-    const logs = await getLogs(env, 2000); // 获取现有日志
-    
-    const logEntry = {
-      id: generateId('log'),
-      type,
-      data,
-      timestamp: new Date().toISOString(),
-      ip: 'system'
-    };
-    
-    logs.push(logEntry);
+// ========== 文件下载 ==========
+async function handleDownload(request, env, ctx) {
+  const url = new URL(request.url);
+  const path = url.pathname;
+  
+  // 解析下载路径：/download/:taskId/:filename
+  const parts = path.split('/').filter(p => p);
+  
+  if (parts.length < 3) {
+    return new Response('Invalid download path', { status: 400 });
+  }
+  
+  const taskId = parts[1];
+  const filename = parts[2];
+  
+  try {
+    // 获取任务信息
+    const task = await getTask(env, taskId);
+    
+    if (!task) {
+      return new Response('Task not found', { status: 404 });
+    }
+    
+    if (filename === 'all.zip') {
+      if (task.status !== 'completed') {
+        return new Response('Task not completed', { status: 400 });
+      }
+      
+      // 打包任务的全部文件，边生成边输出
+      return streamTaskZip(task, url.searchParams.get('compression') === 'deflate', ctx);
+    }
+    
+    // 检查文件是否存在于任务中
+    if (task.downloaded_files && !task.downloaded_files.includes(filename)) {
+      return new Response('File not found', { status: 404 });
+    }
+    
+    // 内容固定，支持 Range 断点续传
+    return rangeResponse(request, buildTaskFileContent(task, filename), {
+      'Content-Type': 'application/pdf',
+      'Content-Disposition': `attachment; filename="${filename}"`,
+      'Cache-Control': 'no-cache'
+    });
+    
+  } catch (error) {
+    console.error('处理下载请求失败:', error);
+    return new Response('Download failed', { status: 500 });
+  }
+}
+
+// 生成模拟文件内容
+function buildTaskFileContent(task, filename) {
+  const fileContent = `学科网下载文件 - ${filename}
+
+任务信息：
+- 任务ID: ${task.task_id}
+- 用户: ${task.username}
+- 邮箱: ${task.email}
+- 下载时间: ${task.completed_at || task.created_at}
+
+文件内容：
+这是学科网文档的模拟下载文件。
+在实际系统中，这里应该是从学科网下载的实际文档内容。
+
+文档ID: ${filename.replace('.pdf', '').split('_').pop()}
+生成时间: ${task.completed_at || task.created_at}`;
+  
+  return new TextEncoder().encode(fileContent);
+}
+
+// 流式输出任务ZIP：逐个文件生成并写入，不在内存中缓存整个压缩包
+function streamTaskZip(task, deflate, ctx) {
+  const { readable, writable } = new TransformStream();
+  const zip = new ZipStreamWriter(writable.getWriter());
+  const modified = new Date(task.completed_at || task.created_at);
+  
+  const pump = async () => {
+    try {
+      for (const filename of task.downloaded_files || []) {
+        await zip.addEntry(filename, buildTaskFileContent(task, filename), modified, deflate);
+      }
+      await zip.finish();
+    } catch (error) {
+      console.error('生成ZIP失败:', error);
+      await zip.abort(error);
+    }
+  };
+  
+  if (ctx && ctx.waitUntil) {
+    ctx.waitUntil(pump());
+  } else {
+    pump();
+  }
+  
+  return new Response(readable, {
+    headers: {
+      'Content-Type': 'application/zip',
+      'Content-Disposition': `attachment; filename="xueke_${task.task_id}.zip"`,
+      'Cache-Control': 'no-cache',
+      'Access-Control-Allow-Origin': '*'
+    }
+  });
+}
+
+// ========== ZIP 流式写入 ==========
+// stored 条目在本地文件头中写明大小和CRC；deflate 条目通过 CompressionStream 压缩，
+// 大小事先未知，使用数据描述符（通用标志位3）写在数据之后
+const CRC32_TABLE = (() => {
+  const table = new Uint32Array(256);
+  for (let n = 0; n < 256; n++) {
+    let c = n;
+    for (let k = 0; k < 8; k++) {
+      c = c & 1 ? 0xedb88320 ^ (c >>> 1) : c >>> 1;
+    }
+    table[n] = c >>> 0;
+  }
+  return table;
+})();
+
+function crc32(bytes) {
+  let crc = 0xffffffff;
+  for (let i = 0; i < bytes.length; i++) {
+    crc = CRC32_TABLE[(crc ^ bytes[i]) & 0xff] ^ (crc >>> 8);
+  }
+  return (crc ^ 0xffffffff) >>> 0;
+}
+
+function toDosDateTime(date) {
+  const time = (date.getUTCHours() << 11) | (date.getUTCMinutes() << 5) | Math.floor(date.getUTCSeconds() / 2);
+  const day = ((Math.max(date.getUTCFullYear(), 1980) - 1980) << 9) | ((date.getUTCMonth() + 1) << 5) | date.getUTCDate();
+  return { time, day };
+}
+
+class ZipStreamWriter {
+  constructor(writer) {
+    this.writer = writer;
+    this.offset = 0;
+    this.entries = [];
+    this.encoder = new TextEncoder();
+  }
+  
+  async write(bytes) {
+    this.offset += bytes.length;
+    await this.writer.write(bytes);
+  }
+  
+  async addEntry(name, bytes, modified, deflate = false) {
+    const nameBytes = this.encoder.encode(name);
+    const { time, day } = toDosDateTime(modified);
+    const entry = {
+      nameBytes,
+      time,
+      day,
+      flags: 0x0800 | (deflate ? 0x0008 : 0), // UTF-8 文件名
+      method: deflate ? 8 : 0,
+      crc: crc32(bytes),
+      compressedSize: deflate ? 0 : bytes.length,
+      size: bytes.length,
+      offset: this.offset
+    };
+    
+    const header = new Uint8Array(30 + nameBytes.length);
+    const view = new DataView(header.buffer);
+    view.setUint32(0, 0x04034b50, true);
+    view.setUint16(4, 20, true);
+    view.setUint16(6, entry.flags, true);
+    view.setUint16(8, entry.method, true);
+    view.setUint16(10, time, true);
+    view.setUint16(12, day, true);
+    // 使用数据描述符时本地头中的CRC和大小为0
+    view.setUint32(14, deflate ? 0 : entry.crc, true);
+    view.setUint32(18, deflate ? 0 : entry.compressedSize, true);
+    view.setUint32(22, deflate ? 0 : entry.size, true);
+    view.setUint16(26, nameBytes.length, true);
+    view.setUint16(28, 0, true);
+    header.set(nameBytes, 30);
+    await this.write(header);
+    
+    if (deflate) {
+      const compressed = new Blob([bytes]).stream().pipeThrough(new CompressionStream('deflate-raw'));
+      const reader = compressed.getReader();
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        entry.compressedSize += value.length;
+        await this.write(value);
+      }
+      
+      const descriptor = new Uint8Array(16);
+      const descriptorView = new DataView(descriptor.buffer);
+      descriptorView.setUint32(0, 0x08074b50, true);
+      descriptorView.setUint32(4, entry.crc, true);
+      descriptorView.setUint32(8, entry.compressedSize, true);
+      descriptorView.setUint32(12, entry.size, true);
+      await this.write(descriptor);
+    } else {
+      await this.write(bytes);
+    }
+    
+    this.entries.push(entry);
+  }
+  
+  async finish() {
+    const centralStart = this.offset;
+    
+    for (const entry of this.entries) {
+      const header = new Uint8Array(46 + entry.nameBytes.length);
+      const view = new DataView(header.buffer);
+      view.setUint32(0, 0x02014b50, true);
+      view.setUint16(4, 20, true);
+      view.setUint16(6, 20, true);
+      view.setUint16(8, entry.flags, true);
+      view.setUint16(10, entry.method, true);
+      view.setUint16(12, entry.time, true);
+      view.setUint16(14, entry.day, true);
+      view.setUint32(16, entry.crc, true);
+      view.setUint32(20, entry.compressedSize, true);
+      view.setUint32(24, entry.size, true);
+      view.setUint16(28, entry.nameBytes.length, true);
+      view.setUint32(42, entry.offset, true);
+      header.set(entry.nameBytes, 46);
+      await this.write(header);
+    }
+    
+    const end = new Uint8Array(22);
+    const view = new DataView(end.buffer);
+    view.setUint32(0, 0x06054b50, true);
+    view.setUint16(8, this.entries.length, true);
+    view.setUint16(10, this.entries.length, true);
+    view.setUint32(12, this.offset - centralStart, true);
+    view.setUint32(16, centralStart, true);
+    await this.write(end);
+    
+    await this.writer.close();
+  }
+  
+  async abort(error) {
+    try {
+      await this.writer.abort(error);
+    } catch (e) {
+      // 忽略已关闭的流
+    }
+  }
+}
+
+// 按 Range 请求头返回部分内容（只支持单个区间）
+function rangeResponse(request, bytes, headers) {
+  const total = bytes.byteLength;
+  const range = request.headers.get('Range');
+  const match = range && /^bytes=(\d*)-(\d*)$/.exec(range.trim());
+  
+  const baseHeaders = {
+    ...headers,
+    'Accept-Ranges': 'bytes',
+    'Access-Control-Allow-Origin': '*'
+  };
+  
+  if (!match || (match[1] === '' && match[2] === '')) {
+    return new Response(bytes, {
+      headers: { ...baseHeaders, 'Content-Length': String(total) }
+    });
+  }
+  
+  let start;
+  let end;
+  if (match[1] === '') {
+    // bytes=-N 表示最后N个字节
+    start = Math.max(0, total - parseInt(match[2], 10));
+    end = total - 1;
+  } else {
+    start = parseInt(match[1], 10);
+    end = match[2] === '' ? total - 1 : Math.min(parseInt(match[2], 10), total - 1);
+  }
+  
+  if (start >= total || start > end) {
+    return new Response(null, {
+      status: 416,
+      headers: { ...baseHeaders, 'Content-Range': `bytes */${total}` }
+    });
+  }
+  
+  return new Response(bytes.slice(start, end + 1), {
+    status: 206,
+    headers: {
+      ...baseHeaders,
+      'Content-Range': `bytes ${start}-${end}/${total}`,
+      'Content-Length': String(end - start + 1)
+    }
+  });
+}
+
+// ========== 数据访问辅助函数 ==========
+// 用户按 user:{id} 存储，user_by_name:{username} / user_by_email:{email} 指向用户ID
+const USER_KEY_PREFIX = 'user:';
+const USER_BY_NAME_KEY_PREFIX = 'user_by_name:';
+const USER_BY_EMAIL_KEY_PREFIX = 'user_by_email:';
+
+// 获取全部用户（仅管理类接口使用），迁移完成前补上尚未迁移的旧版用户
+async function getUsers(env) {
+  try {
+    const keys = await listKeys(env, USER_KEY_PREFIX);
+    const users = (await Promise.all(keys.map(key => getUser(env, key.slice(USER_KEY_PREFIX.length)))))
+      .filter(Boolean);
+    
+    const legacy = await getLegacyUserStore(env);
+    const known = new Set(users.map(user => user.id));
+    return legacy ? [...users, ...legacy.users.filter(user => !known.has(user.id))] : users;
+  } catch (error) {
+    console.error('获取用户数据失败:', error);
+    return [];
+  }
+}
+
+async function getUser(env, userId) {
+  try {
+    const userData = await env.KV_NAMESPACE.get(USER_KEY_PREFIX + userId);
+    if (userData) {
+      return JSON.parse(userData);
+    }
+    
+    const legacy = await getLegacyUserStore(env);
+    return legacy ? legacy.byId.get(userId) || null : null;
+  } catch (error) {
+    console.error('获取用户数据失败:', error);
+    return null;
+  }
+}
+
+async function getUserByName(env, username) {
+  return await getIndexedUser(env, USER_BY_NAME_KEY_PREFIX, username, 'byName');
+}
+
+async function getUserByEmail(env, email) {
+  return await getIndexedUser(env, USER_BY_EMAIL_KEY_PREFIX, email, 'byEmail');
+}
+
+// 按用户名/邮箱索引查找；索引尚未迁移时从旧版数据取用户ID（用户本身可能已被更新，仍按ID读取）
+async function getIndexedUser(env, prefix, value, legacyIndex) {
+  try {
+    const userId = await env.KV_NAMESPACE.get(prefix + value);
+    if (userId) {
+      return await getUser(env, userId);
+    }
+    
+    const legacy = await getLegacyUserStore(env);
+    const legacyUser = legacy ? legacy[legacyIndex].get(value) : null;
+    return legacyUser ? await getUser(env, legacyUser.id) : null;
+  } catch (error) {
+    console.error('获取用户数据失败:', error);
+    return null;
+  }
+}
+
+async function saveUser(env, user) {
+  try {
+    await env.KV_NAMESPACE.put(USER_KEY_PREFIX + user.id, JSON.stringify(user));
+  } catch (error) {
+    console.error('保存用户数据失败:', error);
+  }
+}
+
+// 用户名和邮箱不可修改，只在创建用户时写入索引
+async function indexUser(env, user) {
+  try {
+    await Promise.all([
+      env.KV_NAMESPACE.put(USER_BY_NAME_KEY_PREFIX + user.username, user.id),
+      env.KV_NAMESPACE.put(USER_BY_EMAIL_KEY_PREFIX + user.email, user.id)
+    ]);
+  } catch (error) {
+    console.error('保存用户索引失败:', error);
+  }
+}
+
+// 任务按 task:{id} 单独存储，user_tasks:{user_id} 保存用户任务的精简摘要（按创建顺序）：
+// [{ id, status, created_at, updated_at }]，计数和准入控制只读这一个键，无需读取任务详情。
+// 摘要只在创建和状态变化时更新（进度变化不写索引，避免同一键频繁写入）
+const TASK_KEY_PREFIX = 'task:';
+const USER_TASKS_KEY_PREFIX = 'user_tasks:';
+// 单次请求最多读取的用户任务详情数（KV 每次调用约1000次操作上限）
+const USER_TASK_READ_LIMIT = 500;
+// 旧版索引（任务ID数组）每次读取时最多补全的摘要数
+const USER_TASK_INDEX_UPGRADE_LIMIT = 100;
+const ACTIVE_TASK_STATUSES = ['pending', 'processing'];
+
+// 获取全部任务（仅管理类接口使用，需遍历所有任务键）
+async function getTasks(env) {
+  try {
+    const keys = await listKeys(env, TASK_KEY_PREFIX);
+    const tasks = (await Promise.all(keys.map(key => getTask(env, key.slice(TASK_KEY_PREFIX.length)))))
+      .filter(Boolean);
+    
+    // 迁移完成前补上尚未迁移的旧版任务
+    const known = new Set(tasks.map(task => task.task_id));
+    const legacy = await getUnmigratedLegacyTasks(env);
+    return [...tasks, ...legacy.map(({ task }) => task).filter(task => !known.has(task.task_id))];
+  } catch (error) {
+    console.error('获取任务数据失败:', error);
+    return [];
+  }
+}
+
+async function getTask(env, taskId) {
+  try {
+    const taskData = await env.KV_NAMESPACE.get(TASK_KEY_PREFIX + taskId);
+    if (taskData) {
+      return JSON.parse(taskData);
+    }
+    
+    const legacy = await getLegacyTaskStore(env);
+    return legacy ? legacy.byId.get(taskId) || null : null;
+  } catch (error) {
+    console.error('获取任务数据失败:', error);
+    return null;
+  }
+}
+
+async function saveTask(env, task) {
+  try {
+    await env.KV_NAMESPACE.put(TASK_KEY_PREFIX + task.task_id, JSON.stringify(task));
+  } catch (error) {
+    console.error('保存任务数据失败:', error);
+  }
+}
+
+function summarizeTask(task) {
+  return {
+    id: task.task_id,
+    status: task.status,
+    created_at: task.created_at,
+    updated_at: getTaskUpdatedAt(task)
+  };
+}
+
+// 读取用户任务索引；旧版的任务ID数组逐步补全为摘要（每次最多读取 USER_TASK_INDEX_UPGRADE_LIMIT 个任务），
+// 读取方同时合并尚未迁移的旧版任务。只增删条目的写入方传 upgrade = false，只读写索引本身
+async function getUserTaskIndex(env, userId, upgrade = true) {
+  try {
+    const indexData = await env.KV_NAMESPACE.get(USER_TASKS_KEY_PREFIX + userId);
+    const entries = (indexData ? JSON.parse(indexData) : [])
+      .map(entry => typeof entry === 'string' ? { id: entry } : entry);
+    
+    const incomplete = upgrade
+      ? entries.filter(entry => !entry.status).slice(0, USER_TASK_INDEX_UPGRADE_LIMIT)
+      : [];
+    if (incomplete.length > 0) {
+      const tasks = await Promise.all(incomplete.map(entry => getTask(env, entry.id)));
+      const missing = new Set();
+      incomplete.forEach((entry, index) => {
+        if (tasks[index]) {
+          Object.assign(entry, summarizeTask(tasks[index]));
+        } else {
+          missing.add(entry.id);
+        }
+      });
+      
+      const upgraded = entries.filter(entry => !missing.has(entry.id));
+      await saveUserTaskIndex(env, userId, upgraded);
+      return await withLegacyUserTasks(env, userId, upgraded);
+    }
+    
+    return upgrade ? await withLegacyUserTasks(env, userId, entries) : entries;
+  } catch (error) {
+    console.error('获取用户任务索引失败:', error);
+    return [];
+  }
+}
+
+async function saveUserTaskIndex(env, userId, entries) {
+  try {
+    await env.KV_NAMESPACE.put(USER_TASKS_KEY_PREFIX + userId, JSON.stringify(entries));
+  } catch (error) {
+    console.error('保存用户任务索引失败:', error);
+  }
+}
+
+async function addUserTasks(env, userId, tasks) {
+  const entries = await getUserTaskIndex(env, userId, false);
+  const known = new Set(entries.map(entry => entry.id));
+  const added = tasks.filter(task => !known.has(task.task_id)).map(summarizeTask);
+  if (added.length > 0) {
+    await saveUserTaskIndex(env, userId, [...entries, ...added]);
+  }
+}
+
+// 任务状态变化后同步用户索引和全局索引中的摘要
+async function updateTaskSummaries(env, task) {
+  const entries = await getUserTaskIndex(env, task.user_id, false);
+  const index = entries.findIndex(entry => entry.id === task.task_id);
+  if (index >= 0) {
+    entries[index] = summarizeTask(task);
+    await saveUserTaskIndex(env, task.user_id, entries);
+  }
+  await putTaskIndexEntries(env, [task]);
+}
+
+// 全局任务索引：idx:tasks:{13位倒序时间戳}:{任务ID}，键名按创建时间倒序排列，
+// 元数据保存状态摘要和用户ID，分页、过滤、清理和统计重建只需 list 索引键，命中的任务才读取详情
+const TASK_INDEX_KEY_PREFIX = 'idx:tasks:';
+const MAX_INDEX_TIME = 9999999999999;
+
+function getTaskIndexKey(task) {
+  const created = Date.parse(task.created_at) || 0;
+  return `${TASK_INDEX_KEY_PREFIX}${String(MAX_INDEX_TIME - created).padStart(13, '0')}:${task.task_id}`;
+}
+
+function parseTaskIndexEntry(key) {
+  const metadata = key.metadata || {};
+  const invertedTime = parseInt(key.name.slice(TASK_INDEX_KEY_PREFIX.length, TASK_INDEX_KEY_PREFIX.length + 13), 10);
+  return {
+    id: key.name.slice(TASK_INDEX_KEY_PREFIX.length + 14),
+    user_id: metadata.user_id,
+    status: metadata.status,
+    created_at: new Date(MAX_INDEX_TIME - invertedTime).toISOString(),
+    updated_at: metadata.updated_at
+  };
+}
+
+async function putTaskIndexEntries(env, tasks) {
+  try {
+    await Promise.all(tasks.map(task => env.KV_NAMESPACE.put(getTaskIndexKey(task), '', {
+      metadata: { status: task.status, updated_at: getTaskUpdatedAt(task), user_id: task.user_id }
+    })));
+  } catch (error) {
+    console.error('保存任务索引失败:', error);
+  }
+}
+
+// 按创建时间倒序读取用户最新的任务详情，最多 limit 个
+async function getUserTasks(env, userId, limit = USER_TASK_READ_LIMIT) {
+  const entries = await getUserTaskIndex(env, userId);
+  const newest = entries.slice(-limit).reverse();
+  const tasks = await Promise.all(newest.map(entry => getTask(env, entry.id)));
+  return tasks.filter(Boolean);
+}
+
+// 删除任务并同步更新各用户的索引
+async function deleteTasks(env, tasks) {
+  const removedByUser = new Map();
+  
+  for (const task of tasks) {
+    if (!removedByUser.has(task.user_id)) {
+      removedByUser.set(task.user_id, new Set());
+    }
+    removedByUser.get(task.user_id).add(task.task_id);
+  }
+  
+  await Promise.all(tasks.flatMap(task => [
+    env.KV_NAMESPACE.delete(TASK_KEY_PREFIX + task.task_id),
+    env.KV_NAMESPACE.delete(getTaskIndexKey(task))
+  ]));
+  if (tasks.length > 0) {
+    await statsTasksDeleted(env, tasks);
+  }
+  
+  for (const [userId, removed] of removedByUser) {
+    const entries = await getUserTaskIndex(env, userId, false);
+    await saveUserTaskIndex(env, userId, entries.filter(entry => !removed.has(entry.id)));
+  }
+}
+
+// 旧版单一 tasks 数据由定时任务分段迁移（migrateLegacyTasks），迁移完成前读取接口回退到旧数据。
+// 解析结果在实例内缓存 LEGACY_STORE_TTL_MS，旧键删除后不再读取
+const LEGACY_TASKS_KEY = 'tasks';
+const TASK_MIGRATION_JOB_KEY = 'job:task_migration';
+const LEGACY_STORE_TTL_MS = 30 * 1000;
+const legacyStores = new Map();
+
+async function getLegacyStore(env, key, build) {
+  const cached = legacyStores.get(key);
+  if (cached && (cached.store === null || Date.now() - cached.loadedAt < LEGACY_STORE_TTL_MS)) {
+    return cached.store;
+  }
+  
+  try {
+    const data = await env.KV_NAMESPACE.get(key);
+    const store = data ? build(JSON.parse(data)) : null;
+    legacyStores.set(key, { store, loadedAt: Date.now() });
+    return store;
+  } catch (error) {
+    console.error('读取旧版数据失败:', error);
+    return null;
+  }
+}
+
+// 旧版任务按索引键排序（即创建时间倒序），迁移从最新的任务开始，
+// 未迁移的任务总是早于已迁移的任务，分页时排在索引之后
+function buildLegacyTaskStore(tasks) {
+  const byId = new Map();
+  const byUser = new Map();
+  
+  for (const task of tasks) {
+    byId.set(task.task_id, task);
+    if (!byUser.has(task.user_id)) {
+      byUser.set(task.user_id, []);
+    }
+    byUser.get(task.user_id).push(task);
+  }
+  for (const userTasks of byUser.values()) {
+    userTasks.sort((a, b) => new Date(a.created_at) - new Date(b.created_at));
+  }
+  
+  const ordered = tasks
+    .map(task => ({ key: getTaskIndexKey(task), task }))
+    .sort((a, b) => (a.key < b.key ? -1 : 1));
+  return { byId, byUser, ordered };
+}
+
+async function getLegacyTaskStore(env) {
+  return await getLegacyStore(env, LEGACY_TASKS_KEY, buildLegacyTaskStore);
+}
+
+// 尚未迁移的旧版任务（[{ key, task }]，按索引键排序）
+async function getUnmigratedLegacyTasks(env) {
+  const store = await getLegacyTaskStore(env);
+  if (!store) {
+    return [];
+  }
+  
+  const jobData = await env.KV_NAMESPACE.get(TASK_MIGRATION_JOB_KEY);
+  const done = jobData ? JSON.parse(jobData).done || 0 : 0;
+  return store.ordered.slice(done);
+}
+
+// 用户索引之外的旧版任务摘要排在前面（旧版任务早于已有任务）
+async function withLegacyUserTasks(env, userId, entries) {
+  const store = await getLegacyTaskStore(env);
+  const legacyTasks = store ? store.byUser.get(userId) || [] : [];
+  if (legacyTasks.length === 0) {
+    return entries;
+  }
+  
+  const known = new Set(entries.map(entry => entry.id));
+  return [
+    ...legacyTasks.filter(task => !known.has(task.task_id)).map(summarizeTask),
+    ...entries
+  ];
+}
+
+// 每个任务：检查是否已有新版数据1次，写入任务和索引键各1次；每个用户合并索引2次。
+// 已有新版数据的任务（迁移期间被更新过）只合并索引，不覆盖
+async function migrateLegacyTasks(budget) {
+  const env = budget.env;
+  const legacyData = await env.KV_NAMESPACE.get(LEGACY_TASKS_KEY);
+  if (!legacyData) {
+    return { migrated: 0, complete: true };
+  }
+  
+  const { ordered } = buildLegacyTaskStore(JSON.parse(legacyData));
+  const jobData = await env.KV_NAMESPACE.get(TASK_MIGRATION_JOB_KEY);
+  let done = jobData ? JSON.parse(jobData).done || 0 : 0;
+  const tasksByUser = new Map();
+  let migrated = 0;
+  
+  while (done < ordered.length) {
+    const { task } = ordered[done];
+    const users = tasksByUser.size + (tasksByUser.has(task.user_id) ? 0 : 1);
+    if (budget.remaining() - CRON_BUDGET_RESERVE < 3 + users * 2) {
+      break;
+    }
+    
+    const currentData = await env.KV_NAMESPACE.get(TASK_KEY_PREFIX + task.task_id);
+    const current = currentData ? JSON.parse(currentData) : null;
+    if (!current) {
+      await saveTask(env, task);
+      await putTaskIndexEntries(env, [task]);
+      migrated++;
+    }
+    if (!tasksByUser.has(task.user_id)) {
+      tasksByUser.set(task.user_id, []);
+    }
+    tasksByUser.get(task.user_id).push(current || task);
+    done++;
+  }
+  
+  // 本批任务早于用户索引中已有的任务（包括之前批次迁移的），排在索引前面
+  for (const [userId, userTasks] of tasksByUser) {
+    userTasks.sort((a, b) => new Date(a.created_at) - new Date(b.created_at));
+    const migratedIds = new Set(userTasks.map(task => task.task_id));
+    const existing = await getUserTaskIndex(env, userId, false);
+    await saveUserTaskIndex(env, userId, [
+      ...userTasks.map(summarizeTask),
+      ...existing.filter(entry => !migratedIds.has(entry.id))
+    ]);
+  }
+  
+  const complete = done >= ordered.length;
+  if (complete) {
+    await env.KV_NAMESPACE.delete(LEGACY_TASKS_KEY);
+    await env.KV_NAMESPACE.delete(TASK_MIGRATION_JOB_KEY);
+    await requestStatsRebuild(env);
+    legacyStores.delete(LEGACY_TASKS_KEY);
+    console.log(`已迁移 ${ordered.length} 个旧版任务`);
+  } else {
+    await env.KV_NAMESPACE.put(TASK_MIGRATION_JOB_KEY, JSON.stringify({ done }));
+  }
+  
+  return { migrated, remaining: ordered.length - done, complete };
+}
+
+// 许可证按 license:{key} 存储，user_licenses:{user_id} 保存用户的激活码列表
+const LICENSE_KEY_PREFIX = 'license:';
+const USER_LICENSES_KEY_PREFIX = 'user_licenses:';
+
+// 获取全部许可证（仅管理类接口使用），迁移完成前补上尚未迁移的旧版许可证
+async function getLicenses(env) {
+  try {
+    const keys = await listKeys(env, LICENSE_KEY_PREFIX);
+    const licenses = (await Promise.all(keys.map(key => getLicense(env, key.slice(LICENSE_KEY_PREFIX.length)))))
+      .filter(Boolean);
+    
+    const legacy = await getLegacyLicenseStore(env);
+    const known = new Set(licenses.map(license => license.license_key));
+    return legacy
+      ? [...licenses, ...legacy.licenses.filter(license => !known.has(license.license_key))]
+      : licenses;
+  } catch (error) {
+    console.error('获取许可证数据失败:', error);
+    return [];
+  }
+}
+
+async function getLicense(env, licenseKey) {
+  try {
+    const licenseData = await env.KV_NAMESPACE.get(LICENSE_KEY_PREFIX + licenseKey);
+    if (licenseData) {
+      return JSON.parse(licenseData);
+    }
+    
+    const legacy = await getLegacyLicenseStore(env);
+    return legacy ? legacy.byKey.get(licenseKey) || null : null;
+  } catch (error) {
+    console.error('获取许可证数据失败:', error);
+    return null;
+  }
+}
+
+async function saveLicense(env, license) {
+  try {
+    await env.KV_NAMESPACE.put(LICENSE_KEY_PREFIX + license.license_key, JSON.stringify(license));
+  } catch (error) {
+    console.error('保存许可证数据失败:', error);
+  }
+}
+
+async function getUserLicenses(env, userId) {
+  try {
+    const indexData = await env.KV_NAMESPACE.get(USER_LICENSES_KEY_PREFIX + userId);
+    const legacy = await getLegacyLicenseStore(env);
+    const licenseKeys = [...new Set([
+      ...(indexData ? JSON.parse(indexData) : []),
+      ...(legacy ? legacy.byUser.get(userId) || [] : [])
+    ])];
+    const licenses = await Promise.all(licenseKeys.map(key => getLicense(env, key)));
+    return licenses.filter(Boolean);
+  } catch (error) {
+    console.error('获取用户许可证失败:', error);
+    return [];
+  }
+}
+
+async function addUserLicenseKeys(env, userId, licenseKeys) {
+  try {
+    const indexData = await env.KV_NAMESPACE.get(USER_LICENSES_KEY_PREFIX + userId);
+    const existing = indexData ? JSON.parse(indexData) : [];
+    const merged = [...new Set([...existing, ...licenseKeys])];
+    await env.KV_NAMESPACE.put(USER_LICENSES_KEY_PREFIX + userId, JSON.stringify(merged));
+  } catch (error) {
+    console.error('保存用户许可证索引失败:', error);
+  }
+}
+
+// 尚无任何账户数据时写入默认用户和许可证，保持与旧版相同的初始行为（每个实例只检查一次）
+let accountStorageReady = false;
+
+async function ensureAccountStorage(env) {
+  if (accountStorageReady) {
+    return;
+  }
+  
+  try {
+    const [legacyUsers, legacyLicenses, userPage, licensePage] = await Promise.all([
+      env.KV_NAMESPACE.get(LEGACY_USERS_KEY),
+      env.KV_NAMESPACE.get(LEGACY_LICENSES_KEY),
+      env.KV_NAMESPACE.list({ prefix: USER_KEY_PREFIX, limit: 1 }),
+      env.KV_NAMESPACE.list({ prefix: LICENSE_KEY_PREFIX, limit: 1 })
+    ]);
+    
+    const users = !legacyUsers && userPage.keys.length === 0 ? getDefaultUsers() : [];
+    const licenses = !legacyLicenses && licensePage.keys.length === 0 ? getDefaultLicenses() : [];
+    
+    for (const user of users) {
+      await saveUser(env, user);
+      await indexUser(env, user);
+    }
+    for (const license of licenses) {
+      await saveLicense(env, license);
+      await addUserLicenseKeys(env, license.user_id, [license.license_key]);
+    }
+    
+    if (users.length > 0 || licenses.length > 0) {
+      // 账户数据变化后统计需要重建
+      await requestStatsRebuild(env);
+    }
+    
+    accountStorageReady = true;
+  } catch (error) {
+    console.error('初始化账户数据失败:', error);
+  }
+}
+
+// 旧版 users / licenses 数据由定时任务分段迁移（migrateLegacyAccounts），迁移完成前读取接口回退到旧数据
+const LEGACY_USERS_KEY = 'users';
+const LEGACY_LICENSES_KEY = 'licenses';
+const ACCOUNT_MIGRATION_JOB_KEY = 'job:account_migration';
+
+function buildLegacyUserStore(users) {
+  return {
+    users,
+    byId: new Map(users.map(user => [user.id, user])),
+    byName: new Map(users.map(user => [user.username, user])),
+    byEmail: new Map(users.map(user => [user.email, user]))
+  };
+}
+
+function buildLegacyLicenseStore(licenses) {
+  const byUser = new Map();
+  for (const license of licenses) {
+    if (!license.user_id) {
+      continue;
+    }
+    if (!byUser.has(license.user_id)) {
+      byUser.set(license.user_id, []);
+    }
+    byUser.get(license.user_id).push(license.license_key);
+  }
+  
+  return { licenses, byKey: new Map(licenses.map(license => [license.license_key, license])), byUser };
+}
+
+async function getLegacyUserStore(env) {
+  return await getLegacyStore(env, LEGACY_USERS_KEY, buildLegacyUserStore);
+}
+
+async function getLegacyLicenseStore(env) {
+  return await getLegacyStore(env, LEGACY_LICENSES_KEY, buildLegacyLicenseStore);
+}
+
+// 每个用户：检查是否已有新版数据1次，写入用户和两个索引各1次；每个许可证：检查1次、写入1次，
+// 每个用户合并许可证索引2次。已有新版数据的用户/许可证（迁移期间被更新过）不覆盖
+async function migrateLegacyAccounts(budget) {
+  const env = budget.env;
+  const [usersData, licensesData] = await Promise.all([
+    env.KV_NAMESPACE.get(LEGACY_USERS_KEY),
+    env.KV_NAMESPACE.get(LEGACY_LICENSES_KEY)
+  ]);
+  if (!usersData && !licensesData) {
+    return { migrated: 0, complete: true };
+  }
+  
+  const users = usersData ? JSON.parse(usersData) : [];
+  const licenses = licensesData ? JSON.parse(licensesData) : [];
+  const jobData = await env.KV_NAMESPACE.get(ACCOUNT_MIGRATION_JOB_KEY);
+  const job = jobData ? JSON.parse(jobData) : { users: 0, licenses: 0 };
+  let migrated = 0;
+  
+  while (job.users < users.length && budget.remaining() - CRON_BUDGET_RESERVE >= 4) {
+    const user = users[job.users];
+    if (!await env.KV_NAMESPACE.get(USER_KEY_PREFIX + user.id)) {
+      await saveUser(env, user);
+      migrated++;
+    }
+    await indexUser(env, user);
+    job.users++;
+  }
+  
+  const keysByUser = new Map();
+  while (job.users >= users.length && job.licenses < licenses.length) {
+    const license = licenses[job.licenses];
+    const owners = keysByUser.size + (license.user_id && !keysByUser.has(license.user_id) ? 1 : 0);
+    if (budget.remaining() - CRON_BUDGET_RESERVE < 2 + owners * 2) {
+      break;
+    }
+    
+    if (!await env.KV_NAMESPACE.get(LICENSE_KEY_PREFIX + license.license_key)) {
+      await saveLicense(env, license);
+      migrated++;
+    }
+    if (license.user_id) {
+      if (!keysByUser.has(license.user_id)) {
+        keysByUser.set(license.user_id, []);
+      }
+      keysByUser.get(license.user_id).push(license.license_key);
+    }
+    job.licenses++;
+  }
+  
+  for (const [userId, licenseKeys] of keysByUser) {
+    await addUserLicenseKeys(env, userId, licenseKeys);
+  }
+  
+  const usersDone = job.users >= users.length;
+  const complete = usersDone && job.licenses >= licenses.length;
+  if (usersDone && usersData) {
+    await env.KV_NAMESPACE.delete(LEGACY_USERS_KEY);
+    legacyStores.delete(LEGACY_USERS_KEY);
+  }
+  if (complete) {
+    if (licensesData) {
+      await env.KV_NAMESPACE.delete(LEGACY_LICENSES_KEY);
+      legacyStores.delete(LEGACY_LICENSES_KEY);
+    }
+    await env.KV_NAMESPACE.delete(ACCOUNT_MIGRATION_JOB_KEY);
+    await requestStatsRebuild(env);
+    console.log(`已迁移 ${users.length} 个旧版用户和 ${licenses.length} 个旧版许可证`);
+  } else {
+    await env.KV_NAMESPACE.put(ACCOUNT_MIGRATION_JOB_KEY, JSON.stringify(job));
+  }
+  
+  return { migrated, complete };
+}
+
+// 先迁移账户（登录和激活码验证依赖），剩余预算迁移任务
+async function migrateLegacyStorage(budget) {
+  const accounts = await migrateLegacyAccounts(budget);
+  const tasks = await migrateLegacyTasks(budget);
+  return { accounts, tasks, complete: accounts.complete && tasks.complete };
+}
+
+// 日志按小时分片追加写入：logs:{yyyy-mm-dd-hh}:{毫秒时间戳}-{随机串}
+// 每条日志一个键，写入无需读取，同一小时内的键按时间排序；
+// 较小的日志同时写入元数据，list 即可读到内容，无需逐条读取
+const LOG_KEY_PREFIX = 'logs:';
+const LEGACY_LOGS_KEY = 'logs';
+const HOUR_MS = 60 * 60 * 1000;
+const LOG_METADATA_MAX_LENGTH = 1000;
+// 单次查询日志最多的KV操作数，用完时返回已读到的日志和游标
+const LOG_READ_BUDGET = 300;
+
+function getLogRetentionHours(env) {
+  return parseInt(env.LOG_RETENTION_HOURS || '168', 10);
+}
+
+function getHourBucket(time) {
+  return new Date(time).toISOString().slice(0, 13).replace('T', '-');
+}
+
+function getHourBucketTime(bucket) {
+  const [year, month, day, hour] = bucket.split('-');
+  return Date.UTC(parseInt(year, 10), parseInt(month, 10) - 1, parseInt(day, 10), parseInt(hour, 10));
+}
+
+// 分页读取日志，最新的在前面；cursor 为上一页最后读到的日志键，
+// 操作预算用完时为下一个待读取位置（logs:{小时}:~ 表示从该小时的最新一条开始）
+async function getLogs(env, limit = 1000, cursor = null) {
+  const logs = [];
+  let ops = 0;
+  
+  try {
+    const oldest = Date.now() - getLogRetentionHours(env) * HOUR_MS;
+    let bucketTime = cursor ? getHourBucketTime(cursor.slice(LOG_KEY_PREFIX.length).split(':')[0]) : Date.now();
+    let nextCursor = null;
+    
+    while (logs.length < limit && bucketTime >= oldest - HOUR_MS) {
+      const bucket = getHourBucket(bucketTime);
+      const prefix = `${LOG_KEY_PREFIX}${bucket}:`;
+      const resume = cursor && cursor.startsWith(prefix) ? cursor : `${prefix}~`;
+      
+      if (ops >= LOG_READ_BUDGET) {
+        // 预算用完：下次从当前位置继续
+        nextCursor = resume;
+        break;
+      }
+      
+      const keys = [];
+      let listCursor;
+      do {
+        const page = await env.KV_NAMESPACE.list({ prefix, cursor: listCursor });
+        ops += 1;
+        keys.push(...page.keys);
+        listCursor = page.list_complete ? null : page.cursor;
+      } while (listCursor);
+      
+      keys.reverse();
+      const pending = keys
+        .filter(key => !cursor || key.name < cursor)
+        .slice(0, limit - logs.length);
+      
+      // 没有元数据的日志需单独读取，受剩余预算限制
+      let readable = pending.length;
+      let gets = 0;
+      for (let i = 0; i < pending.length; i++) {
+        if (!pending[i].metadata && ++gets > LOG_READ_BUDGET - ops) {
+          readable = i;
+          break;
+        }
+      }
+      
+      const batch = pending.slice(0, readable);
+      const entries = await Promise.all(batch.map(key => key.metadata
+        ? key.metadata
+        : env.KV_NAMESPACE.get(key.name).then(value => (value ? JSON.parse(value) : null))));
+      ops += batch.filter(key => !key.metadata).length;
+      
+      nextCursor = resume;
+      entries.forEach((entry, index) => {
+        if (entry) {
+          logs.push(entry);
+        }
+        nextCursor = batch[index].name;
+      });
+      
+      if (readable < pending.length || logs.length >= limit) {
+        break;
+      }
+      
+      nextCursor = null;
+      bucketTime -= HOUR_MS;
+    }
+    
+    return { logs, cursor: nextCursor };
+  } catch (error) {
+    console.error('获取日志失败:', error);
+    return { logs, cursor: null };
+  }
+}
+
+async function logEvent(env, type, data) {
+  try {
+    const now = Date.now();
+    const logEntry = {
+      id: generateId('log'),
+      type,
+      data,
+      timestamp: new Date(now).toISOString(),
+      ip: 'system'
+    };
     
-    // 限制日志数量
-    if (logs.length > 2000) {
-      logs.splice(0, logs.length - 2000);
+    await putLogEntry(env, logEntry, now, getLogRetentionHours(env) * 3600);
+  } catch (error) {
+    console.error('记录日志失败:', error);
+  }
+}
+
+async function putLogEntry(env, logEntry, time, ttl) {
+  const value = JSON.stringify(logEntry);
+  const seq = `${String(time).padStart(13, '0')}-${Math.random().toString(36).substr(2, 6)}`;
+  await env.KV_NAMESPACE.put(`${LOG_KEY_PREFIX}${getHourBucket(time)}:${seq}`, value, {
+    expirationTtl: ttl,
+    ...(value.length <= LOG_METADATA_MAX_LENGTH ? { metadata: logEntry } : {})
+  });
+}
+
+// 删除超出保留期的日志分片（检查保留期之前的24个小时分片），并把旧版的单一 logs 数据迁移到小时分片；
+// 传入 budget 时受操作预算限制，未完成的部分下次继续
+async function compactLogs(env, budget = null) {
+  const target = budget ? budget.env : env;
+  const kv = target.KV_NAMESPACE;
+  const remaining = () => (budget ? budget.remaining() - CRON_BUDGET_RESERVE : Infinity);
+  let removed = 0;
+  
+  try {
+    const cutoff = Date.now() - getLogRetentionHours(env) * HOUR_MS;
+    
+    for (let hour = 1; hour <= 24 && remaining() > 1; hour++) {
+      const bucket = getHourBucket(cutoff - hour * HOUR_MS);
+      const page = await kv.list({ prefix: `${LOG_KEY_PREFIX}${bucket}:` });
+      const keys = page.keys.map(key => key.name).slice(0, Math.max(0, remaining()));
+      await Promise.all(keys.map(key => kv.delete(key)));
+      removed += keys.length;
     }
     
-    await saveLogs(env, logs);
+    if (remaining() > 2) {
+      await migrateLegacyLogs(target, remaining() - 2);
+    }
   } catch (error) {
-    console.error('记录日志失败:', error);
+    console.error('清理日志失败:', error);
+  }
+  
+  return removed;
+}
+
+// 旧版日志为单一数组（按时间正序），从最新的开始按原时间写入小时分片，
+// 每次最多写入 maxWrites 条，剩余部分写回旧键，全部迁移后删除
+async function migrateLegacyLogs(env, maxWrites) {
+  const kv = env.KV_NAMESPACE;
+  const legacyData = await kv.get(LEGACY_LOGS_KEY);
+  if (!legacyData) {
+    return 0;
+  }
+  
+  const legacyLogs = JSON.parse(legacyData);
+  const retentionMs = getLogRetentionHours(env) * HOUR_MS;
+  const batch = legacyLogs.splice(Math.max(0, legacyLogs.length - maxWrites));
+  
+  await Promise.all(batch.map(logEntry => {
+    const time = Date.parse(logEntry.timestamp) || Date.now();
+    const ttl = Math.floor((time + retentionMs - Date.now()) / 1000);
+    // 已超出保留期的日志不再迁移（expirationTtl 最短60秒）
+    return ttl >= 60 ? putLogEntry(env, logEntry, time, ttl) : null;
+  }));
+  
+  if (legacyLogs.length > 0) {
+    await kv.put(LEGACY_LOGS_KEY, JSON.stringify(legacyLogs));
+  } else {
+    await kv.delete(LEGACY_LOGS_KEY);
   }
+  return batch.length;
 }
 
 async function sendNotification(env, type, data) {
@@ -1133,6 +3140,342 @@ async function sendNotification(env, type, data) {
   await logEvent(env, `notification_${type}`, data);
 }
 
+// ========== 统计计数 ==========
+// stats 键保存定时任务合并后的基准计数；请求中的增量先累加在实例内存里，
+// 再整体覆盖写入本实例当前小时的分片 stats:shard:{yyyy-mm-dd-hh}:{实例ID}（每个分片每秒最多写一次），
+// 读取时基准加上 folded_through 之后的全部分片。分片互不争用，不会因并发读改写丢失增量；
+// 实例回收前未写出的尾部增量仍可能丢失，由每日的 rebuildStats 全量校正
+const STATS_KEY = 'stats';
+const STATS_SHARD_PREFIX = 'stats:shard:';
+const STATS_REBUILD_KEY = 'stats_rebuild_requested';
+const STATS_FLUSH_INTERVAL_MS = 1000;
+// 读取/合并分片时最多的 list 调用次数（每次最多1000个分片）
+const STATS_MAX_LIST_CALLS = 5;
+// 分片小于此长度时同时写入元数据，list 即可读到内容
+const STATS_METADATA_MAX_LENGTH = 1000;
+
+let statsShard = null;
+
+function createEmptyStats() {
+  return {
+    total_users: 0,
+    active_users: 0,
+    total_tasks: 0,
+    task_status: {},
+    total_licenses: 0,
+    license_expiries: {}, // expires_at -> [有效数量, 总数量]
+    tasks_by_hour: {}, // yyyy-mm-dd-hh -> 新建任务数
+    rebuilt_at: null,
+    folded_through: null // 已合并进基准的最后一个小时分片
+  };
+}
+
+function mergeStats(counters, delta, sign = 1) {
+  for (const field of ['total_users', 'active_users', 'total_tasks', 'total_licenses']) {
+    counters[field] += sign * (delta[field] || 0);
+  }
+  for (const [status, count] of Object.entries(delta.task_status || {})) {
+    counters.task_status[status] = (counters.task_status[status] || 0) + sign * count;
+  }
+  for (const [bucket, count] of Object.entries(delta.tasks_by_hour || {})) {
+    counters.tasks_by_hour[bucket] = (counters.tasks_by_hour[bucket] || 0) + sign * count;
+  }
+  for (const [expiresAt, [active, total]] of Object.entries(delta.license_expiries || {})) {
+    const entry = counters.license_expiries[expiresAt] || [0, 0];
+    counters.license_expiries[expiresAt] = [entry[0] + sign * active, entry[1] + sign * total];
+  }
+}
+
+// 只保留最近25小时的分桶，状态计数不小于0
+function normalizeStats(counters) {
+  const cutoff = Date.now() - 25 * HOUR_MS;
+  for (const bucket of Object.keys(counters.tasks_by_hour)) {
+    if (getHourBucketTime(bucket) < cutoff) {
+      delete counters.tasks_by_hour[bucket];
+    }
+  }
+  for (const status of Object.keys(counters.task_status)) {
+    counters.task_status[status] = Math.max(0, counters.task_status[status]);
+  }
+  return counters;
+}
+
+async function getStatsBase(env) {
+  const statsData = await env.KV_NAMESPACE.get(STATS_KEY);
+  return statsData ? { ...createEmptyStats(), ...JSON.parse(statsData) } : createEmptyStats();
+}
+
+// 列出 after 之后的小时分片；complete 为 false 表示超出 list 次数上限未读完
+async function listStatsShards(env, after) {
+  const shards = [];
+  let cursor = null;
+  let complete = false;
+  
+  for (let calls = 0; calls < STATS_MAX_LIST_CALLS; calls++) {
+    const page = await env.KV_NAMESPACE.list({ prefix: STATS_SHARD_PREFIX, cursor: cursor || undefined });
+    for (const key of page.keys) {
+      const bucket = key.name.slice(STATS_SHARD_PREFIX.length).split(':')[0];
+      if (after && bucket <= after) {
+        continue;
+      }
+      
+      let delta = key.metadata;
+      if (!delta) {
+        const value = await env.KV_NAMESPACE.get(key.name);
+        delta = value ? JSON.parse(value) : null;
+      }
+      if (delta) {
+        shards.push({ name: key.name, bucket, delta });
+      }
+    }
+    
+    if (page.list_complete) {
+      complete = true;
+      break;
+    }
+    cursor = page.cursor;
+  }
+  
+  return { shards, complete };
+}
+
+// 汇总 after 之后的全部分片，本实例的分片以内存中的最新值为准
+async function sumStatsShards(env, after) {
+  const total = createEmptyStats();
+  const { shards } = await listStatsShards(env, after);
+  const ownKey = statsShard ? getStatsShardKey(statsShard) : null;
+  
+  for (const shard of shards) {
+    if (shard.name !== ownKey) {
+      mergeStats(total, shard.delta);
+    }
+  }
+  if (statsShard && !(after && statsShard.bucket <= after)) {
+    mergeStats(total, statsShard.counters);
+  }
+  return total;
+}
+
+// 读取计数：基准加各实例的分片；不在请求中全量重建
+async function getStatsCounters(env) {
+  const counters = await getStatsBase(env);
+  
+  try {
+    mergeStats(counters, await sumStatsShards(env, counters.folded_through));
+  } catch (error) {
+    console.error('获取统计计数失败:', error);
+  }
+  
+  return normalizeStats(counters);
+}
+
+function getStatsShardKey(shard) {
+  return `${STATS_SHARD_PREFIX}${shard.bucket}:${shard.id}`;
+}
+
+async function flushStatsShard(env, shard) {
+  if (shard.timer) {
+    clearTimeout(shard.timer);
+    shard.timer = null;
+  }
+  shard.flushedAt = Date.now();
+  shard.dirty = false;
+  
+  const value = JSON.stringify(shard.counters);
+  await env.KV_NAMESPACE.put(getStatsShardKey(shard), value,
+    value.length <= STATS_METADATA_MAX_LENGTH ? { metadata: shard.counters } : undefined);
+}
+
+async function updateStats(env, mutate) {
+  try {
+    const now = Date.now();
+    const bucket = getHourBucket(now);
+    
+    if (!statsShard || statsShard.bucket !== bucket) {
+      // 进入新的小时：先写出上一小时的分片
+      if (statsShard && statsShard.dirty) {
+        await flushStatsShard(env, statsShard);
+      }
+      statsShard = {
+        id: statsShard ? statsShard.id : generateId('isolate'),
+        bucket,
+        counters: createEmptyStats(),
+        flushedAt: 0,
+        dirty: false,
+        timer: null
+      };
+    }
+    
+    const shard = statsShard;
+    mutate(shard.counters);
+    shard.dirty = true;
+    
+    const wait = shard.flushedAt + STATS_FLUSH_INTERVAL_MS - now;
+    if (wait <= 0) {
+      await flushStatsShard(env, shard);
+    } else if (!shard.timer) {
+      // 距上次写入不足1秒：延后写出，期间的增量合并为一次写入
+      shard.timer = setTimeout(() => {
+        shard.timer = null;
+        if (shard.dirty) {
+          flushStatsShard(env, shard).catch(error => console.error('写入统计分片失败:', error));
+        }
+      }, wait);
+    }
+  } catch (error) {
+    console.error('更新统计计数失败:', error);
+  }
+}
+
+// 定时任务：把已结束的小时分片（上一小时之前）合并进基准并删除，删除数受操作预算限制
+async function compactStats(budget) {
+  const env = budget.env;
+  const counters = await getStatsBase(env);
+  const foldBefore = getHourBucket(Date.now() - HOUR_MS);
+  const { shards, complete } = await listStatsShards(env, counters.folded_through);
+  let folded = shards.filter(shard => shard.bucket < foldBefore);
+  
+  if (!complete && folded.length > 0) {
+    // 未读完时最后一个小时的分片可能不全，留到下次
+    const lastBucket = folded[folded.length - 1].bucket;
+    folded = folded.filter(shard => shard.bucket < lastBucket);
+  }
+  
+  if (folded.length > 0) {
+    folded.forEach(shard => mergeStats(counters, shard.delta));
+    counters.folded_through = folded[folded.length - 1].bucket;
+    await env.KV_NAMESPACE.put(STATS_KEY, JSON.stringify(normalizeStats(counters)));
+  }
+  
+  // 删除已合并（含重建前）的分片，未删完的下次继续（读取时按 folded_through 跳过）
+  let removed = 0;
+  const limit = Math.min(1000, budget.remaining() - CRON_BUDGET_RESERVE - 1);
+  if (counters.folded_through && limit > 0) {
+    const page = await env.KV_NAMESPACE.list({ prefix: STATS_SHARD_PREFIX, limit });
+    const stale = page.keys.map(key => key.name)
+      .filter(name => name.slice(STATS_SHARD_PREFIX.length).split(':')[0] <= counters.folded_through)
+      .slice(0, budget.remaining() - CRON_BUDGET_RESERVE);
+    await Promise.all(stale.map(name => env.KV_NAMESPACE.delete(name)));
+    removed = stale.length;
+  }
+  
+  return { folded: folded.length, removed };
+}
+
+// 管理接口和数据迁移只登记重建请求，由定时任务执行全量重建
+async function requestStatsRebuild(env) {
+  await env.KV_NAMESPACE.put(STATS_REBUILD_KEY, new Date().toISOString());
+}
+
+function countTask(counters, task, delta) {
+  counters.total_tasks += delta;
+  counters.task_status[task.status] = (counters.task_status[task.status] || 0) + delta;
+  
+  const bucket = getHourBucket(task.created_at);
+  if (Date.now() - getHourBucketTime(bucket) < 25 * HOUR_MS) {
+    counters.tasks_by_hour[bucket] = (counters.tasks_by_hour[bucket] || 0) + delta;
+  }
+}
+
+function countUser(counters, user, delta) {
+  counters.total_users += delta;
+  if (user.is_active) {
+    counters.active_users += delta;
+  }
+}
+
+function countLicense(counters, license, delta) {
+  counters.total_licenses += delta;
+  const entry = counters.license_expiries[license.expires_at] || [0, 0];
+  entry[0] += license.is_active ? delta : 0;
+  entry[1] += delta;
+  counters.license_expiries[license.expires_at] = entry;
+}
+
+async function statsTaskCreated(env, task) {
+  await updateStats(env, counters => countTask(counters, task, 1));
+}
+
+async function statsTaskStatusChanged(env, fromStatus, toStatus) {
+  await updateStats(env, counters => {
+    counters.task_status[fromStatus] = (counters.task_status[fromStatus] || 0) - 1;
+    counters.task_status[toStatus] = (counters.task_status[toStatus] || 0) + 1;
+  });
+}
+
+async function statsTasksDeleted(env, tasks) {
+  await updateStats(env, counters => tasks.forEach(task => countTask(counters, task, -1)));
+}
+
+async function statsUserCreated(env, user) {
+  await updateStats(env, counters => countUser(counters, user, 1));
+}
+
+// 全量扫描重建计数器（只由定时任务调用），按操作预算分段执行，进度和部分计数保存在 job:stats_rebuild 中。
+// 任务索引补写完成后只需 list 索引键（元数据含状态，键名含创建时间），否则逐个读取任务。
+// 上一小时之后的分片仍在累加：基准减去开始时这些分片的值，之后的增量照常叠加；
+// 重建期间不合并分片，扫描期间的变更可能被重复计入
+async function rebuildStats(budget, job) {
+  const env = budget.env;
+  
+  if (!job) {
+    const foldedThrough = getHourBucket(Date.now() - 2 * HOUR_MS);
+    job = {
+      started_at: new Date().toISOString(),
+      section: 0,
+      cursor: null,
+      use_index: Boolean(await env.KV_NAMESPACE.get(TASK_INDEX_READY_KEY)),
+      folded_through: foldedThrough,
+      pending: await sumStatsShards(env, foldedThrough),
+      counters: createEmptyStats()
+    };
+  }
+  
+  const sections = ['users', 'tasks', 'licenses'];
+  const counters = job.counters;
+  
+  while (job.section < sections.length) {
+    const section = sections[job.section];
+    const available = budget.remaining() - CRON_BUDGET_RESERVE;
+    if (available < 2) {
+      break;
+    }
+    
+    let cursor;
+    if (section === 'tasks' && job.use_index) {
+      const page = await env.KV_NAMESPACE.list({ prefix: TASK_INDEX_KEY_PREFIX, cursor: job.cursor || undefined });
+      page.keys.map(parseTaskIndexEntry).forEach(entry => countTask(counters, entry, 1));
+      cursor = page.list_complete ? null : page.cursor;
+    } else {
+      const prefix = { users: USER_KEY_PREFIX, tasks: TASK_KEY_PREFIX, licenses: LICENSE_KEY_PREFIX }[section];
+      const page = await listKeysPage(env, prefix, job.cursor, Math.min(CLEANUP_PAGE_SIZE, available - 1));
+      const values = await Promise.all(page.keys.map(key => env.KV_NAMESPACE.get(key)));
+      const count = { users: countUser, tasks: countTask, licenses: countLicense }[section];
+      values.filter(Boolean).forEach(value => count(counters, JSON.parse(value), 1));
+      cursor = page.cursor;
+    }
+    
+    job.cursor = cursor;
+    if (!cursor) {
+      job.section += 1;
+    }
+  }
+  
+  if (job.section < sections.length) {
+    await env.KV_NAMESPACE.put(STATS_REBUILD_JOB_KEY, JSON.stringify(job));
+    return { complete: false, section: sections[job.section] };
+  }
+  
+  mergeStats(counters, job.pending, -1);
+  counters.rebuilt_at = new Date().toISOString();
+  counters.folded_through = job.folded_through;
+  
+  await env.KV_NAMESPACE.put(STATS_KEY, JSON.stringify(counters));
+  await env.KV_NAMESPACE.delete(STATS_REBUILD_JOB_KEY);
+  await env.KV_NAMESPACE.delete(STATS_REBUILD_KEY);
+  return { complete: true, rebuilt_at: counters.rebuilt_at };
+}
+
 // ========== 默认数据 ==========
 function getDefaultUsers() {
   return [
@@ -1202,19 +3545,425 @@ function getDefaultLicenses() {
 }
 
 // ========== 工具函数 ==========
+// 列出指定前缀的全部键（自动翻页）
+async function listKeys(env, prefix) {
+  const keys = [];
+  let cursor;
+  
+  do {
+    const page = await env.KV_NAMESPACE.list({ prefix, cursor });
+    keys.push(...page.keys.map(k => k.name));
+    cursor = page.list_complete ? null : page.cursor;
+  } while (cursor);
+  
+  return keys;
+}
+
 function generateId(prefix = 'id') {
   const timestamp = Date.now().toString(36);
   const random = Math.random().toString(36).substr(2, 9);
   return `${prefix}_${timestamp}_${random}`;
 }
 
+function buildTaskStatus(task) {
+  return {
+    task_id: task.task_id,
+    status: task.status,
+    progress: task.progress,
+    started_at: task.started_at,
+    completed_at: task.completed_at,
+    updated_at: getTaskUpdatedAt(task),
+    downloaded_count: task.downloaded_files ? task.downloaded_files.length : 0
+  };
+}
+
+// 下载链接使用创建任务时的访问域名（本地 wrangler dev 下也可直接下载）
+function getTaskBaseUrl(task) {
+  return task.base_url || 'https://xuke.ambition.qzz.io';
+}
+
+// 任务每次变更都刷新 updated_at，供增量同步使用
+function touchTask(task) {
+  task.updated_at = new Date().toISOString();
+}
+
+function getTaskUpdatedAt(task) {
+  return task.updated_at || task.completed_at || task.started_at || task.created_at || '';
+}
+
+// 令牌桶保存在实例内存中：KV 单键每秒只能写一次，不适合按请求计数
+const rateLimitBuckets = new Map();
+const RATE_LIMIT_MAX_BUCKETS = 10000;
+const RATE_LIMIT_EXEMPT_PATHS = ['/', '/index.html', '/api/ping'];
+
+function checkRateLimit(request, env) {
+  if (env.ENABLE_RATE_LIMIT !== 'true' || request.method === 'OPTIONS') {
+    return null;
+  }
+  
+  if (RATE_LIMIT_EXEMPT_PATHS.includes(new URL(request.url).pathname)) {
+    return null;
+  }
+  
+  const limit = parseInt(env.RATE_LIMIT_REQUESTS || '120', 10);
+  const period = parseInt(env.RATE_LIMIT_PERIOD || '60', 10);
+  const refillPerMs = limit / (period * 1000);
+  const now = Date.now();
+  
+  // 按客户端IP+用户计数：IP 由 Cloudflare 填写，客户端自报的设备ID可随意更换，不参与计数
+  const key = `${request.headers.get('CF-Connecting-IP') || 'unknown'}:${request.headers.get('X-User-ID') || '-'}`;
+  
+  let bucket = rateLimitBuckets.get(key);
+  if (!bucket) {
+    if (rateLimitBuckets.size >= RATE_LIMIT_MAX_BUCKETS) {
+      pruneRateLimitBuckets(now, limit, refillPerMs);
+    }
+    bucket = { tokens: limit, updated: now };
+    rateLimitBuckets.set(key, bucket);
+  }
+  
+  bucket.tokens = Math.min(limit, bucket.tokens + (now - bucket.updated) * refillPerMs);
+  bucket.updated = now;
+  
+  const allowed = bucket.tokens >= 1;
+  if (allowed) {
+    bucket.tokens -= 1;
+  }
+  
+  return {
+    allowed,
+    limit,
+    remaining: Math.floor(bucket.tokens),
+    retryAfter: allowed ? 0 : Math.ceil((1 - bucket.tokens) / refillPerMs / 1000),
+    reset: Math.ceil((limit - bucket.tokens) / refillPerMs / 1000)
+  };
+}
+
+function pruneRateLimitBuckets(now, limit, refillPerMs) {
+  // 删除已回满的桶；仍然过多时整体清空
+  for (const [key, bucket] of rateLimitBuckets) {
+    if (bucket.tokens + (now - bucket.updated) * refillPerMs >= limit) {
+      rateLimitBuckets.delete(key);
+    }
+  }
+  if (rateLimitBuckets.size >= RATE_LIMIT_MAX_BUCKETS) {
+    rateLimitBuckets.clear();
+  }
+}
+
+function applyRateLimitHeaders(response, rateLimit) {
+  if (!rateLimit) {
+    return response;
+  }
+  
+  // 上游返回的响应头可能不可修改
+  let result = response;
+  try {
+    result.headers.set('X-RateLimit-Limit', String(rateLimit.limit));
+  } catch (error) {
+    result = new Response(response.body, response);
+  }
+  
+  result.headers.set('X-RateLimit-Limit', String(rateLimit.limit));
+  result.headers.set('X-RateLimit-Remaining', String(rateLimit.remaining));
+  result.headers.set('X-RateLimit-Reset', String(rateLimit.reset));
+  if (!rateLimit.allowed) {
+    result.headers.set('Retry-After', String(rateLimit.retryAfter));
+  }
+  return result;
+}
+
+// KV 调用计时：返回替换了 KV_NAMESPACE 的 env，耗时累加到 timing
+function withKVTiming(env, timing) {
+  const kv = env.KV_NAMESPACE;
+  if (!kv) {
+    return env;
+  }
+  
+  const timedKV = new Proxy(kv, {
+    get(target, prop) {
+      const value = target[prop];
+      if (typeof value !== 'function') {
+        return value;
+      }
+      return async (...args) => {
+        const started = Date.now();
+        try {
+          return await value.apply(target, args);
+        } finally {
+          timing.kv += Date.now() - started;
+          timing.kvOps += 1;
+        }
+      };
+    }
+  });
+  
+  return { ...env, KV_NAMESPACE: timedKV };
+}
+
+function applyServerTiming(response, timing, started) {
+  const value = `total;dur=${Date.now() - started}, kv;dur=${timing.kv};desc="${timing.kvOps} ops"`;
+  
+  // 上游返回的响应头可能不可修改
+  try {
+    response.headers.set('Server-Timing', value);
+    return response;
+  } catch (error) {
+    const result = new Response(response.body, response);
+    result.headers.set('Server-Timing', value);
+    return result;
+  }
+}
+
 function jsonResponse(data, status = 200) {
-  return new Response(JSON.stringify(data, null, 2), {
+  const body = JSON.stringify(data);
+  
+  return new Response(body, {
     status,
     headers: {
       'Content-Type': 'application/json',
       'Access-Control-Allow-Origin': '*',
-      'Cache-Control': 'no-cache'
+      'Cache-Control': 'no-cache',
+      'ETag': computeETag(body)
     }
   });
-}
\ No newline at end of file
+}
+
+// 弱ETag：响应体的 FNV-1a 哈希加长度
+function computeETag(body) {
+  let hash = 0x811c9dc5;
+  for (let i = 0; i < body.length; i++) {
+    hash ^= body.charCodeAt(i);
+    hash = Math.imul(hash, 0x01000193);
+  }
+  return `W/"${(hash >>> 0).toString(16)}-${body.length.toString(16)}"`;
+}
+
+// GET 请求的 If-None-Match 与响应 ETag 一致时返回 304
+function applyConditionalGet(request, response) {
+  return notModifiedResponse(request, response.status, response.headers) || response;
+}
+
+// If-None-Match 命中 headers 中的 ETag 时返回 304 响应，否则返回 null
+function notModifiedResponse(request, status, headers) {
+  const etag = headers.get('ETag');
+  const ifNoneMatch = request.headers.get('If-None-Match');
+  
+  if (request.method !== 'GET' || status !== 200 || !etag || !ifNoneMatch) {
+    return null;
+  }
+  
+  const candidates = ifNoneMatch.split(',').map(tag => tag.trim());
+  if (!candidates.includes(etag) && !candidates.includes('*')) {
+    return null;
+  }
+  
+  const notModifiedHeaders = {
+    'ETag': etag,
+    'Access-Control-Allow-Origin': '*',
+    'Cache-Control': 'no-cache'
+  };
+  if (headers.get('Vary')) {
+    notModifiedHeaders['Vary'] = headers.get('Vary');
+  }
+  return new Response(null, { status: 304, headers: notModifiedHeaders });
+}
+
+// 同一资源不同表示（JSON/MessagePack）使用不同的ETag：在引号内追加表示后缀
+function variantETag(etag, variant) {
+  if (!etag || !etag.endsWith('"')) {
+    return etag;
+  }
+  return `${etag.slice(0, -1)}-${variant}"`;
+}
+
+// ========== 响应编码协商 ==========
+
+const SERVER_FEATURES = ['fields', 'gzip', 'br', 'msgpack'];
+const MSGPACK_CONTENT_TYPE = 'application/msgpack';
+// 2.1.0 起的客户端才能解码 MessagePack
+const MSGPACK_MIN_CLIENT_VERSION = '2.1.0';
+// 小于此大小的响应不压缩
+const COMPRESSION_MIN_BYTES = 1024;
+
+// JSON 响应按 Accept 转为 MessagePack，按 Accept-Encoding 选择 br/gzip（由运行时按 Content-Encoding 压缩）
+async function negotiateResponseEncoding(request, response) {
+  const contentType = response.headers.get('Content-Type') || '';
+  if (!response.body || !contentType.startsWith('application/json')) {
+    return response;
+  }
+  
+  const headers = new Headers(response.headers);
+  headers.set('Vary', 'Accept, Accept-Encoding, X-Client-Version');
+  
+  // 先确定表示及其ETag，再判断条件请求，命中时无需编码响应体
+  const msgpack = acceptsMsgpack(request);
+  if (msgpack) {
+    headers.set('Content-Type', MSGPACK_CONTENT_TYPE);
+    headers.set('ETag', variantETag(headers.get('ETag'), 'msgpack'));
+  }
+  const notModified = notModifiedResponse(request, response.status, headers);
+  if (notModified) {
+    return notModified;
+  }
+  
+  let body;
+  if (msgpack) {
+    body = encodeMsgpack(await response.json());
+  } else {
+    body = new Uint8Array(await response.arrayBuffer());
+  }
+  
+  const encoding = body.byteLength >= COMPRESSION_MIN_BYTES
+    ? chooseContentEncoding(request.headers.get('Accept-Encoding'))
+    : null;
+  if (encoding) {
+    headers.set('Content-Encoding', encoding);
+  }
+  
+  return new Response(body, { status: response.status, statusText: response.statusText, headers });
+}
+
+function acceptsMsgpack(request) {
+  const accept = request.headers.get('Accept') || '';
+  const clientVersion = request.headers.get('X-Client-Version') || '0';
+  return accept.includes(MSGPACK_CONTENT_TYPE) && compareVersions(clientVersion, MSGPACK_MIN_CLIENT_VERSION) >= 0;
+}
+
+function chooseContentEncoding(acceptEncoding) {
+  if (!acceptEncoding) {
+    return null;
+  }
+  
+  const accepted = new Set();
+  for (const part of acceptEncoding.split(',')) {
+    const [coding, ...params] = part.trim().toLowerCase().split(';');
+    const q = params.map(p => p.trim()).find(p => p.startsWith('q='));
+    if (!q || parseFloat(q.slice(2)) > 0) {
+      accepted.add(coding.trim());
+    }
+  }
+  
+  for (const coding of ['br', 'gzip']) {
+    if (accepted.has(coding)) {
+      return coding;
+    }
+  }
+  return null;
+}
+
+function compareVersions(a, b) {
+  const left = String(a).split('.').map(n => parseInt(n, 10) || 0);
+  const right = String(b).split('.').map(n => parseInt(n, 10) || 0);
+  for (let i = 0; i < Math.max(left.length, right.length); i++) {
+    const diff = (left[i] || 0) - (right[i] || 0);
+    if (diff !== 0) {
+      return diff;
+    }
+  }
+  return 0;
+}
+
+// MessagePack 编码，只需覆盖 JSON 中的数据类型
+const textEncoder = new TextEncoder();
+
+function encodeMsgpack(value) {
+  const chunks = [];
+  let size = 0;
+  
+  const push = bytes => {
+    chunks.push(bytes);
+    size += bytes.length;
+  };
+  
+  const writeHeader = (type, length, bytes) => {
+    const buffer = new DataView(new ArrayBuffer(1 + bytes));
+    buffer.setUint8(0, type);
+    if (bytes === 1) {
+      buffer.setUint8(1, length);
+    } else if (bytes === 2) {
+      buffer.setUint16(1, length);
+    } else {
+      buffer.setUint32(1, length);
+    }
+    push(new Uint8Array(buffer.buffer));
+  };
+  
+  // 长度小于 fixLimit 时用紧凑格式，否则按长度选择 8/16/32 位格式（type8 为 null 表示没有 8 位格式）
+  const writeLength = (length, fixType, fixLimit, type8, type16, type32) => {
+    if (length < fixLimit) {
+      push(Uint8Array.of(fixType | length));
+    } else if (type8 !== null && length < 0x100) {
+      writeHeader(type8, length, 1);
+    } else if (length < 0x10000) {
+      writeHeader(type16, length, 2);
+    } else {
+      writeHeader(type32, length, 4);
+    }
+  };
+  
+  const writeWide = (type, setter, number) => {
+    const buffer = new DataView(new ArrayBuffer(9));
+    buffer.setUint8(0, type);
+    buffer[setter](1, setter === 'setFloat64' ? number : BigInt(number));
+    push(new Uint8Array(buffer.buffer));
+  };
+  
+  const writeNumber = number => {
+    if (!Number.isSafeInteger(number)) {
+      writeWide(0xcb, 'setFloat64', number);
+    } else if (number >= 0 && number < 0x80) {
+      push(Uint8Array.of(number));
+    } else if (number < 0 && number >= -0x20) {
+      push(Uint8Array.of(0xe0 | (number + 0x20)));
+    } else if (number < 0) {
+      writeWide(0xd3, 'setBigInt64', number);
+    } else if (number < 0x100) {
+      writeHeader(0xcc, number, 1);
+    } else if (number < 0x10000) {
+      writeHeader(0xcd, number, 2);
+    } else if (number < 0x100000000) {
+      writeHeader(0xce, number, 4);
+    } else {
+      writeWide(0xcf, 'setBigUint64', number);
+    }
+  };
+  
+  const writeString = string => {
+    const bytes = textEncoder.encode(string);
+    writeLength(bytes.length, 0xa0, 32, 0xd9, 0xda, 0xdb);
+    push(bytes);
+  };
+  
+  const write = item => {
+    if (item === null || item === undefined) {
+      push(Uint8Array.of(0xc0));
+    } else if (typeof item === 'boolean') {
+      push(Uint8Array.of(item ? 0xc3 : 0xc2));
+    } else if (typeof item === 'number') {
+      writeNumber(item);
+    } else if (typeof item === 'string') {
+      writeString(item);
+    } else if (Array.isArray(item)) {
+      writeLength(item.length, 0x90, 16, null, 0xdc, 0xdd);
+      item.forEach(write);
+    } else {
+      const entries = Object.entries(item);
+      writeLength(entries.length, 0x80, 16, null, 0xde, 0xdf);
+      for (const [key, entry] of entries) {
+        writeString(key);
+        write(entry);
+      }
+    }
+  };
+  
+  write(value);
+  
+  const result = new Uint8Array(size);
+  let offset = 0;
+  for (const chunk of chunks) {
+    result.set(chunk, offset);
+    offset += chunk.length;
+  }
+  return result;
+}